@@ -1,17 +1,94 @@
-import gradio as gr
-from langchain_google_genai import ChatGoogleGenerativeAI
-from PIL import Image
-import umd_rag
-import pineconing
-import my_utils
+import startup
+
+# Timings of every startup phase, see startup.py
+app_startup = startup.Startup()
+
+with app_startup.phase("import gradio"):
+    import gradio as gr
+    from fastapi import FastAPI
+    from fastapi.responses import JSONResponse, PlainTextResponse
+    import asyncio
+    import my_utils
+    import prompt_builder
+    import build_assets
+    import metrics
+    import coordinator
+    import os
+    import time
 
 """
 Initiate everything needed for the app (chatbot)
+Nothing heavy is loaded here: the vector storage, embedding model and Gemini
+client are only built on first use, or by the warm up thread once the server
+is listening (see the bottom of this file).
 """
-vdb = pineconing.VectorDB()
 google_model = "gemini-2.5-flash-lite"
-llm = ChatGoogleGenerativeAI(model=google_model)
-rag = umd_rag.UMDRAG(vdb, llm)
+
+# The scraped files that were upserted (DATA_FILES, see build_assets.py)
+data_files = build_assets.DATA_FILES
+
+# serve.py sets this to its pool of embedding worker processes, otherwise the model is loaded here
+embedding_model = None
+
+embedding_check = os.environ.get("EMBEDDING_CHECK", "fail")
+
+def load_vdb():
+    import pineconing
+    vector_db = pineconing.VectorDB(backend=os.environ.get("VECTOR_BACKEND", "pinecone"),
+                                    embedding_backend=os.environ.get("EMBEDDING_BACKEND", "torch"),
+                                    embedding_model=embedding_model,
+                                    # A non-torch backend is checked against the full model first ("fail", "warn" or "off")
+                                    check_embeddings=embedding_check if embedding_check != "off" else False,
+                                    # The workers already run queries side by side
+                                    batch_queries=embedding_model is None)
+    # Catch up on facts added/deleted outside the app, then build the keyword index
+    # for hybrid retrieval (both are kept up to date as facts are added/deleted)
+    vector_db.reconcile_own_data()
+    vector_db.build_keyword_index(data_files)
+    # Vectors only have slim metadata, their text comes from the local chunk store
+    vector_db.fill_chunk_store(data_files)
+    return vector_db
+
+def load_llm():
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(model=google_model)
+
+def load_rag():
+    import umd_rag
+    import semantic_cache
+    import context_selection
+    # Repeated text and the metadata lines are cut out of the prompt, see context_selection.py
+    selector = context_selection.ContextSelector(vdb.get(), max_context_tokens=int(os.environ.get("CONTEXT_TOKENS", 1500)))
+    return umd_rag.UMDRAG(vdb.get(), llm.get(), cache=semantic_cache.SemanticCache(), limiter=request_coordinator.limiter,
+                          context_selector=selector)
+
+# Thresholds can be tuned with benchmarks/relevance_report.py. Without RELEVANCE_ACCEPT / RELEVANCE_REJECT
+# nothing is accepted / rejected locally, those facts go to the LLM
+def load_relevance():
+    import relevance_filter
+    accept = os.environ.get("RELEVANCE_ACCEPT")
+    reject = os.environ.get("RELEVANCE_REJECT")
+    return relevance_filter.RelevanceFilter(vdb.get(), data_files,
+                                            accept_thresh=float(accept) if accept else None,
+                                            reject_thresh=float(reject) if reject else None,
+                                            duplicate_thresh=float(os.environ.get("RELEVANCE_DUPLICATE", 0.95)))
+
+"""
+Caps how many Gemini calls run at once and merges identical questions asked at
+the same time (see coordinator.py). Anything past LLM_CONCURRENCY running plus
+LLM_QUEUE waiting gets a "busy" reply right away.
+"""
+llm_concurrency = int(os.environ.get("LLM_CONCURRENCY", 8))
+llm_queue = int(os.environ.get("LLM_QUEUE", 16))
+request_coordinator = coordinator.RequestCoordinator(limit=llm_concurrency, max_waiting=llm_queue,
+                                                     timeout=float(os.environ.get("LLM_QUEUE_TIMEOUT", 10)))
+busy_message = "Sorry, a lot of people are asking questions right now. Please try again in a moment."
+
+vdb = startup.LazyResource("vector db", load_vdb, app_startup)
+llm = startup.LazyResource("llm", load_llm, app_startup)
+rag = startup.LazyResource("rag", load_rag, app_startup)
+relevance = startup.LazyResource("relevance filter", load_relevance, app_startup)
+sus_check_prompt = prompt_builder.CachedTextFile("datafiles/sus_check_prompt.txt")
 
 """
 This function checks whether the inputted info is related to sustainability at UMD:
@@ -24,45 +101,114 @@ Outpus:
     second str is the output message (whether yes or no)
 """
 def check_info(info: str):
-    prompt = my_utils.read_text_file("datafiles/sus_check_prompt.txt") + f"\n{info}"
-    llm_answer = llm.invoke(prompt).content
+    # The same fact sent twice at once is only checked (and added) once
+    try:
+        return request_coordinator.run(("check_info", coordinator.normalize_query(info)), lambda: check_fact(info))
+    except coordinator.Busy:
+        return info, busy_message
+
+def check_fact(info):
+    # Clear cases are decided locally, only unsure ones cost an LLM call
+    verdict = relevance.get().check(info)
+    if verdict["decision"] == "duplicate":
+        return "", f"Thanks, but that fact was already added ({verdict['duplicate_of']})."
+
+    if verdict["decision"] == "unsure":
+        prompt = sus_check_prompt.get() + f"\n{info}"
+        with request_coordinator.limiter.slot():
+            llm_answer = llm.get().invoke(prompt).content
+    else:
+        llm_answer = "yes" if verdict["decision"] == "accept" else "no"
 
     output = ""
     if llm_answer.lower() == 'yes':
         output = "Thank you! Your fact is valid and will be sent to the database!"
-        vdb.upsert_own_data(info)
+        # Written in the background, the user doesn't wait for the embedding/upsert
+        vdb.get().upsert_own_data(info, wait=False)
     else:
         output = "Sorry. Try to mention something related to sustainability at UMD."
 
     return "", output
 
-# Function when user wants to see added data
-def get_added_data():
-    ids = []
-    for v in vdb.index.list(namespace='own_data'):
-        ids.extend(v)
+added_data_page_size = 20
 
-    fr = vdb.index.fetch(ids=ids, namespace='own_data')
-    vectors = fr.vectors # dict
+"""
+Function when user wants to see added data. Reads one page from the local
+own data catalogue (newest first), not the vector store.
+Inputs:
+    search: only show facts containing this
+    page: page number (starts at 1)
+Outputs:
+    (str, int): the markdown list and the page actually shown
+"""
+def get_added_data(search="", page=1):
+    catalog = vdb.get().own_data
+    total = catalog.count(search)
+    pages = max(1, -(-total // added_data_page_size))
+    page = min(max(int(page), 1), pages)
 
     added_data = []
-    for key in sorted(vectors.keys()):
-        value = vectors[key]
-        added_data.append(f"ID: {key}, Info: {value.metadata['Content']}")
-    
-    return "- " + "\n- ".join(added_data) + "\n---"
+    for id, content in catalog.page(page, added_data_page_size, search):
+        added_data.append(f"ID: own_data_{id}, Info: {content}")
+
+    if not added_data:
+        return "No added data found.\n---", page
+    return "- " + "\n- ".join(added_data) + f"\n\nPage {page} of {pages} ({total} facts)\n---", page
+
+def previous_added_data(search, page):
+    return get_added_data(search, page - 1)
+
+def next_added_data(search, page):
+    return get_added_data(search, page + 1)
+
+def search_added_data(search):
+    return get_added_data(search, 1)
 
 # Function when user wants to delete some user added data
 def delete_added_data(id):
-    return "", vdb.delete_by_id(id, 'own_data')
+    return "", vdb.get().delete_by_id(id, 'own_data')
 
-# Chatbot function
-def gradio_response(message, chat_history):
-    response = rag.pipe(message, include_metadata=True, top_k=6, retrieval_thresh=0.5)
-    bot_message = response['answer'].content
+# Chatbot function, streams the answer into the chat as the model writes it
+async def gradio_response(message, chat_history):
     chat_history.append({"role": "user", "content": message})
-    chat_history.append({"role": "assistant", "content": bot_message})
-    return "", chat_history, response['metadata']
+    chat_history.append({"role": "assistant", "content": ""})
+    yield "", chat_history, []
+
+    # Only waits if the warm up hasn't finished yet
+    pipeline = await asyncio.to_thread(rag.get)
+    # People asking the same thing at the same time all get the one answer being streamed
+    parts = request_coordinator.stream(("chat", coordinator.normalize_query(message)),
+                            lambda: pipeline.astream(message, include_metadata=True, top_k=6, retrieval_thresh=0.5))
+    try:
+        async for part in parts:
+            chat_history[-1]["content"] += part['token']
+            yield "", chat_history, part['metadata']
+    except coordinator.Busy:
+        chat_history[-1]["content"] = busy_message
+        yield "", chat_history, []
+
+"""
+The diagram and intro texts are made ahead of time by build_assets.py.
+If that wasn't run, fall back to making them here.
+"""
+def load_intro_texts():
+    texts = build_assets.load_intro_texts()
+    if texts is None:
+        texts = {}
+        for name in build_assets.INTRO_TEXTS:
+            texts[name] = my_utils.read_text_file(build_assets.intro_file(name), False)
+    return texts
+
+def load_diagram():
+    if os.path.exists(build_assets.DIAGRAM_SMALL):
+        return build_assets.DIAGRAM_SMALL
+    return build_assets.resize_diagram()
+
+with app_startup.phase("static assets"):
+    intro_texts = load_intro_texts()
+    diagram = load_diagram()
+
+ui_start = time.perf_counter()
 
 # Theme
 theme = gr.themes.Glass(
@@ -89,7 +235,7 @@ with gr.Blocks(theme=theme) as demo:
     
     # Chatbot Tab
     with gr.Tab("Chatbot"):
-        gr.Markdown(my_utils.read_text_file('datafiles/intro_texts/chatbot_intro.txt', False))
+        gr.Markdown(intro_texts['chatbot_intro'])
 
         # Layout
         with gr.Row():
@@ -120,15 +266,17 @@ with gr.Blocks(theme=theme) as demo:
 
                     for idx, item in enumerate(retrievals[0:3]):
                         item_id = item.get("id", "N/A")
-                        score = round(item.get("score", 0), 4)
+                        # Chunks only the keyword search found have no similarity score
+                        score = round(item["score"], 4) if item.get("score") is not None else "keyword match"
                         content = item.get("metadata", {}).get("Content", "")
                         
                         preview = content[:150] + "..." if len(content) > 150 else content
                         
                         with gr.Accordion(f"{idx+1}. ID: {item_id} | Score: {score}"):
                             if item['namespace'] != 'own_data':
-                                link = item.get("metadata", {}).get("Link", "#")
-                                gr.Markdown(f"🔗 Link: {link}")
+                                # Merged duplicate chunks (see dedup.py) have every page they were on
+                                links = item.get("metadata", {}).get("Links") or [item.get("metadata", {}).get("Link", "#")]
+                                gr.Markdown("🔗 Link: " + ", ".join(links))
                             else:
                                 gr.Markdown("User entered data:")
                             gr.Markdown(f"**Content Preview:** {preview}")
@@ -139,40 +287,37 @@ with gr.Blocks(theme=theme) as demo:
     with gr.Tab("Introduction"):
 
         # Welcome (Intro)
-        gr.Markdown(my_utils.read_text_file('datafiles/intro_texts/intro.txt', False))
+        gr.Markdown(intro_texts['intro'])
 
         # Nav and Notes
         with gr.Row():
-            gr.Markdown(my_utils.read_text_file('datafiles/intro_texts/intro_nav.txt', False))
-            gr.Markdown(my_utils.read_text_file('datafiles/intro_texts/intro_notes.txt', False))
+            gr.Markdown(intro_texts['intro_nav'])
+            gr.Markdown(intro_texts['intro_notes'])
         gr.Markdown("---")
 
         # Tools and Stats
         with gr.Row():
-            gr.Markdown(my_utils.read_text_file('datafiles/intro_texts/intro_tools.txt', False))
-            gr.Markdown(my_utils.read_text_file('datafiles/intro_texts/intro_stats.txt', False))
+            gr.Markdown(intro_texts['intro_tools'])
+            gr.Markdown(intro_texts['intro_stats'])
         gr.Markdown("---")
 
         # How and Image
         with gr.Row():
-            gr.Markdown(my_utils.read_text_file('datafiles/intro_texts/intro_how.txt', False))
-            diagram = Image.open('datafiles/RAG_Pipeline.jpg')
-            width, height = diagram.size
-            diagram = diagram.resize((width // 4, height // 4))
+            gr.Markdown(intro_texts['intro_how'])
             gr.Image(diagram)
         gr.Markdown("---")
 
         # About
         with gr.Row():
-            gr.Markdown(my_utils.read_text_file('datafiles/intro_texts/intro_about.txt', False))
+            gr.Markdown(intro_texts['intro_about'])
         gr.Markdown("---")
 
         # Contact
-        gr.Markdown(my_utils.read_text_file('datafiles/intro_texts/intro_contact.txt', False))
+        gr.Markdown(intro_texts['intro_contact'])
            
     # Enter own facts tab
     with gr.Tab("Enter Your Own Facts!"):
-        gr.Markdown(my_utils.read_text_file('datafiles/intro_texts/own_data_intro.txt', False))
+        gr.Markdown(intro_texts['own_data_intro'])
 
         fact = gr.Textbox(
             placeholder="Enter Fact Here!",
@@ -182,8 +327,16 @@ with gr.Blocks(theme=theme) as demo:
         fact.submit(fn=check_info, inputs=fact, outputs=[fact, added_output], api_name="check_info")
         
         with gr.Accordion("See all added data (Click again to reload):", open=False) as accordion:
+            added_search = gr.Textbox(placeholder="Search added data", show_label=False)
             added_data = gr.Markdown(show_label=False)
-            gr.Markdown(my_utils.read_text_file('datafiles/intro_texts/own_data_delete.txt', False))
+            added_page = gr.State(1)
+            with gr.Row():
+                previous_page = gr.Button("Previous")
+                next_page = gr.Button("Next")
+            added_search.submit(fn=search_added_data, inputs=added_search, outputs=[added_data, added_page])
+            previous_page.click(fn=previous_added_data, inputs=[added_search, added_page], outputs=[added_data, added_page])
+            next_page.click(fn=next_added_data, inputs=[added_search, added_page], outputs=[added_data, added_page])
+            gr.Markdown(intro_texts['own_data_delete'])
             wrong = gr.Textbox(
                 placeholder="Enter ID number here",
                 label="Delete:",
@@ -191,6 +344,68 @@ with gr.Blocks(theme=theme) as demo:
             )
             deleted_output = gr.Markdown(show_label=False)
             wrong.submit(fn=delete_added_data, inputs=wrong, outputs=[wrong, deleted_output])
-        accordion.expand(fn=get_added_data, outputs=added_data)
-        
-demo.launch(debug=True)
\ No newline at end of file
+        accordion.expand(fn=get_added_data, inputs=[added_search, added_page], outputs=[added_data, added_page])
+
+app_startup.record("build ui", time.perf_counter() - ui_start)
+
+# Numbers that are read only when /metrics is scraped
+metrics.registry.gauge("app_ready", "1 once everything is loaded", lambda: app_startup.ready.is_set())
+metrics.registry.gauge("embedding_cache_hit_rate", "Share of chunk embeddings that came from the cache",
+                       lambda: vdb.value.embedding_cache.hit_rate())
+metrics.registry.gauge("semantic_cache_entries", "Answers in the semantic cache",
+                       lambda: rag.value.cache.stats()["entries"])
+metrics.registry.gauge("llm_in_flight", "Gemini calls running right now", request_coordinator.limiter.in_use)
+metrics.registry.gauge("llm_queue_depth", "Gemini calls waiting for a free slot", request_coordinator.limiter.depth)
+metrics.registry.gauge("prompt_truncated_total", "Prompts that had context cut to fit the token budget",
+                       lambda: rag.value.prompt_builder.stats()["truncated_prompts"])
+
+"""
+Serve gradio inside a FastAPI app so there are extra endpoints:
+    /ready   200 once everything is loaded, 503 before that
+    /startup how long every startup phase took
+    /metrics stage timings, chunk counts, prompt sizes and cache hits
+             in the Prometheus text format (see metrics.py)
+    /workers health of the embedding worker processes (when run with serve.py)
+"""
+server = FastAPI()
+
+@server.get("/ready")
+def ready():
+    report = app_startup.report()
+    return JSONResponse(report, status_code=200 if report["ready"] else 503)
+
+@server.get("/startup")
+def startup_report():
+    return app_startup.report()
+
+@server.get("/metrics")
+def metrics_report():
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+@server.get("/workers")
+def workers_report():
+    if embedding_model is None:
+        return {"workers": [], "healthy": True}
+    report = embedding_model.health()
+    return JSONResponse(report, status_code=200 if report["healthy"] else 503)
+
+"""
+Gradio runs as many chats at once as the coordinator can hold (running plus
+waiting), so the coordinator decides who waits and who gets "busy". Cached and
+coalesced answers don't take an LLM slot, so they never wait behind the others.
+"""
+demo.queue(default_concurrency_limit=llm_concurrency + llm_queue, max_size=2 * (llm_concurrency + llm_queue))
+
+server = gr.mount_gradio_app(server, demo, path="/")
+
+def run_server():
+    import uvicorn
+
+    app_startup.record("before server start", time.perf_counter() - app_startup.created)
+    app_startup.warm([vdb, llm, rag, relevance])
+    uvicorn.run(server,
+                host=os.environ.get("GRADIO_SERVER_NAME", "127.0.0.1"),
+                port=int(os.environ.get("GRADIO_SERVER_PORT", 7860)))
+
+if __name__ == "__main__":
+    run_server()
@@ -0,0 +1,75 @@
+"""
+Compares the approximate IVFBackend against exact search (LocalBackend) on
+synthetic clustered vectors: recall@k and p50/p99 query latency.
+
+Usage (from the repo root):
+    python benchmarks/ann_benchmark.py [--sizes 10000 100000 1000000] [--nprobe 4 8 16]
+
+1M vectors of 384 floats is about 1.5GB, so make sure the machine has the memory.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from vector_backends import LocalBackend, IVFBackend
+
+DIM = 384
+
+# Vectors around a bunch of random topics, closer to real embeddings than pure noise
+def make_vectors(n, rng, topics=200):
+    centers = rng.standard_normal((topics, DIM)).astype(np.float32)
+    labels = rng.integers(0, topics, n)
+    return centers[labels] + 0.6 * rng.standard_normal((n, DIM)).astype(np.float32)
+
+def fill(backend, vectors):
+    batch = 50000
+    for start in range(0, len(vectors), batch):
+        backend.upsert([{"id": str(start + i), "values": v} for i, v in enumerate(vectors[start:start + batch])], "file_data")
+
+def time_queries(backend, queries, top_k):
+    latencies = []
+    results = []
+    for q in queries:
+        start = time.perf_counter()
+        results.append({m["id"] for m in backend.query(q, top_k, ["file_data"])})
+        latencies.append((time.perf_counter() - start) * 1000)
+    return results, np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+def run(n, nprobes, top_k, num_queries, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = make_vectors(n, rng)
+    queries = make_vectors(num_queries, rng)
+
+    with tempfile.TemporaryDirectory() as folder:
+        exact = LocalBackend(os.path.join(folder, "exact"), dim=DIM)
+        fill(exact, vectors)
+        truth, p50, p99 = time_queries(exact, queries, top_k)
+        print(f"n={n:>8} exact        recall@{top_k}=1.000  p50={p50:7.3f}ms  p99={p99:7.3f}ms")
+        del exact
+
+        start = time.perf_counter()
+        ivf = IVFBackend(os.path.join(folder, "ivf"), dim=DIM)
+        fill(ivf, vectors)
+        print(f"n={n:>8} ivf build {time.perf_counter() - start:.1f}s, nlist={len(ivf.namespaces['file_data']['centroids'])}")
+
+        for nprobe in nprobes:
+            ivf.nprobe = nprobe
+            found, p50, p99 = time_queries(ivf, queries, top_k)
+            recall = np.mean([len(f & t) / len(t) for f, t in zip(found, truth)])
+            print(f"n={n:>8} ivf nprobe={nprobe:<3} recall@{top_k}={recall:.3f}  p50={p50:7.3f}ms  p99={p99:7.3f}ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32])
+    parser.add_argument("--top_k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    for n in args.sizes:
+        run(n, args.nprobe, args.top_k, args.queries)
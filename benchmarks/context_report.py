@@ -0,0 +1,131 @@
+"""
+What context selection (context_selection.py) does to the prompts of the
+labelled questions in datafiles/eval_queries.json:
+- prompt tokens with every retrieved chunk vs the selected context
+- how long selecting takes
+- how many questions still have a relevant page in the prompt (so trimming
+  doesn't throw away the answer)
+- with --llm gemini, Gemini's generation latency for both prompts (needs
+  GOOGLE_API_KEY), otherwise only the prompt side is measured
+
+Runs on a temporary local index so nothing real is touched.
+
+Usage (from the repo root):
+    python benchmarks/context_report.py [--max_context_tokens 1500] [--embedding torch] [--llm gemini]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+import pineconing
+from context_selection import ContextSelector
+from prompt_builder import PromptBuilder
+from umd_rag import UMDRAG
+
+DATA_FILES = ["datafiles/umd_sustainability_data.json", "datafiles/umd_sustainingprogress_data.json"]
+
+def has_relevant(context, relevant):
+    links = set()
+    for match in context:
+        links.update(match["metadata"].get("Links") or [match["metadata"].get("Link")])
+    return bool(links & set(relevant))
+
+def generation_ms(llm, prompt):
+    start = time.perf_counter()
+    llm.invoke(prompt)
+    return (time.perf_counter() - start) * 1000
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", default="datafiles/eval_queries.json")
+    parser.add_argument("--files", nargs="+", default=DATA_FILES)
+    parser.add_argument("--embedding", default="torch", help="embedding backend, see embedding_backends.py")
+    parser.add_argument("--top_k", type=int, default=6)
+    parser.add_argument("--retrieval_thresh", type=float, default=0.5)
+    parser.add_argument("--max_context_tokens", type=int, default=1500)
+    parser.add_argument("--mmr_lambda", type=float, default=0.7)
+    parser.add_argument("--llm", choices=["none", "gemini"], default="none")
+    parser.add_argument("--output", help="also save the numbers as json")
+    args = parser.parse_args()
+
+    with open(args.queries) as f:
+        queries = json.load(f)
+
+    llm = None
+    if args.llm == "gemini":
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        from dotenv import load_dotenv
+
+        load_dotenv(override=True)
+        llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash-lite")
+
+    with tempfile.TemporaryDirectory() as folder:
+        vdb = pineconing.VectorDB(backend="local", backend_options={"folder": folder}, batch_queries=False,
+                                  embedding_backend=args.embedding, own_data_file=os.path.join(folder, "own_data.sqlite"),
+                                  chunk_store_folder=os.path.join(folder, "chunk_store"),
+                                  embedding_cache_folder=os.path.join(folder, "embedding_cache"))
+        vdb.upsert_files(args.files)
+        vdb.build_keyword_index(args.files)
+
+        selector = ContextSelector(vdb, max_context_tokens=args.max_context_tokens, mmr_lambda=args.mmr_lambda)
+        # With a selector, retrieve keeps the search's vectors for it (like the app)
+        rag = UMDRAG(vdb, None, context_selector=selector)
+        builder = PromptBuilder()
+
+        rows = []
+        for q in queries:
+            retrieval = rag.retrieve(q["query"], args.top_k, args.retrieval_thresh)
+            start = time.perf_counter()
+            context = selector.select(retrieval, q["query"])
+            select_ms = (time.perf_counter() - start) * 1000
+
+            before = builder.build(retrieval, q["query"])
+            after = builder.build(context, q["query"])
+            row = {
+                "query": q["query"],
+                "chunks_before": len(retrieval), "chunks_after": len(context),
+                "tokens_before": builder.count_tokens(before), "tokens_after": builder.count_tokens(after),
+                "select_ms": select_ms,
+                "relevant_before": has_relevant(retrieval, q["relevant_links"]),
+                "relevant_after": has_relevant(context, q["relevant_links"]),
+            }
+            if llm is not None:
+                row["generate_ms_before"] = generation_ms(llm, before)
+                row["generate_ms_after"] = generation_ms(llm, after)
+            rows.append(row)
+
+    n = len(rows)
+    before = np.array([r["tokens_before"] for r in rows])
+    after = np.array([r["tokens_after"] for r in rows])
+    print(f"Questions: {n}, token budget for the context: {args.max_context_tokens}")
+    print(f"Prompt tokens   before: mean {before.mean():.0f}  max {before.max()}   "
+          f"after: mean {after.mean():.0f}  max {after.max()}   ({1 - after.sum() / before.sum():.1%} fewer)")
+    print(f"Chunks in prompt  before: {np.mean([r['chunks_before'] for r in rows]):.1f}  "
+          f"after: {np.mean([r['chunks_after'] for r in rows]):.1f}")
+    print(f"Selection time  p50 {np.percentile([r['select_ms'] for r in rows], 50):.2f}ms  "
+          f"p99 {np.percentile([r['select_ms'] for r in rows], 99):.2f}ms")
+    print(f"Relevant page in the prompt  before: {sum(r['relevant_before'] for r in rows)}/{n}  "
+          f"after: {sum(r['relevant_after'] for r in rows)}/{n}")
+
+    if llm is not None:
+        for key in ("before", "after"):
+            times = [r[f"generate_ms_{key}"] for r in rows]
+            print(f"Generation {key:<6} p50 {np.percentile(times, 50):.0f}ms  mean {np.mean(times):.0f}ms")
+    else:
+        print("Generation latency not measured (run with --llm gemini)")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"args": vars(args), "rows": rows}, f, indent=2)
+    return rows
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Compares the embedding backends in embedding_backends.py on our own chunks:
+- query latency (one text at a time, p50/p99)
+- throughput (chunks/sec embedding in batches)
+- resident memory after loading the model and embedding
+- lowest cosine similarity to the full precision "torch" model
+
+Every backend runs in its own process so the memory numbers don't mix.
+
+Usage (from the repo root):
+    python benchmarks/embedding_benchmark.py [--backends torch torch-int8 onnx onnx-int8]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import my_utils
+
+def sample_texts(n):
+    return [d['Content'] for d in my_utils.iter_records(os.path.join(ROOT, "datafiles/umd_sustainability_data.json"))][:n]
+
+# Runs inside the child process, prints one json line
+def measure(backend, num_texts, num_queries):
+    import psutil
+    import embedding_backends
+
+    process = psutil.Process()
+    rss_before = process.memory_info().rss
+
+    start = time.perf_counter()
+    model = embedding_backends.load_embedding_model(backend)
+    load_seconds = time.perf_counter() - start
+
+    texts = sample_texts(num_texts)
+    model.encode_document(texts[:8])  # warm up
+
+    latencies = []
+    for text in texts[:num_queries]:
+        start = time.perf_counter()
+        model.encode_query(text[:200])
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    embeddings = model.encode_document(texts, batch_size=64)
+    throughput = len(texts) / (time.perf_counter() - start)
+
+    np.save(os.path.join(ROOT, f"benchmarks/.embeddings_{backend}.npy"), np.asarray(embeddings, dtype=np.float32))
+    print(json.dumps({
+        "backend": backend,
+        "load_seconds": load_seconds,
+        "query_p50_ms": float(np.percentile(latencies, 50)),
+        "query_p99_ms": float(np.percentile(latencies, 99)),
+        "docs_per_sec": throughput,
+        "rss_mb": (process.memory_info().rss - rss_before) / 2**20,
+    }))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backends", nargs="+", default=["torch", "torch-int8", "onnx", "onnx-int8"])
+    parser.add_argument("--texts", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        measure(args.child, args.texts, args.queries)
+        return
+
+    backends = args.backends if "torch" in args.backends else ["torch"] + args.backends
+    results = []
+    for backend in backends:
+        out = subprocess.run([sys.executable, __file__, "--child", backend, "--texts", str(args.texts), "--queries", str(args.queries)],
+                             capture_output=True, text=True, cwd=ROOT)
+        lines = [line for line in out.stdout.splitlines() if line.startswith("{")]
+        if out.returncode != 0 or not lines:
+            print(f"{backend}: failed\n{out.stderr[-2000:]}")
+            continue
+        results.append(json.loads(lines[-1]))
+
+    reference = np.load(os.path.join(ROOT, "benchmarks/.embeddings_torch.npy"))
+    print(f"{'backend':<12}{'load s':>8}{'p50 ms':>9}{'p99 ms':>9}{'docs/s':>9}{'RSS MB':>9}{'min cos':>9}")
+    for r in results:
+        file = os.path.join(ROOT, f"benchmarks/.embeddings_{r['backend']}.npy")
+        emb = np.load(file)
+        cos = np.sum(emb * reference, axis=1) / (np.linalg.norm(emb, axis=1) * np.linalg.norm(reference, axis=1))
+        print(f"{r['backend']:<12}{r['load_seconds']:>8.2f}{r['query_p50_ms']:>9.2f}{r['query_p99_ms']:>9.2f}"
+              f"{r['docs_per_sec']:>9.1f}{r['rss_mb']:>9.1f}{cos.min():>9.4f}")
+    for r in results:
+        os.remove(os.path.join(ROOT, f"benchmarks/.embeddings_{r['backend']}.npy"))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Checks the single pass extract_content against the original five-sweep
+extractors (extract_content_legacy) on saved HTML pages, for every parser
+that is installed, and times both.
+
+Usage (from the repo root):
+    python benchmarks/extraction_check.py [folder with saved .html pages]
+Without a folder it runs on the pages in benchmarks/fixtures/pages/ (small
+pages in the site's section markup: main content, text and image sections,
+an accordion, a card group and a slideshow).
+
+To save some pages first:
+    python benchmarks/extraction_check.py <folder> --save https://sustainability.umd.edu/
+"""
+import glob
+import os
+import sys
+import time
+
+import requests
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import umd_webscraper
+
+PARSERS = ["html.parser", "lxml"]
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "pages")
+
+def save_pages(folder, url, limit=50):
+    os.makedirs(folder, exist_ok=True)
+    scraper = umd_webscraper.UMDWebScraper(url)
+    for i, (link, _) in enumerate(scraper.iter_crawl(url)):
+        if i >= limit:
+            break
+        html = requests.get(link, timeout=10).text
+        with open(os.path.join(folder, f"page_{i}.html"), "w", encoding="utf-8") as f:
+            f.write(html)
+
+def check(folder, repeat=5):
+    files = sorted(glob.glob(os.path.join(folder, "*.html")))
+    print(f"{len(files)} pages")
+
+    for parser in PARSERS:
+        try:
+            BeautifulSoup("<p></p>", parser)
+        except Exception:
+            print(f"{parser}: not installed, skipping")
+            continue
+
+        scraper = umd_webscraper.UMDWebScraper("", parser=parser)
+        mismatches = 0
+        chunks = 0
+        parse_time = single_time = legacy_time = 0
+        for file in files:
+            with open(file, "r", encoding="utf-8") as f:
+                html = f.read()
+
+            for _ in range(repeat):
+                start = time.perf_counter()
+                soup = BeautifulSoup(html, parser)
+                parse_time += time.perf_counter() - start
+            template = scraper.make_page_template(soup, file)
+
+            start = time.perf_counter()
+            for _ in range(repeat):
+                single = scraper.extract_content(soup, template)
+            single_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            for _ in range(repeat):
+                legacy = scraper.extract_content_legacy(soup, template)
+            legacy_time += time.perf_counter() - start
+
+            chunks += len(single)
+            if single != legacy:
+                mismatches += 1
+                print(f"{parser}: output differs on {file}")
+
+        runs = len(files) * repeat
+        print(f"{parser}: {chunks} chunks, {mismatches} mismatches | per page: parse {parse_time / runs * 1000:.2f}ms | "
+              f"single pass {single_time / runs * 1000:.2f}ms | legacy {legacy_time / runs * 1000:.2f}ms "
+              f"({legacy_time / single_time if single_time else 0:.1f}x)")
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[2] == "--save":
+        save_pages(sys.argv[1], sys.argv[3])
+    check(sys.argv[1] if len(sys.argv) > 1 else FIXTURES)
@@ -0,0 +1,94 @@
+"""
+Stress test for adding user facts (VectorDB.upsert_own_data). Runs offline on
+a temporary local index, catalogue and the "hashing" embedding stand-in.
+
+1. Many threads submit facts as fast as they can (like lots of people on the
+   "Enter Your Own Facts!" tab at once), then it checks that every fact got
+   its own id, is in the catalogue and in the vector store with its own text.
+2. Several processes take ids from the same SQLite catalogue at the same
+   time and it checks that no id was handed out twice.
+
+Usage (from the repo root):
+    python benchmarks/own_data_stress.py [--threads 32] [--facts 200] [--processes 4]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+from own_data_catalog import OwnDataCatalog
+
+def thread_test(folder, threads, facts):
+    import pineconing
+
+    vdb = pineconing.VectorDB(backend="local", backend_options={"folder": os.path.join(folder, "index")},
+                              batch_queries=False, embedding_backend="hashing",
+                              own_data_file=os.path.join(folder, "threads.sqlite"),
+                              chunk_store_folder=os.path.join(folder, "chunk_store"),
+                              embedding_cache_folder=os.path.join(folder, "embedding_cache"))
+
+    def submit(worker):
+        return [(vdb.upsert_own_data(f"fact {i} from worker {worker}", wait=False), f"fact {i} from worker {worker}")
+                for i in range(facts)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        submitted = [pair for pairs in pool.map(submit, range(threads)) for pair in pairs]
+    submit_seconds = time.perf_counter() - start
+    vdb.own_data_writer.flush()
+    total_seconds = time.perf_counter() - start
+
+    expected = threads * facts
+    ids = [id for id, _ in submitted]
+    stored = vdb.fetch([f"own_data_{id}" for id in ids], namespace="own_data")
+    wrong_text = [id for id, text in submitted if stored.get(f"own_data_{id}", {}).get("metadata", {}).get("Content") != text]
+
+    print(f"Threads: {threads} x {facts} facts, submitted in {submit_seconds:.2f}s, all written after {total_seconds:.2f}s "
+          f"({expected / total_seconds:.0f} facts/sec)")
+    print(f"  duplicate ids: {len(ids) - len(set(ids))}")
+    print(f"  in catalogue: {len(vdb.own_data)}/{expected}, pending: {len(vdb.own_data.pending())}")
+    print(f"  in vector store: {len(stored)}/{expected}, wrong text: {len(wrong_text)}")
+    print(f"  writer: {vdb.own_data_writer.stats()}")
+    return len(set(ids)) == expected and len(stored) == expected and not wrong_text and not vdb.own_data.pending()
+
+def allocate(args):
+    file, count = args
+    catalog = OwnDataCatalog(file, id_count_file="")
+    return [catalog.add_pending(f"fact {i} from process {os.getpid()}") for i in range(count)]
+
+def process_test(folder, processes, facts):
+    file = os.path.join(folder, "processes.sqlite")
+    OwnDataCatalog(file, id_count_file="")
+
+    start = time.perf_counter()
+    with multiprocessing.Pool(processes) as pool:
+        ids = [id for chunk in pool.map(allocate, [(file, facts)] * processes) for id in chunk]
+    seconds = time.perf_counter() - start
+
+    rows = len(OwnDataCatalog(file, id_count_file="").ids())
+    print(f"Processes: {processes} x {facts} ids in {seconds:.2f}s, duplicate ids: {len(ids) - len(set(ids))}, "
+          f"rows: {rows}/{processes * facts}")
+    return len(set(ids)) == len(ids) == rows
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--facts", type=int, default=200, help="facts per thread / process")
+    parser.add_argument("--processes", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        ok = thread_test(folder, args.threads, args.facts)
+        ok = process_test(folder, args.processes, args.facts) and ok
+
+    print("OK: no lost or duplicated facts" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
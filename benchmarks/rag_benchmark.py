@@ -0,0 +1,214 @@
+"""
+End to end benchmark of the RAG pipeline, runs offline:
+- vectors live in a temporary local index (LocalBackend) instead of pinecone
+- the LLM is a FakeStreamingLLM (fake_llm.py) with a fixed delay
+- with --embedding hashing the embedding model is a stand-in too, so nothing
+  has to be downloaded (use torch to measure the real model)
+
+The questions in datafiles/eval_queries.json go through every stage:
+    search:  VectorDB.search
+    retrieve: UMDRAG.retrieve (dense + keyword)
+    prompt:  UMDRAG.create_prompt
+    pipe:    UMDRAG.pipe (everything, with the fake LLM)
+and it reports p50/p95/p99 latency per stage, pipe throughput at a few
+concurrency levels, and memory. The corpus can be scaled up synthetically
+(--scales 1 10 100): copies of every chunk get slightly jittered vectors.
+
+Results are saved as json in benchmarks/results/ (named after the commit), and
+--compare old.json prints how much every number changed.
+
+Usage (from the repo root):
+    python benchmarks/rag_benchmark.py [--embedding hashing] [--scales 1 10] [--concurrency 1 4 16] [--compare benchmarks/results/<file>.json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+import my_utils
+import pineconing
+from bm25 import BM25Index
+from fake_llm import FakeStreamingLLM
+from umd_rag import UMDRAG
+
+DATA_FILES = ["datafiles/umd_sustainability_data.json", "datafiles/umd_sustainingprogress_data.json"]
+RESULTS_FOLDER = "benchmarks/results"
+
+def percentiles(latencies):
+    latencies = np.asarray(latencies) * 1000
+    return {"p50_ms": float(np.percentile(latencies, 50)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+            "mean_ms": float(latencies.mean())}
+
+def rss_mb():
+    import psutil
+    return psutil.Process().memory_info().rss / 2**20
+
+"""
+VectorDB on a local index in folder, filled with the scraped chunks scale times.
+Copy n of a chunk gets id "<id>_x<n>" and its vector plus a little noise, so
+search does scale times the work without embedding scale times as much text.
+"""
+def build_vdb(folder, scale, embedding, seed=0):
+    vdb = pineconing.VectorDB(backend="local", backend_options={"folder": folder},
+                              batch_queries=False, embedding_backend=embedding,
+                              own_data_file=os.path.join(folder, "own_data.sqlite"),
+                              chunk_store_folder=os.path.join(folder, "chunk_store"),
+                              embedding_cache_folder=os.path.join(folder, "embedding_cache"))
+    vdb.keyword_index = BM25Index()
+    # Every question should really be embedded, not come from the query LRU
+    vdb.embedding_cache.query_cache_size = 0
+
+    rng = np.random.default_rng(seed)
+    vectors = []
+    for file in DATA_FILES:
+        fname = pineconing.get_file_name(file)
+        page_counts = {}
+        for batch in my_utils.iter_batches(my_utils.iter_records(file), 256):
+            vectors.extend(vdb.to_vectors(fname, batch, page_counts))
+
+    copies = []
+    for copy in range(1, scale):
+        noise = 0.05 * rng.standard_normal((len(vectors), vdb.embedding_model.get_sentence_embedding_dimension())).astype(np.float32)
+        copies.extend({"id": f"{v['id']}_x{copy}", "values": v["values"] + noise[i], "metadata": v["metadata"]}
+                      for i, v in enumerate(vectors))
+
+    # One upsert, the local index saves itself after every upsert
+    vdb.upsert(vectors + copies, "file_data")
+    return vdb
+
+def time_stage(queries, run, repeats):
+    latencies = []
+    for _ in range(repeats):
+        for query in queries:
+            start = time.perf_counter()
+            run(query)
+            latencies.append(time.perf_counter() - start)
+    return percentiles(latencies)
+
+def throughput(rag, queries, concurrency, requests, top_k, thresh):
+    def one(i):
+        start = time.perf_counter()
+        rag.pipe(queries[i % len(queries)], top_k=top_k, retrieval_thresh=thresh)
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        latencies = list(pool.map(one, range(requests)))
+        total = time.perf_counter() - start
+    return dict(percentiles(latencies), concurrency=concurrency, queries_per_sec=requests / total)
+
+def run_scale(scale, queries, args):
+    result = {"scale": scale}
+    with tempfile.TemporaryDirectory() as folder:
+        rss_before = rss_mb()
+        start = time.perf_counter()
+        vdb = build_vdb(folder, scale, args.embedding)
+        result["chunks"] = len(vdb.keyword_index)
+        result["build_seconds"] = time.perf_counter() - start
+        result["index_rss_mb"] = rss_mb() - rss_before
+
+        llm = FakeStreamingLLM(answer="This is a benchmark answer. " * 20, first_token_delay=args.llm_delay)
+        rag = UMDRAG(vdb, llm)
+        top_k, thresh = args.top_k, args.retrieval_thresh
+
+        # Warm up (model, numpy, prompt file)
+        for query in queries:
+            rag.pipe(query, top_k=top_k, retrieval_thresh=thresh)
+
+        retrievals = {query: rag.retrieve(query, top_k, thresh) for query in queries}
+        result["latency"] = {
+            "search": time_stage(queries, lambda q: vdb.search(q, top_k), args.repeats),
+            "retrieve": time_stage(queries, lambda q: rag.retrieve(q, top_k, thresh), args.repeats),
+            "prompt": time_stage(queries, lambda q: rag.create_prompt(retrievals[q], q), args.repeats),
+            "pipe": time_stage(queries, lambda q: rag.pipe(q, top_k=top_k, retrieval_thresh=thresh), args.repeats),
+        }
+        result["throughput"] = [throughput(rag, queries, c, args.requests, top_k, thresh) for c in args.concurrency]
+
+        # Peak python memory (numpy included) while answering every question once
+        tracemalloc.start()
+        for query in queries:
+            rag.pipe(query, top_k=top_k, retrieval_thresh=thresh)
+        result["query_peak_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+        result["rss_mb"] = rss_mb()
+
+    print_scale(result)
+    return result
+
+def print_scale(result):
+    print(f"\nscale {result['scale']}x: {result['chunks']} chunks, built in {result['build_seconds']:.1f}s, "
+          f"index ~{result['index_rss_mb']:.0f}MB, rss {result['rss_mb']:.0f}MB, query peak {result['query_peak_mb']:.1f}MB")
+    for stage, s in result["latency"].items():
+        print(f"  {stage:<9} p50 {s['p50_ms']:8.2f}ms  p95 {s['p95_ms']:8.2f}ms  p99 {s['p99_ms']:8.2f}ms")
+    for t in result["throughput"]:
+        print(f"  concurrency {t['concurrency']:>3}: {t['queries_per_sec']:7.1f} queries/sec  p99 {t['p99_ms']:8.2f}ms")
+
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=ROOT).stdout.strip() or "unknown"
+    except OSError:
+        return "unknown"
+
+# Prints new / old for every latency and throughput number both runs have
+def compare(results, old_file):
+    with open(old_file) as f:
+        old = {r["scale"]: r for r in json.load(f)["scales"]}
+
+    print(f"\nCompared to {old_file} (new / old, latency > 1 is slower, throughput > 1 is faster):")
+    for result in results:
+        before = old.get(result["scale"])
+        if before is None:
+            continue
+        for stage, s in result["latency"].items():
+            if stage in before["latency"]:
+                b = before["latency"][stage]
+                print(f"  {result['scale']}x {stage:<9} p50 {s['p50_ms'] / b['p50_ms']:.2f}  p99 {s['p99_ms'] / b['p99_ms']:.2f}")
+        old_throughput = {t["concurrency"]: t for t in before["throughput"]}
+        for t in result["throughput"]:
+            if t["concurrency"] in old_throughput:
+                ratio = t["queries_per_sec"] / old_throughput[t["concurrency"]]["queries_per_sec"]
+                print(f"  {result['scale']}x concurrency {t['concurrency']:>3} throughput {ratio:.2f}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", default="datafiles/eval_queries.json")
+    parser.add_argument("--embedding", default="hashing", help="embedding backend, see embedding_backends.py")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--requests", type=int, default=200, help="pipe calls per concurrency level")
+    parser.add_argument("--top_k", type=int, default=6)
+    parser.add_argument("--retrieval_thresh", type=float, default=0.5)
+    parser.add_argument("--llm_delay", type=float, default=0.0, help="seconds the fake LLM takes")
+    parser.add_argument("--output")
+    parser.add_argument("--compare")
+    args = parser.parse_args()
+
+    with open(args.queries) as f:
+        queries = [q["query"] for q in json.load(f)]
+
+    results = [run_scale(scale, queries, args) for scale in args.scales]
+
+    output = args.output or os.path.join(RESULTS_FOLDER, f"rag_{commit()}_{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({"commit": commit(), "time": time.strftime("%Y-%m-%d %H:%M:%S"), "args": vars(args), "scales": results}, f, indent=2)
+    print(f"\nSaved {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Accuracy and latency of the local fact check (relevance_filter.py) on the
+labelled facts in datafiles/relevance_sample.json:
+- how many facts it decides locally vs sends to the LLM
+- how many of its local decisions match the label
+- how long a check takes (p50/p99)
+- the same numbers for other accept/reject thresholds, to pick good ones
+- whether re-worded copies of added facts are caught as duplicates
+
+Runs on a temporary local index so nothing real is touched.
+
+Usage (from the repo root):
+    python benchmarks/relevance_report.py [--accept 0.55] [--reject 0.15] [--embedding torch]
+Without --accept / --reject nothing is accepted / rejected locally (the app's
+default until the thresholds are tuned on the real model). With --reject it
+also prints how many relevant facts would be rejected without asking the LLM.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+import pineconing
+from relevance_filter import RelevanceFilter
+
+DATA_FILES = ["datafiles/umd_sustainability_data.json", "datafiles/umd_sustainingprogress_data.json"]
+
+def summarize(samples, scores, accept, reject):
+    local, correct = 0, 0
+    for sample, score in zip(samples, scores):
+        if score >= accept or score <= reject:
+            local += 1
+            correct += (score >= accept) == sample["relevant"]
+    return local, correct
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sample", default="datafiles/relevance_sample.json")
+    parser.add_argument("--embedding", default="torch", help="embedding backend, see embedding_backends.py")
+    parser.add_argument("--accept", type=float, default=None)
+    parser.add_argument("--reject", type=float, default=None)
+    parser.add_argument("--duplicate", type=float, default=0.95)
+    args = parser.parse_args()
+
+    with open(args.sample) as f:
+        samples = json.load(f)
+
+    with tempfile.TemporaryDirectory() as folder:
+        vdb = pineconing.VectorDB(backend="local", backend_options={"folder": folder}, batch_queries=False,
+                                  embedding_backend=args.embedding, own_data_file=os.path.join(folder, "own_data.sqlite"),
+                                  chunk_store_folder=os.path.join(folder, "chunk_store"),
+                                  embedding_cache_folder=os.path.join(folder, "embedding_cache"))
+        relevance = RelevanceFilter(vdb, DATA_FILES, accept_thresh=args.accept, reject_thresh=args.reject,
+                                    duplicate_thresh=args.duplicate, centroid_file=None)
+
+        results = [relevance.check(sample["text"]) for sample in samples]
+        n = len(samples)
+        decided = [(s, r) for s, r in zip(samples, results) if r["decision"] in ("accept", "reject")]
+        correct = sum((r["decision"] == "accept") == s["relevant"] for s, r in decided)
+        latencies = [r["ms"] for r in results]
+
+        print(f"Thresholds: accept >= {args.accept if args.accept is not None else 'never'}, "
+              f"reject <= {args.reject if args.reject is not None else 'never'}")
+        print(f"Decided locally: {len(decided)}/{n} ({len(decided) / n:.0%}), sent to the LLM: {n - len(decided)}")
+        print(f"Local accuracy: {correct}/{len(decided)} ({correct / len(decided) if decided else 0:.0%})")
+        relevant_count = sum(s["relevant"] for s in samples)
+        false_rejects = sum(s["relevant"] and r["decision"] == "reject" for s, r in zip(samples, results))
+        print(f"False rejects: {false_rejects}/{relevant_count} relevant facts "
+              f"({false_rejects / relevant_count if relevant_count else 0:.0%})")
+        print(f"Check latency: p50 {np.percentile(latencies, 50):.2f}ms  p99 {np.percentile(latencies, 99):.2f}ms")
+
+        print("\nWrong local decisions:")
+        for s, r in decided:
+            if (r["decision"] == "accept") != s["relevant"]:
+                print(f"  {r['decision']:<6} {r['score']:.3f}  {s['text']}")
+
+        print("\nScores (relevant / not relevant):")
+        relevant = [r["score"] for s, r in zip(samples, results) if s["relevant"]]
+        other = [r["score"] for s, r in zip(samples, results) if not s["relevant"]]
+        print(f"  relevant:     min {min(relevant):.3f}  mean {np.mean(relevant):.3f}  max {max(relevant):.3f}")
+        print(f"  not relevant: min {min(other):.3f}  mean {np.mean(other):.3f}  max {max(other):.3f}")
+
+        print("\nThreshold sweep (reject, accept): decided locally, local accuracy")
+        scores = [r["score"] for r in results]
+        for reject in (0.05, 0.1, 0.15, 0.2, 0.25):
+            row = []
+            for accept in (0.4, 0.45, 0.5, 0.55, 0.6):
+                local, right = summarize(samples, scores, accept, reject)
+                row.append(f"({reject:.2f},{accept:.2f}) {local:>2}/{n} {right / local if local else 0:4.0%}")
+            print("  " + "  ".join(row))
+
+        # Add a few facts, then check slightly different wordings of them
+        originals = [s["text"] for s in samples if s["relevant"]][:5]
+        for text in originals:
+            vdb.upsert_own_data(text)
+        reworded = [text.rstrip(".") + "!" for text in originals]
+        duplicates = sum(relevance.check(text)["decision"] == "duplicate" for text in reworded)
+        print(f"\nNear-duplicates caught: {duplicates}/{len(reworded)}")
+
+        # Same again for facts that are still waiting for the writer
+        more = [s["text"] for s in samples if s["relevant"]][5:10]
+        for text in more:
+            vdb.upsert_own_data(text, wait=False)
+        pending = sum(relevance.check(text.rstrip(".") + "!")["decision"] == "duplicate" for text in more)
+        print(f"Near-duplicates of facts not stored yet caught: {pending}/{len(more)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Measures how often retrieval finds the right page for the labelled questions
+in datafiles/eval_queries.json, for dense only, keyword (BM25) only and hybrid
+(both fused with reciprocal rank fusion, what UMDRAG.retrieve does):
+- hit@k: the share of questions with at least one relevant page in the top k
+- recall@k: the share of relevant pages found in the top k
+It also shows the keyword search latency.
+
+Usage (from the repo root):
+    python benchmarks/retrieval_recall.py [--top_k 6] [--backend local] [--keyword_only] [--compact]
+
+--compact runs everything again on the corpus after dedup.py and shows the
+difference, to check compaction doesn't hurt retrieval.
+
+With --backend local the data files are embedded into a temporary local index
+(embeddings come from the embedding cache after the first run).
+--keyword_only skips everything that needs the embedding model.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+from bm25 import BM25Index
+
+# Nothing in the data answers these, so retrieval should give them no context
+OFF_TOPIC = ["tell me a joke", "what's the weather like today", "who won the game last night",
+             "how do I reset my password", "what is the capital of france"]
+
+DATA_FILES = ["datafiles/umd_sustainability_data.json", "datafiles/umd_sustainingprogress_data.json"]
+
+# A merged chunk (see dedup.py) counts for every page in its "Links"
+def score(results, relevant):
+    found = set()
+    for match in results:
+        found.update(match["metadata"].get("Links") or [match["metadata"].get("Link")])
+    found &= set(relevant)
+    return len(found) > 0, len(found) / len(relevant)
+
+def evaluate(name, search, queries, top_k):
+    hits, recalls = [], []
+    for q in queries:
+        hit, recall = score(search(q["query"], top_k), q["relevant_links"])
+        hits.append(hit)
+        recalls.append(recall)
+    print(f"{name:<8} hit@{top_k}: {np.mean(hits):.3f}  recall@{top_k}: {np.mean(recalls):.3f}")
+    return {"hit": float(np.mean(hits)), "recall": float(np.mean(recalls))}
+
+def evaluate_corpus(files, queries, args):
+    start = time.perf_counter()
+    index = BM25Index()
+    for file in files:
+        index.add_file(file)
+    print(f"Keyword index: {len(index)} chunks, {len(index.postings)} terms, built in {time.perf_counter() - start:.2f}s")
+
+    latencies = []
+    for _ in range(5):
+        for q in queries:
+            start = time.perf_counter()
+            index.search(q["query"], args.top_k)
+            latencies.append((time.perf_counter() - start) * 1000)
+    print(f"Keyword search p50 {np.percentile(latencies, 50):.3f}ms  p99 {np.percentile(latencies, 99):.3f}ms")
+
+    results = {"keyword": evaluate("keyword", index.search, queries, args.top_k)}
+
+    if not args.keyword_only:
+        import pineconing
+        from umd_rag import UMDRAG
+
+        with tempfile.TemporaryDirectory() as folder:
+            options = {"folder": folder} if args.backend in ("local", "ivf") else None
+            vdb = pineconing.VectorDB(backend=args.backend, backend_options=options, batch_queries=False,
+                                      own_data_file=os.path.join(folder, "own_data.sqlite"),
+                                      chunk_store_folder=os.path.join(folder, "chunk_store"),
+                                      embedding_cache_folder=os.path.join(folder, "embedding_cache"))
+            if options is not None:
+                vdb.upsert_files(files)
+            vdb.keyword_index = index
+
+            dense = UMDRAG(vdb, None, hybrid=False)
+            hybrid = UMDRAG(vdb, None, hybrid=True)
+            results["dense"] = evaluate("dense", lambda q, k: dense.retrieve(q, k, args.retrieval_thresh), queries, args.top_k)
+            results["hybrid"] = evaluate("hybrid", lambda q, k: hybrid.retrieve(q, k, args.retrieval_thresh), queries, args.top_k)
+            for name, rag in (("dense", dense), ("hybrid", hybrid)):
+                answered = sum(bool(rag.retrieve(q, args.top_k, args.retrieval_thresh)) for q in OFF_TOPIC)
+                print(f"{name:<8} off-topic questions that got context: {answered}/{len(OFF_TOPIC)}")
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", default="datafiles/eval_queries.json")
+    parser.add_argument("--files", nargs="+", default=DATA_FILES)
+    parser.add_argument("--top_k", type=int, default=6)
+    parser.add_argument("--retrieval_thresh", type=float, default=0.5)
+    parser.add_argument("--backend", default="local")
+    parser.add_argument("--keyword_only", action="store_true")
+    parser.add_argument("--compact", action="store_true", help="also run on the files after dedup.py and compare")
+    args = parser.parse_args()
+
+    with open(args.queries) as f:
+        queries = json.load(f)
+
+    print("Corpus: " + ", ".join(args.files))
+    results = {"original": evaluate_corpus(args.files, queries, args)}
+
+    if args.compact:
+        from dedup import compact_files
+
+        with tempfile.TemporaryDirectory(dir="datafiles") as folder:
+            print("\nCompacted corpus:")
+            files, _ = compact_files(args.files, os.path.relpath(folder, ROOT))
+            results["compacted"] = evaluate_corpus(files, queries, args)
+
+        print("\nCompacted - original:")
+        for method, r in results["compacted"].items():
+            before = results["original"][method]
+            print(f"{method:<8} hit {r['hit'] - before['hit']:+.3f}  recall {r['recall'] - before['recall']:+.3f}")
+
+    return results
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+How query embedding scales with the number of worker processes in serve.py:
+- queries/sec with as many threads sending queries as there are workers (x2)
+- p50/p99 latency of one query
+- memory: RSS (counts shared pages in every process) and PSS (shared pages
+  split between the processes) of the front end plus all workers, and how
+  much each extra worker adds
+
+Every worker count runs in its own process so the memory numbers don't mix.
+
+Usage (from the repo root):
+    python benchmarks/serve_benchmark.py [--workers 1 2 4] [--embedding_backend torch] [--queries 400]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+# Runs inside the child process, prints one json line
+def measure(backend, workers, num_queries):
+    import serve
+
+    with open("datafiles/eval_queries.json") as f:
+        questions = [q["query"] for q in json.load(f)]
+    queries = [f"{questions[i % len(questions)]} {i}" for i in range(num_queries)]
+
+    pool = serve.WorkerPool(backend, workers)
+    for query in questions:
+        pool.encode_query(query)
+
+    latencies = []
+    for query in queries[:50]:
+        start = time.perf_counter()
+        pool.encode_query(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=2 * workers) as executor:
+        list(executor.map(pool.encode_query, queries))
+    seconds = time.perf_counter() - start
+
+    health = pool.health()
+    processes = [health["front_end"]] + health["workers"]
+    pool.close()
+    return {
+        "workers": workers,
+        "queries_per_sec": num_queries / seconds,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "rss_mb": sum(p.get("rss", 0) for p in processes),
+        "pss_mb": sum(p.get("pss", 0) for p in processes),
+        "worker_pss_mb": [round(w.get("pss", 0), 1) for w in health["workers"]],
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--embedding_backend", default="torch")
+    parser.add_argument("--queries", type=int, default=400)
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.embedding_backend, args.child, args.queries)))
+        return
+
+    print(f"{os.cpu_count()} cores, embedding backend {args.embedding_backend}")
+    results = []
+    for workers in args.workers:
+        output = subprocess.run([sys.executable, __file__, "--child", str(workers), "--queries", str(args.queries),
+                                 "--embedding_backend", args.embedding_backend],
+                                capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        results.append(result)
+        print(f"{workers:>2} workers: {result['queries_per_sec']:8.1f} queries/sec  p50 {result['p50_ms']:.2f}ms  "
+              f"p99 {result['p99_ms']:.2f}ms  rss {result['rss_mb']:.0f}MB  pss {result['pss_mb']:.0f}MB")
+
+    base = results[0]
+    for result in results[1:]:
+        extra = result["workers"] - base["workers"]
+        print(f"{base['workers']} -> {result['workers']} workers: throughput x{result['queries_per_sec'] / base['queries_per_sec']:.2f}, "
+              f"+{(result['pss_mb'] - base['pss_mb']) / extra:.1f}MB pss per extra worker")
+    return results
+
+if __name__ == "__main__":
+    main()
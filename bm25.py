@@ -0,0 +1,136 @@
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+
+import my_utils
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Words too common to help a keyword search
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "how",
+    "i", "in", "is", "it", "of", "on", "or", "that", "the", "this", "to", "was", "what", "when",
+    "where", "which", "who", "why", "will", "with", "you", "your",
+}
+
+def tokenize(text):
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+"""
+BM25 keyword index (inverted index) over the Content of the chunks.
+Catches exact matches the embeddings miss: building names, acronyms, numbers.
+A search only looks at the postings of the words in the query, so it's fast
+enough to run on every question. Chunks can be added and removed one at a
+time (e.g. when a user adds a fact).
+Inputs:
+    k1, b: the usual BM25 parameters
+"""
+class BM25Index:
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.lock = threading.Lock()
+        self.postings = defaultdict(dict)  # term -> {id: term count}
+        self.docs = {}  # id -> {namespace, metadata, length, terms}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, id, text, namespace, metadata):
+        terms = Counter(tokenize(text))
+        with self.lock:
+            if id in self.docs:
+                self.remove_unlocked(id)
+            for term, count in terms.items():
+                self.postings[term][id] = count
+            length = sum(terms.values())
+            self.docs[id] = {"namespace": namespace, "metadata": metadata, "length": length, "terms": list(terms)}
+            self.total_length += length
+
+    def remove(self, id):
+        with self.lock:
+            self.remove_unlocked(id)
+
+    def remove_unlocked(self, id):
+        doc = self.docs.pop(id, None)
+        if doc is None:
+            return
+        for term in doc["terms"]:
+            postings = self.postings[term]
+            postings.pop(id, None)
+            if not postings:
+                del self.postings[term]
+        self.total_length -= doc["length"]
+
+    # Chunks of a scraped data file, with the same ids the vectors get
+    def add_file(self, file, namespace="file_data"):
+        import pineconing
+
+        fname = pineconing.get_file_name(file)
+        page_counts = {}
+        for batch in my_utils.iter_batches(my_utils.iter_records(file), 500):
+            ids = pineconing.assign_chunk_ids(fname, batch, page_counts)
+            for id, data in zip(ids, batch):
+                self.add(id, data["Content"], namespace, data)
+
+    """
+    Returns the top_k chunks for the query, best first, in the same format as
+    the vector search: {id, score, namespace, metadata}, plus
+    "normalized_score": score / the most any chunk could get for this query
+    (every query word, including ones no chunk has, matched many times).
+    Raw BM25 scores depend on the query length, the normalized one is 0..1
+    and can be compared against a fixed threshold.
+    """
+    def search(self, query, top_k=10, namespaces=None):
+        terms = set(tokenize(query))
+        scores = defaultdict(float)
+
+        with self.lock:
+            n = len(self.docs)
+            if n == 0 or not terms:
+                return []
+            average_length = self.total_length / n
+
+            best_possible = 0.0
+            for term in terms:
+                postings = self.postings.get(term, {})
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                best_possible += idf * (self.k1 + 1)
+                for id, count in postings.items():
+                    length_norm = 1 - self.b + self.b * self.docs[id]["length"] / average_length
+                    scores[id] += idf * count * (self.k1 + 1) / (count + self.k1 * length_norm)
+
+            if namespaces is not None:
+                scores = {id: score for id, score in scores.items() if self.docs[id]["namespace"] in namespaces}
+            best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+            return [{"id": id,
+                     "score": score,
+                     "normalized_score": score / best_possible,
+                     "namespace": self.docs[id]["namespace"],
+                     "metadata": self.docs[id]["metadata"]} for id, score in best]
+
+
+"""
+Reciprocal rank fusion: merges ranked result lists into one.
+Every chunk gets sum(1 / (k + rank)) over the lists it shows up in, so chunks
+that rank well in both lists win and the raw scores (cosine vs BM25) never have
+to be compared. The merged results keep the fields of the first list they're
+in (so "score" stays that list's score), plus "rrf_score" = the fused score
+(what they're sorted by) and "dense_score" / "keyword_score".
+Inputs:
+    result_lists: dict of name -> results (best first), e.g. {"dense": [...], "keyword": [...]}
+    k: smooths out the difference between the top ranks (60 is the usual)
+"""
+def reciprocal_rank_fusion(result_lists, k=60):
+    fused = {}
+    for name, results in result_lists.items():
+        for rank, match in enumerate(results):
+            if match["id"] not in fused:
+                fused[match["id"]] = dict(match, rrf_score=0.0)
+            fused[match["id"]]["rrf_score"] += 1 / (k + rank + 1)
+            fused[match["id"]][f"{name}_score"] = match["score"]
+
+    return sorted(fused.values(), key=lambda match: match["rrf_score"], reverse=True)
@@ -0,0 +1,80 @@
+import json
+import os
+
+import my_utils
+
+"""
+Makes the static things the UI needs ahead of time, so app.py doesn't have to
+at startup:
+- the RAG pipeline diagram shrunk to the size we show it at
+- all the intro texts in one json file
+- the relevance filter's centroid of the data files (see relevance_filter.py),
+  for the EMBEDDING_BACKEND and DATA_FILES the app will run with
+Run it before deploying (from the repo root):
+    python build_assets.py
+app.py falls back to doing this itself if the files aren't there.
+"""
+
+BUILD_FOLDER = 'datafiles/build'
+DIAGRAM = 'datafiles/RAG_Pipeline.jpg'
+DIAGRAM_SMALL = os.path.join(BUILD_FOLDER, 'RAG_Pipeline_small.jpg')
+INTRO_BUNDLE = os.path.join(BUILD_FOLDER, 'intro_texts.json')
+CENTROID_FILE = os.path.join(BUILD_FOLDER, 'relevance_centroid.npz')
+
+# The scraped files that were upserted. The app's keyword index, chunk store and relevance filter all read
+# these, so they have to be the same files the vectors came from, e.g. after `python ingest.py --dedup`:
+#   DATA_FILES=datafiles/compact/umd_sustainability_data.jsonl,datafiles/compact/umd_sustainingprogress_data.jsonl
+DATA_FILES = (os.environ.get("DATA_FILES") or "datafiles/umd_sustainability_data.json,"
+                                              "datafiles/umd_sustainingprogress_data.json").split(",")
+
+INTRO_TEXTS = ['chatbot_intro', 'intro', 'intro_nav', 'intro_notes', 'intro_tools', 'intro_stats',
+               'intro_how', 'intro_about', 'intro_contact', 'own_data_intro', 'own_data_delete']
+
+def intro_file(name):
+    return f'datafiles/intro_texts/{name}.txt'
+
+# The diagram at a quarter of its size, as a PIL image
+def resize_diagram():
+    from PIL import Image
+
+    diagram = Image.open(DIAGRAM)
+    width, height = diagram.size
+    return diagram.resize((width // 4, height // 4))
+
+def build_diagram():
+    resize_diagram().save(DIAGRAM_SMALL)
+    print(f"Saved {DIAGRAM_SMALL}")
+
+def build_intro_texts():
+    texts = {name: my_utils.read_text_file(intro_file(name), False) for name in INTRO_TEXTS}
+    with open(INTRO_BUNDLE, 'w', encoding='utf-8') as f:
+        json.dump(texts, f, ensure_ascii=False)
+    print(f"Saved {INTRO_BUNDLE}")
+
+# The bundled intro texts, or None if there's no bundle or a text changed after it was made
+def load_intro_texts():
+    if not os.path.exists(INTRO_BUNDLE):
+        return None
+
+    built = os.stat(INTRO_BUNDLE).st_mtime
+    if any(os.stat(intro_file(name)).st_mtime > built for name in INTRO_TEXTS):
+        return None
+
+    with open(INTRO_BUNDLE, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def build_centroid():
+    import relevance_filter
+    from embedding_backends import embedding_name, load_embedding_model
+
+    backend = os.environ.get("EMBEDDING_BACKEND", "torch")
+    model = load_embedding_model(backend)
+    centroid = relevance_filter.make_centroid(DATA_FILES, model.encode_document)
+    relevance_filter.save_centroid(CENTROID_FILE, centroid, relevance_filter.centroid_key(embedding_name(backend), DATA_FILES))
+    print(f"Saved {CENTROID_FILE}")
+
+if __name__ == "__main__":
+    os.makedirs(BUILD_FOLDER, exist_ok=True)
+    build_intro_texts()
+    build_diagram()
+    build_centroid()
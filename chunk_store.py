@@ -0,0 +1,166 @@
+import argparse
+import json
+import mmap
+import os
+import threading
+
+import my_utils
+
+"""
+Local store for the text and fields of the scraped chunks, so the vector store
+only has to keep an id and a few small fields per vector (see slim_metadata).
+
+Everything is in one append-only file, one line per chunk:
+    <id>\t<record as json>\n
+A deleted chunk gets a line with an empty record. When the store opens, the
+file is scanned once to build {id: (offset, length)} of the newest line of
+every id, and reads are slices of a memory map of the file, so looking up the
+few chunks a question retrieves doesn't read or parse anything else.
+Upserting a chunk that didn't change writes nothing, so re-ingesting the same
+files doesn't grow the file. compact() rewrites it without the old versions.
+
+Command line (from the repo root):
+    python chunk_store.py [--folder datafiles/chunk_store] [--compact]
+"""
+
+# Fields that stay in the vector store's metadata (small, and you can filter on them)
+FILTER_FIELDS = ("Link",)
+
+def slim_metadata(record):
+    return {key: record[key] for key in FILTER_FIELDS if key in record}
+
+
+class ChunkStore:
+    def __init__(self, folder="datafiles/chunk_store"):
+        self.folder = folder
+        self.file = os.path.join(folder, "chunks.tsv")
+        self.lock = threading.Lock()
+        self.offsets = {}  # id -> (offset, length) of the record json
+        self.dead = 0  # lines that are old versions or deletions
+        self.map = None
+
+        os.makedirs(folder, exist_ok=True)
+        if os.path.exists(self.file):
+            # A line cut off by a crash would get glued to the next write
+            my_utils.truncate_partial_line(self.file)
+        self.writer = open(self.file, "ab")
+        self.size = self.scan()
+
+    # Builds the offsets from the file, returns the file size
+    def scan(self):
+        offset = 0
+        with open(self.file, "rb") as f:
+            for line in f:
+                tab = line.index(b"\t")
+                id = line[:tab].decode("utf-8")
+                length = len(line) - tab - 2
+                if id in self.offsets:
+                    self.dead += 1
+                    del self.offsets[id]
+                if length > 0:
+                    self.offsets[id] = (offset + tab + 1, length)
+                else:
+                    self.dead += 1
+                offset += len(line)
+        return offset
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __contains__(self, id):
+        return id in self.offsets
+
+    # Caller holds the lock. Bytes of one record, maps the file again if it grew
+    def read(self, offset, length):
+        if self.map is None or offset + length > len(self.map):
+            if self.map is not None:
+                self.map.close()
+            with open(self.file, "rb") as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.map[offset:offset + length]
+
+    # Caller holds the lock
+    def append(self, lines):
+        if not lines:
+            return
+        self.writer.write(b"".join(line for _, line in lines))
+        self.writer.flush()
+        for id, line in lines:
+            length = len(line) - len(id.encode("utf-8")) - 2
+            if id in self.offsets:
+                self.dead += 1
+                del self.offsets[id]
+            if length > 0:
+                self.offsets[id] = (self.size + len(line) - 1 - length, length)
+            else:
+                self.dead += 1
+            self.size += len(line)
+
+    """
+    Inputs:
+        items: list of (id, record dict)
+    """
+    def put_many(self, items):
+        with self.lock:
+            lines = []
+            for id, record in items:
+                data = json.dumps(record, ensure_ascii=False).encode("utf-8")
+                if id in self.offsets and self.read(*self.offsets[id]) == data:
+                    continue
+                lines.append((id, id.encode("utf-8") + b"\t" + data + b"\n"))
+            self.append(lines)
+
+    def put(self, id, record):
+        self.put_many([(id, record)])
+
+    # {id: record} for the ids that are in the store
+    def get_many(self, ids):
+        with self.lock:
+            found = {}
+            for id in ids:
+                if id in self.offsets:
+                    found[id] = json.loads(self.read(*self.offsets[id]))
+            return found
+
+    def get(self, id):
+        return self.get_many([id]).get(id)
+
+    def delete(self, ids):
+        with self.lock:
+            self.append([(id, id.encode("utf-8") + b"\t\n") for id in ids if id in self.offsets])
+
+    # Rewrites the file with only the newest version of every chunk
+    def compact(self):
+        with self.lock:
+            temp = self.file + ".tmp"
+            with open(temp, "wb") as f:
+                for id, (offset, length) in self.offsets.items():
+                    f.write(id.encode("utf-8") + b"\t" + self.read(offset, length) + b"\n")
+
+            self.writer.close()
+            if self.map is not None:
+                self.map.close()
+                self.map = None
+            os.replace(temp, self.file)
+
+            self.offsets = {}
+            self.dead = 0
+            self.writer = open(self.file, "ab")
+            self.size = self.scan()
+
+    def stats(self):
+        with self.lock:
+            return {"chunks": len(self.offsets), "dead_lines": self.dead, "bytes": self.size}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show or compact the local chunk store")
+    parser.add_argument("--folder", default="datafiles/chunk_store")
+    parser.add_argument("--compact", action="store_true")
+    args = parser.parse_args()
+
+    store = ChunkStore(args.folder)
+    print(store.stats())
+    if args.compact:
+        store.compact()
+        print(store.stats())
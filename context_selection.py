@@ -0,0 +1,125 @@
+import re
+
+import numpy as np
+
+import metrics
+import my_utils
+from prompt_builder import estimate_tokens
+
+"""
+Picks and trims what goes into the prompt, between UMDRAG.retrieve and
+create_prompt. The retrieved chunks often say the same thing several times
+(the same paragraph on two pages, or a list and its items), and every chunk's
+Content ends with the Site Title / Header / Link lines that format_chunk
+already writes from the fields. Every extra token makes Gemini slower and
+costs money, so:
+1. the Site Title / Header / Link lines at the end of Content are cut
+2. chunks are ordered with MMR (maximal marginal relevance): each next chunk
+   is the one most similar to the question and least similar to the chunks
+   already picked, using the vectors the search returned with the chunks
+3. sentences that were already said (same words, or nearly) are dropped
+4. chunks are added in that order until max_context_tokens is used up, and
+   the last one is cut at a sentence so it fits
+The retrieval itself isn't changed (the metadata panel and semantic cache
+still see every chunk), only the copies that go in the prompt.
+
+Inputs:
+    vdb: the VectorDB (for the query embedding, and chunks only the keyword search found)
+    max_context_tokens: token budget for all the chunks together
+    mmr_lambda: 1 only looks at relevance, lower values prefer chunks that add something new
+    sentence_overlap: a sentence whose words are this much (Jaccard) like an earlier one is dropped
+    count_tokens: same token estimate as the prompt builder
+"""
+class ContextSelector:
+    def __init__(self, vdb, max_context_tokens=1500, mmr_lambda=0.7, sentence_overlap=0.8, count_tokens=estimate_tokens):
+        self.vdb = vdb
+        self.max_context_tokens = max_context_tokens
+        self.mmr_lambda = mmr_lambda
+        self.sentence_overlap = sentence_overlap
+        self.count_tokens = count_tokens
+
+    @staticmethod
+    def split_sentences(text):
+        return [s.strip() for s in re.split(r"(?<=[.!?])\s+|\n+", text) if s.strip()]
+
+    @staticmethod
+    def normalize(embeddings):
+        return embeddings / np.maximum(np.linalg.norm(embeddings, axis=-1, keepdims=True), 1e-12)
+
+    # Indexes of the chunks in MMR order
+    def mmr_order(self, query_embedding, chunk_embeddings):
+        relevance = chunk_embeddings @ query_embedding
+        similarity = chunk_embeddings @ chunk_embeddings.T
+        order = []
+        left = list(range(len(chunk_embeddings)))
+        while left:
+            if order:
+                redundancy = similarity[np.ix_(left, order)].max(axis=1)
+            else:
+                redundancy = np.zeros(len(left))
+            scores = self.mmr_lambda * relevance[left] - (1 - self.mmr_lambda) * redundancy
+            order.append(left.pop(int(np.argmax(scores))))
+        return order
+
+    # The vector search's vectors, matches without one (keyword only) are embedded like at ingest
+    def chunk_vectors(self, retrieval):
+        vectors = [match.get('values') for match in retrieval]
+        for own_data, embed in ((False, self.vdb.embed_documents), (True, self.vdb.embed_own_data)):
+            missing = [i for i, match in enumerate(retrieval)
+                       if vectors[i] is None and (match.get('namespace') == 'own_data') == own_data]
+            if missing:
+                for i, vector in zip(missing, embed([retrieval[i]['metadata']['Content'] for i in missing])):
+                    vectors[i] = vector
+        return vectors
+
+    """
+    It can embed (keyword only matches, on a cache miss), so don't call it on
+    the event loop.
+    Inputs:
+        retrieval: matches from UMDRAG.retrieve (best first), with "values"
+        query: the question
+    Outputs:
+        copies of the matches to put in the prompt, in MMR order, with trimmed
+        Content. Chunks with nothing new left are gone.
+    """
+    def select(self, retrieval, query):
+        if not retrieval:
+            return []
+
+        with metrics.span("context_select", chunks=len(retrieval)):
+            # The query comes from the query LRU (the search just embedded it)
+            chunks = self.normalize(np.asarray(self.chunk_vectors(retrieval), dtype=np.float32))
+            query_embedding = self.normalize(np.asarray(self.vdb.embed_query(query), dtype=np.float32))
+
+            budget = self.max_context_tokens
+            seen = []  # word sets of the sentences already used
+            selected = []
+            full = False
+            for i in self.mmr_order(query_embedding, chunks):
+                match = retrieval[i]
+                kept = []
+                for sentence in self.split_sentences(my_utils.strip_chunk_metadata(match['metadata']['Content'])):
+                    words = set(re.findall(r"\w+", sentence.lower()))
+                    if any(len(words & other) / len(words | other) >= self.sentence_overlap for other in seen if words | other):
+                        dropped_sentences.inc()
+                        continue
+
+                    tokens = self.count_tokens(sentence) + 1
+                    if tokens > budget:
+                        full = True
+                        break
+                    kept.append(sentence)
+                    seen.append(words)
+                    budget -= tokens
+
+                if kept:
+                    selected.append(dict(match, metadata=dict(match['metadata'], Content=" ".join(kept))))
+                if full:
+                    break
+            dropped_chunks.inc(len(retrieval) - len(selected))
+
+        return selected
+
+
+dropped_chunks = metrics.registry.counter("context_dropped_chunks_total", "Retrieved chunks left out of the prompt (nothing new, or over the token budget)")
+dropped_sentences = metrics.registry.counter("context_dropped_sentences_total", "Sentences left out of the prompt as repeats")
@@ -0,0 +1,242 @@
+import asyncio
+import collections
+import contextlib
+import re
+import threading
+import time
+from concurrent.futures import Future
+
+import metrics
+
+"""
+Keeps bursts of chat traffic (e.g. right after a link to the chatbot gets
+shared) from turning into a pile of LLM calls.
+
+- Single-flight: the same question asked while it's already being answered
+  doesn't run again, it waits for the answer that's on its way (a streamed
+  answer is replayed to everyone from the first token).
+- ConcurrencyLimiter: at most `limit` LLM calls at once. Up to max_waiting
+  more wait for a free slot (first come first served), anything beyond that,
+  or waiting longer than timeout, gets Busy right away instead of piling up.
+Queue depth, waiting time, busy replies and coalesced requests go to /metrics.
+"""
+
+class Busy(Exception):
+    pass
+
+# "What is  UMD doing for solar?" and "what is UMD doing for solar" are the same question
+def normalize_query(text):
+    return re.sub(r"\s+", " ", text).strip().rstrip("?!. ").lower()
+
+
+"""
+Inputs:
+    limit: LLM calls allowed at the same time
+    max_waiting: how many calls can wait for a slot before new ones get Busy
+    timeout: seconds a call waits for a slot before it gets Busy
+"""
+class ConcurrencyLimiter:
+    def __init__(self, limit=8, max_waiting=16, timeout=10.0):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.free = limit
+        # Wake up functions of the waiting calls, a released slot goes straight to the first one
+        self.waiters = collections.deque()
+
+    def in_use(self):
+        return self.limit - self.free
+
+    def depth(self):
+        return len(self.waiters)
+
+    # True when a new call would get Busy right away
+    def full(self):
+        with self.lock:
+            return self.free == 0 and len(self.waiters) >= self.max_waiting
+
+    # Caller holds the lock. True if a slot was free, otherwise queues wake (or raises Busy)
+    def enqueue(self, wake):
+        if self.free > 0 and not self.waiters:
+            self.free -= 1
+            return True
+        if len(self.waiters) >= self.max_waiting:
+            busy_replies.inc(reason="queue_full")
+            raise Busy("Too many questions waiting for the LLM")
+        self.waiters.append(wake)
+        return False
+
+    # Called after a timeout/cancel. True if the slot was handed over in the meantime
+    def dequeue(self, wake):
+        with self.lock:
+            if wake in self.waiters:
+                self.waiters.remove(wake)
+                return False
+            return True
+
+    def acquire(self):
+        start = time.perf_counter()
+        event = threading.Event()
+        with self.lock:
+            got = self.enqueue(event.set)
+        if not got and not event.wait(self.timeout) and not self.dequeue(event.set):
+            busy_replies.inc(reason="timeout")
+            raise Busy("Waited too long for the LLM")
+        queue_wait.observe(time.perf_counter() - start)
+
+    async def aacquire(self):
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: ready.done() or ready.set_result(None))
+
+        with self.lock:
+            got = self.enqueue(wake)
+        if not got:
+            try:
+                await asyncio.wait_for(asyncio.shield(ready), self.timeout)
+            except asyncio.TimeoutError:
+                if not self.dequeue(wake):
+                    busy_replies.inc(reason="timeout")
+                    raise Busy("Waited too long for the LLM")
+            except asyncio.CancelledError:
+                # Gave up (e.g. the user left), pass on a slot we were given
+                if self.dequeue(wake):
+                    self.release()
+                raise
+        queue_wait.observe(time.perf_counter() - start)
+
+    def release(self):
+        with self.lock:
+            if self.waiters:
+                self.waiters.popleft()()
+            else:
+                self.free += 1
+
+    # with limiter.slot(): model.invoke(...)
+    @contextlib.contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    @contextlib.asynccontextmanager
+    async def aslot(self):
+        await self.aacquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+
+# One answer being made, shared by everyone who asked the same thing
+class Flight:
+    def __init__(self):
+        self.parts = []
+        self.done = False
+        self.error = None
+        self.changed = asyncio.Condition()
+        # The producer task. The event loop only keeps a weak reference, so it has to be held somewhere
+        self.task = None
+
+
+class RequestCoordinator:
+    def __init__(self, limit=8, max_waiting=16, timeout=10.0):
+        self.limiter = ConcurrencyLimiter(limit, max_waiting, timeout)
+        self.lock = threading.Lock()
+        self.calls = {}  # key -> Future of a running run()
+        self.flights = {}  # key -> Flight of a running stream()
+
+    """
+    Runs fn() once for everyone who calls with the same key while it runs.
+    Inputs:
+        key: e.g. ("check_info", normalize_query(text))
+        fn: function with no arguments
+    Outputs:
+        what fn returned (or raises what it raised)
+    """
+    def run(self, key, fn):
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+
+        if not leader:
+            coalesced_requests.inc(kind=key[0])
+            return future.result()
+
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self.lock:
+                del self.calls[key]
+        return future.result()
+
+    """
+    Async generator version of run() for streamed answers. make_stream() is
+    only called by the first request with this key, in its own task so it
+    finishes even if that user leaves, and every request gets every part.
+    A new question is turned away with Busy up front if the LLM queue is full.
+    Inputs:
+        key: e.g. ("chat", normalize_query(message))
+        make_stream: function returning an async generator
+    """
+    async def stream(self, key, make_stream):
+        flight = self.flights.get(key)
+        if flight is None:
+            if self.limiter.full():
+                busy_replies.inc(reason="queue_full")
+                raise Busy("Too many questions waiting for the LLM")
+            flight = self.flights[key] = Flight()
+            flight.task = asyncio.create_task(self.produce(key, flight, make_stream))
+        else:
+            coalesced_requests.inc(kind=key[0])
+
+        sent = 0
+        while True:
+            async with flight.changed:
+                await flight.changed.wait_for(lambda: len(flight.parts) > sent or flight.done)
+                parts = flight.parts[sent:]
+                done = flight.done
+            for part in parts:
+                yield part
+            sent += len(parts)
+            if done and sent == len(flight.parts):
+                if flight.error is not None:
+                    raise flight.error
+                return
+
+    async def produce(self, key, flight, make_stream):
+        try:
+            async for part in make_stream():
+                async with flight.changed:
+                    flight.parts.append(part)
+                    flight.changed.notify_all()
+        except Exception as e:
+            flight.error = e
+        finally:
+            # Later askers start a new flight (and probably hit the semantic cache)
+            del self.flights[key]
+            async with flight.changed:
+                flight.done = True
+                flight.changed.notify_all()
+
+    def stats(self):
+        return {
+            "llm_in_flight": self.limiter.in_use(),
+            "llm_queue_depth": self.limiter.depth(),
+            "coalescing": len(self.calls) + len(self.flights),
+        }
+
+
+queue_wait = metrics.registry.histogram("llm_queue_wait_seconds", "Time LLM calls waited for a free slot")
+busy_replies = metrics.registry.counter("llm_busy_total", "Requests turned away because the LLM queue was full", ("reason",))
+coalesced_requests = metrics.registry.counter("coalesced_requests_total", "Requests that shared an answer already being made", ("kind",))
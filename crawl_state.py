@@ -0,0 +1,69 @@
+import hashlib
+import json
+import os
+import threading
+
+"""
+Remembers what every crawled page looked like last time so a re-crawl can
+skip pages that didn't change.
+
+For every url we keep:
+    etag / last_modified: validators sent back in conditional GET headers
+    hash: sha256 of the raw page body
+    links: the links found on the page (needed when the server answers 304)
+    data: the chunks extracted from the page
+"""
+class CrawlState:
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.pages = {}
+
+        if os.path.exists(filename):
+            with open(filename, 'r', encoding='utf-8') as f:
+                self.pages = json.load(f)
+
+    def get(self, url):
+        with self.lock:
+            return self.pages.get(url)
+
+    # Headers for a conditional GET, empty if we've never seen the page
+    def conditional_headers(self, url):
+        entry = self.get(url)
+        headers = {}
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def update(self, url, response, page_hash, links, data):
+        with self.lock:
+            self.pages[url] = {
+                "etag": response.headers.get('ETag', ""),
+                "last_modified": response.headers.get('Last-Modified', ""),
+                "hash": page_hash,
+                "links": sorted(links),
+                "data": data,
+            }
+
+    # Forgets every url not in keep and returns the ones that were dropped
+    def prune(self, keep):
+        with self.lock:
+            removed = set(self.pages) - set(keep)
+            for url in removed:
+                del self.pages[url]
+        return removed
+
+    # Written to a temp file first and swapped in, so a crash while saving leaves the old state instead of half a file
+    def save(self):
+        with self.lock:
+            tmp = self.filename + ".tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self.pages, f, ensure_ascii=False)
+            os.replace(tmp, self.filename)
+
+
+def hash_content(content: bytes):
+    return hashlib.sha256(content).hexdigest()
@@ -0,0 +1,230 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import zlib
+
+import numpy as np
+
+import my_utils
+
+"""
+Removes repeated chunks from the scraped data before it gets embedded.
+
+The same accordion / card group / slideshow text shows up on lots of pages
+(and on both sites), and a <li> is saved both by itself and inside its parent
+list. Every copy costs an embedding, index space and a top k slot.
+
+Three passes, on the page text (without the Site Title/Header/Link lines):
+1. contained: a chunk whose whole text is inside another chunk of the same page
+   is dropped (that's the <li> case)
+2. exact: chunks with the same normalized text are merged
+3. near: MinHash signatures of word shingles, grouped with LSH (locality
+   sensitive hashing) so only likely pairs get compared. Pairs with a Jaccard
+   similarity >= threshold are merged.
+A merged chunk is the longest one of its group, with "Links" = the links of
+every chunk in the group, so no source is lost.
+
+Command line (from the repo root), writes datafiles/compact/umd_<name>_data.jsonl:
+    python dedup.py datafiles/umd_sustainability_data.json datafiles/umd_sustainingprogress_data.json
+Upsert the compacted files after that (`python ingest.py --dedup` does both).
+Their chunk ids start with compact_ so they never mix with the originals', and
+the app has to read the same files (DATA_FILES) for its keyword index and
+chunk store.
+"""
+
+COMPACT_FOLDER = "datafiles/compact"
+
+# Largest prime below 2^32, so (a * x + b) % PRIME fits in uint64
+PRIME = 4294967291
+
+def normalize(content):
+    text = my_utils.strip_chunk_metadata(content).lower()
+    return re.sub(r"\s+", " ", text).strip()
+
+def shingles(text, size):
+    words = text.split()
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+class UnionFind:
+    def __init__(self, n):
+        self.parent = list(range(n))
+
+    def find(self, i):
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i, j):
+        i, j = self.find(i), self.find(j)
+        if i != j:
+            self.parent[max(i, j)] = min(i, j)
+
+
+"""
+Inputs:
+    threshold: Jaccard similarity of shingles needed to count as near-duplicates
+    num_perm: MinHash signature length
+    bands: LSH bands (num_perm / bands rows each); more bands finds more pairs
+    shingle_size: words per shingle
+"""
+class ChunkDeduplicator:
+    def __init__(self, threshold=0.8, num_perm=128, bands=32, shingle_size=5, seed=1):
+        if num_perm % bands:
+            raise Exception("num_perm has to be a multiple of bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 2**31, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 2**31, num_perm, dtype=np.uint64)
+
+    def signature(self, shingle_set):
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingle_set), dtype=np.uint64, count=len(shingle_set))
+        return ((self.a[:, None] * hashes[None, :] + self.b[:, None]) % PRIME).min(axis=1)
+
+    # Pairs (i, j) that share at least one LSH band
+    def candidate_pairs(self, signatures):
+        pairs = set()
+        for band in range(self.bands):
+            buckets = {}
+            for i, signature in enumerate(signatures):
+                key = signature[band * self.rows:(band + 1) * self.rows].tobytes()
+                buckets.setdefault(key, []).append(i)
+            for members in buckets.values():
+                for x in range(len(members)):
+                    for y in range(x + 1, len(members)):
+                        pairs.add((members[x], members[y]))
+        return pairs
+
+    """
+    Inputs:
+        records: scraped chunks (dicts with Link, Site_Title, Header, Content)
+    Outputs:
+        (compacted records, report dict)
+    """
+    def dedup(self, records):
+        texts = [normalize(r['Content']) for r in records]
+        report = {"chunks_in": len(records), "chars_in": sum(len(t) for t in texts)}
+        keep = [True] * len(records)
+        groups = UnionFind(len(records))
+
+        # 1. Contained in a longer chunk of the same page
+        by_page = {}
+        for i, r in enumerate(records):
+            by_page.setdefault(r['Link'], []).append(i)
+        contained = 0
+        for members in by_page.values():
+            members = sorted(members, key=lambda i: len(texts[i]))
+            for x, i in enumerate(members):
+                for j in members[x + 1:]:
+                    if len(texts[i]) < len(texts[j]) and texts[i] in texts[j]:
+                        keep[i] = False
+                        contained += 1
+                        break
+        report["contained"] = contained
+
+        # 2. Exact duplicates
+        first = {}
+        exact = 0
+        for i, text in enumerate(texts):
+            if not keep[i]:
+                continue
+            key = hashlib.sha1(text.encode("utf-8")).hexdigest()
+            if key in first:
+                groups.union(first[key], i)
+                exact += 1
+            else:
+                first[key] = i
+        report["exact_duplicates"] = exact
+
+        # 3. Near duplicates, only among one chunk per exact group
+        unique = list(first.values())
+        shingle_sets = [shingles(texts[i], self.shingle_size) for i in unique]
+        signatures = [self.signature(s) for s in shingle_sets]
+        near = 0
+        for x, y in self.candidate_pairs(signatures):
+            i, j = unique[x], unique[y]
+            if groups.find(i) != groups.find(j) and jaccard(shingle_sets[x], shingle_sets[y]) >= self.threshold:
+                groups.union(i, j)
+                near += 1
+        report["near_duplicates"] = near
+
+        # Merge every group into its longest chunk, keeping all the links
+        members = {}
+        for i in range(len(records)):
+            if keep[i]:
+                members.setdefault(groups.find(i), []).append(i)
+
+        compacted = []
+        for root in sorted(members):
+            group = members[root]
+            best = max(group, key=lambda i: len(texts[i]))
+            merged = dict(records[best])
+            merged["Links"] = list(dict.fromkeys(records[i]['Link'] for i in group))
+            compacted.append((min(group), merged))
+        compacted = [record for _, record in sorted(compacted, key=lambda item: item[0])]
+
+        report["chunks_out"] = len(compacted)
+        report["chars_out"] = sum(len(normalize(r['Content'])) for r in compacted)
+        report["chunk_reduction"] = 1 - report["chunks_out"] / report["chunks_in"] if records else 0.0
+        report["char_reduction"] = 1 - report["chars_out"] / report["chars_in"] if records else 0.0
+        return compacted, report
+
+
+"""
+Dedups several data files together (the two sites share a lot) and writes one
+compacted '.jsonl' per input file into out_folder. A merged chunk goes in the
+file of the chunk it was made from.
+Outputs:
+    (list of written files, report dict)
+"""
+def compact_files(files, out_folder=COMPACT_FOLDER, **options):
+    # Remember which file every record came from
+    records = [dict(record, _source=file) for file in files for record in my_utils.iter_records(file)]
+    compacted, report = ChunkDeduplicator(**options).dedup(records)
+
+    os.makedirs(out_folder, exist_ok=True)
+    outputs = []
+    for file in files:
+        out = compacted_name(file, out_folder)
+        with open(out, "w", encoding="utf-8") as f:
+            for record in compacted:
+                if record["_source"] == file:
+                    f.write(json.dumps({k: v for k, v in record.items() if k != "_source"}, ensure_ascii=False) + "\n")
+        outputs.append(out)
+
+    print_report(report)
+    return outputs, report
+
+# datafiles/umd_x_data.json -> datafiles/compact/umd_x_data.jsonl
+def compacted_name(file, out_folder=COMPACT_FOLDER):
+    name = os.path.splitext(os.path.basename(file))[0]
+    return f"{out_folder}/{name}.jsonl"
+
+def print_report(report):
+    print(f"Chunks: {report['chunks_in']} -> {report['chunks_out']} ({report['chunk_reduction']:.1%} fewer), "
+          f"text: {report['chars_in']} -> {report['chars_out']} chars ({report['char_reduction']:.1%} less)")
+    print(f"  contained in another chunk of the page: {report['contained']}, "
+          f"exact duplicates: {report['exact_duplicates']}, near duplicates: {report['near_duplicates']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge duplicate chunks in scraped data files")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--out_folder", default=COMPACT_FOLDER)
+    parser.add_argument("--threshold", type=float, default=0.8)
+    args = parser.parse_args()
+
+    compact_files(args.files, args.out_folder, threshold=args.threshold)
@@ -0,0 +1,96 @@
+import hashlib
+
+import numpy as np
+
+"""
+Different ways of running the same embedding model (all-MiniLM-L6-v2) on CPU.
+    "torch":      the normal full precision SentenceTransformer (the reference)
+    "torch-int8": same model with its Linear layers dynamically quantized to int8
+    "onnx":       the ONNX export run with onnxruntime
+    "onnx-int8":  the int8 quantized ONNX export
+    "hashing":    not the model at all, a hashed bag of words for running
+                  benchmarks offline (see HashingEmbedding)
+All of them have encode_query / encode_document like a SentenceTransformer.
+The ONNX ones need `pip install sentence-transformers[onnx]`.
+"""
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
+BACKENDS = ["torch", "torch-int8", "onnx", "onnx-int8", "hashing"]
+
+# Quantized ONNX file in the model repo, the avx2 one runs on pretty much any x86 CPU
+ONNX_INT8_FILE = "onnx/model_quint8_avx2.onnx"
+
+# Name for a backend's vectors, so caches and saved vectors of different backends never mix
+def embedding_name(backend):
+    return MODEL_NAME if backend == "torch" else f"{MODEL_NAME}-{backend}"
+
+def load_embedding_model(backend="torch", model_name=MODEL_NAME):
+    if backend == "hashing":
+        return HashingEmbedding()
+
+    from sentence_transformers import SentenceTransformer
+
+    if backend == "torch":
+        return SentenceTransformer(model_name)
+
+    if backend == "torch-int8":
+        import torch
+
+        model = SentenceTransformer(model_name, device="cpu")
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    if backend == "onnx":
+        return SentenceTransformer(model_name, backend="onnx")
+
+    if backend == "onnx-int8":
+        return SentenceTransformer(model_name, backend="onnx", model_kwargs={"file_name": ONNX_INT8_FILE})
+
+    raise Exception(f"Unknown embedding backend: {backend}")
+
+"""
+Stand-in for the embedding model that needs no download or torch: every word
+is hashed into one of dim buckets and the counts are normalized. Texts that
+share words end up close, which is enough to exercise search, caching and
+batching in benchmarks. Don't serve with it.
+"""
+class HashingEmbedding:
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode_document(self, texts, batch_size=32, **kwargs):
+        single = isinstance(texts, str)
+        texts = [texts] if single else texts
+
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in text.lower().split():
+                digest = hashlib.md5(word.encode()).digest()
+                vectors[i, int.from_bytes(digest[:4], "little") % self.dim] += 1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.maximum(norms, 1e-12)
+        return vectors[0] if single else vectors
+
+    def encode_query(self, texts, **kwargs):
+        return self.encode_document(texts, **kwargs)
+
+"""
+Checks a model gives (almost) the same embeddings as the reference one.
+Inputs:
+    model, reference: SentenceTransformer models
+    texts: sample texts to compare on
+    tolerance: lowest cosine similarity allowed between the two embeddings of a text
+Outputs:
+    the lowest cosine similarity seen, raises an Exception if it's below tolerance
+"""
+def check_against_reference(model, reference, texts, tolerance=0.99):
+    a = np.asarray(model.encode_document(texts), dtype=np.float32)
+    b = np.asarray(reference.encode_document(texts), dtype=np.float32)
+    cosines = np.sum(a * b, axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+
+    worst = float(cosines.min())
+    if worst < tolerance:
+        raise Exception(f"Embeddings drifted from the reference model: cosine {worst:.4f} < {tolerance}")
+    return worst
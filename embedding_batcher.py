@@ -0,0 +1,58 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+import my_utils
+
+"""
+Micro-batching for query embeddings.
+
+When many chats come in at once, every one of them would run the model on a
+single query. Instead, callers put their query on a queue and wait. A
+background thread takes whatever arrived within max_wait seconds (up to
+max_batch_size queries), embeds them all in one model call, and hands every
+caller back its own vector.
+
+stats() gives how many batches ran, their sizes and how long queries waited.
+"""
+class EmbeddingBatcher:
+    def __init__(self, encode, max_batch_size=32, max_wait=0.002):
+        self.encode_batch = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self.queue = queue.Queue()
+        self.batch_stats = my_utils.BatchStats()
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # Embeds one text, blocking until its batch is done
+    def encode(self, text):
+        future = Future()
+        self.queue.put((text, future, time.perf_counter()))
+        return future.result()
+
+    def run(self):
+        while True:
+            batch = my_utils.collect_batch(self.queue, self.max_batch_size, self.max_wait)
+            started = time.perf_counter()
+            texts = [text for text, _, _ in batch]
+            try:
+                vectors = np.asarray(self.encode_batch(texts))
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            for i, (_, future, _) in enumerate(batch):
+                future.set_result(vectors[i])
+
+            self.batch_stats.add(started, [queued for _, _, queued in batch])
+
+    def stats(self):
+        stats = self.batch_stats.stats()
+        return {"requests": stats.pop("items"), **stats}
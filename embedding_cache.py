@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import metrics
+
+"""
+Cache for embeddings so the same text never goes through the model twice.
+
+Two levels:
+- On disk: a memory-mapped float32 matrix (one row per embedded text) plus a
+  small json index next to it saying which row belongs to which text. Keys are
+  the content hash, and the model name is part of the file name, so switching
+  models never mixes vectors. When the matrix is full the least recently used
+  row gets reused. New rows are only appended to a log next to the index
+  ("key row" lines), the index itself is rewritten once the log gets long, so
+  a cache miss doesn't rewrite the whole index.
+- In memory: an LRU of recent search queries, so asking the same thing again
+  doesn't even need a hash lookup on disk.
+
+Used by VectorDB.embed_documents / VectorDB.embed_query.
+"""
+class EmbeddingCache:
+    def __init__(self, model_name, dim, folder="datafiles/embedding_cache", max_rows=20000, query_cache_size=1024):
+        self.model_name = model_name
+        self.dim = dim
+        self.max_rows = max_rows
+        self.query_cache_size = query_cache_size
+        self.lock = threading.Lock()
+
+        os.makedirs(folder, exist_ok=True)
+        safe_name = model_name.replace('/', '_')
+        self.matrix_file = os.path.join(folder, f"{safe_name}.f32")
+        self.index_file = os.path.join(folder, f"{safe_name}.json")
+        self.log_file = os.path.join(folder, f"{safe_name}.log")
+
+        # key -> row, least recently used first
+        self.rows = OrderedDict()
+        self.log_lines = 0
+        valid = False
+        if os.path.exists(self.index_file) and os.path.exists(self.matrix_file):
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            if saved["dim"] == dim and saved["max_rows"] == max_rows:
+                self.rows = OrderedDict(saved["rows"])
+                valid = True
+                self.replay_log()
+
+        self.matrix = np.memmap(self.matrix_file, dtype=np.float32, mode='r+' if valid else 'w+', shape=(max_rows, dim))
+        if not valid:
+            self.save()
+
+        self.queries = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "query_hits": 0, "query_misses": 0, "evictions": 0}
+
+    @staticmethod
+    def make_key(text, kind):
+        return kind + ":" + hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    """
+    Returns embeddings for texts, only calling encode on the ones we haven't seen.
+    Inputs:
+        texts: list of str
+        encode: function that embeds a list of str (e.g. model.encode_document)
+        kind: "document" or "query", they are cached separately
+    Outputs:
+        float32 array of shape (len(texts), dim)
+    """
+    def get_many(self, texts, encode, kind="document"):
+        keys = [self.make_key(t, kind) for t in texts]
+        result = np.zeros((len(texts), self.dim), dtype=np.float32)
+
+        missing = []
+        with self.lock:
+            for i, key in enumerate(keys):
+                row = self.rows.get(key)
+                if row is not None:
+                    self.rows.move_to_end(key)
+                    result[i] = self.matrix[row]
+                else:
+                    missing.append(i)
+            self.stats["hits"] += len(texts) - len(missing)
+            self.stats["misses"] += len(missing)
+
+        if missing:
+            # Same text can show up more than once in a batch, embed it once
+            unique = list(dict.fromkeys(texts[i] for i in missing))
+            embedded = np.asarray(encode(unique), dtype=np.float32).reshape(len(unique), self.dim)
+            by_text = dict(zip(unique, embedded))
+            for i in missing:
+                result[i] = by_text[texts[i]]
+
+            with self.lock:
+                written = []
+                for text, vector in by_text.items():
+                    key = self.make_key(text, kind)
+                    written.append((key, self.put(key, vector)))
+                self.append_log(written)
+
+        return result
+
+    # Embedding for a search query, served from the in memory LRU when possible
+    def get_query(self, text, encode):
+        with self.lock:
+            if text in self.queries:
+                self.queries.move_to_end(text)
+                self.stats["query_hits"] += 1
+                metrics.cache_outcomes.inc(cache="query_embedding", outcome="hit")
+                return self.queries[text]
+            self.stats["query_misses"] += 1
+        metrics.cache_outcomes.inc(cache="query_embedding", outcome="miss")
+
+        vector = np.asarray(encode(text), dtype=np.float32)
+
+        with self.lock:
+            self.queries[text] = vector
+            if len(self.queries) > self.query_cache_size:
+                self.queries.popitem(last=False)
+        return vector
+
+    # Caller holds the lock
+    def put(self, key, vector):
+        if key in self.rows:
+            row = self.rows[key]
+        elif len(self.rows) < self.max_rows:
+            row = len(self.rows)
+        else:
+            # Full: reuse the row that was used the longest time ago
+            _, row = self.rows.popitem(last=False)
+            self.stats["evictions"] += 1
+
+        self.matrix[row] = vector
+        self.rows[key] = row
+        self.rows.move_to_end(key)
+        return row
+
+    # Rows written since the index was saved. A row given to a new key drops the key it had
+    def replay_log(self):
+        if not os.path.exists(self.log_file):
+            return
+        by_row = {row: key for key, row in self.rows.items()}
+        with open(self.log_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.split()
+                # A line cut short by a crash is skipped
+                if not line.endswith("\n") or len(parts) != 2 or not parts[1].isdigit():
+                    continue
+                key, row = parts[0], int(parts[1])
+                old = by_row.get(row)
+                if old is not None and old != key:
+                    self.rows.pop(old, None)
+                self.rows.pop(key, None)
+                self.rows[key] = row
+                by_row[row] = key
+                self.log_lines += 1
+
+    # Caller holds the lock. The vectors go to disk before the lines that point at them
+    def append_log(self, written):
+        self.matrix.flush()
+        with open(self.log_file, 'a', encoding='utf-8') as f:
+            f.write("".join(f"{key} {row}\n" for key, row in written))
+        self.log_lines += len(written)
+        if self.log_lines > self.max_rows:
+            self.save()
+
+    # Caller holds the lock. Writes the whole index and starts a new log
+    def save(self):
+        self.matrix.flush()
+        with open(self.index_file, 'w', encoding='utf-8') as f:
+            json.dump({"dim": self.dim, "max_rows": self.max_rows, "rows": list(self.rows.items())}, f)
+        open(self.log_file, 'w').close()
+        self.log_lines = 0
+
+    def hit_rate(self):
+        total = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / total if total else 0.0
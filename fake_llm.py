@@ -0,0 +1,61 @@
+import asyncio
+import time
+
+"""
+Stand-in for ChatGoogleGenerativeAI so the RAG pipeline can run without
+network or an API key (tests, benchmarks). It has the same methods UMDRAG
+uses: invoke, ainvoke, stream and astream.
+
+The answer is just the words in answer (or an echo of the end of the prompt),
+streamed one word at a time with token_delay seconds between words, after
+first_token_delay seconds of "thinking".
+"""
+class FakeMessage:
+    def __init__(self, content):
+        self.content = content
+
+    # Chunks add up like langchain's AIMessageChunk
+    def __add__(self, other):
+        return FakeMessage(self.content + other.content)
+
+    def __repr__(self):
+        return f"FakeMessage({self.content!r})"
+
+
+class FakeStreamingLLM:
+    def __init__(self, answer=None, first_token_delay=0.0, token_delay=0.0):
+        self.answer = answer
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.calls = 0
+        self.prompts = []
+
+    def tokens(self, prompt):
+        self.calls += 1
+        self.prompts.append(prompt)
+        text = self.answer if self.answer is not None else "You asked: " + prompt[-200:]
+        words = text.split(" ")
+        return [word if i == 0 else " " + word for i, word in enumerate(words)]
+
+    def invoke(self, prompt):
+        return FakeMessage("".join(chunk.content for chunk in self.stream(prompt)))
+
+    def stream(self, prompt):
+        time.sleep(self.first_token_delay)
+        for i, token in enumerate(self.tokens(prompt)):
+            if i:
+                time.sleep(self.token_delay)
+            yield FakeMessage(token)
+
+    async def ainvoke(self, prompt):
+        content = ""
+        async for chunk in self.astream(prompt):
+            content += chunk.content
+        return FakeMessage(content)
+
+    async def astream(self, prompt):
+        await asyncio.sleep(self.first_token_delay)
+        for i, token in enumerate(self.tokens(prompt)):
+            if i:
+                await asyncio.sleep(self.token_delay)
+            yield FakeMessage(token)
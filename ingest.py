@@ -0,0 +1,241 @@
+import argparse
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import my_utils
+import pineconing
+
+"""
+Pipelined ingest of the scraped data files into a VectorDB.
+
+Three stages run at the same time, connected by small bounded queues:
+    read:   reads records from the files and gives them their ids
+    embed:  embeds embed_batch_size records at a time
+    upsert: sends upsert_batch_size vectors per request, with up to
+            max_in_flight requests at once, retrying failed ones with
+            exponential backoff
+So a full re-index takes about as long as the slowest stage instead of all
+three added up. Progress is printed as batches get upserted, and run()
+returns the chunks/sec of every stage. A stage's seconds are only the time it
+was busy (not waiting on the stage before it), for upsert that's the time at
+least one request was out.
+
+Command line (from the repo root):
+    python ingest.py datafiles/umd_sustainability_data.json datafiles/umd_sustainingprogress_data.json [--backend local] [--dedup]
+--dedup first merges duplicate chunks (see dedup.py) and ingests the files in
+datafiles/compact/ instead. Their chunks have their own ids, so start the app
+with DATA_FILES set to those files too.
+"""
+
+# Put on a queue to tell the next stage there's nothing more coming
+DONE = object()
+
+
+class IngestPipeline:
+    def __init__(self, vdb, embed_batch_size=64, upsert_batch_size=200, max_in_flight=4,
+                 retries=4, backoff=0.5, namespace="file_data", queue_size=8):
+        self.vdb = vdb
+        self.embed_batch_size = embed_batch_size
+        self.upsert_batch_size = upsert_batch_size
+        self.max_in_flight = max_in_flight
+        self.retries = retries
+        self.backoff = backoff
+        self.namespace = namespace
+        self.queue_size = queue_size
+
+    def run(self, files: list):
+        self.errors = []
+        self.lock = threading.Lock()
+        self.stats = {stage: {"chunks": 0, "seconds": 0.0} for stage in ("read", "embed", "upsert")}
+        self.requests_out = 0
+        self.busy_since = 0.0
+
+        parsed = queue.Queue(maxsize=self.queue_size)
+        embedded = queue.Queue(maxsize=self.queue_size)
+        stages = [
+            threading.Thread(target=self.read_stage, args=(files, parsed)),
+            threading.Thread(target=self.embed_stage, args=(parsed, embedded)),
+            threading.Thread(target=self.upsert_stage, args=(embedded,)),
+        ]
+
+        start = time.perf_counter()
+        for stage in stages:
+            stage.start()
+        for stage in stages:
+            stage.join()
+        total = time.perf_counter() - start
+
+        report = self.report(total)
+        if self.errors:
+            raise self.errors[0]
+        return report
+
+    def add_stat(self, stage, chunks, seconds):
+        with self.lock:
+            self.stats[stage]["chunks"] += chunks
+            self.stats[stage]["seconds"] += seconds
+
+    # Like queue.put, but gives up if another stage failed so nothing hangs
+    def put(self, q, item):
+        while not self.errors:
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read_stage(self, files, parsed):
+        try:
+            for file in files:
+                fname = pineconing.get_file_name(file)
+                page_counts = {}
+                batches = my_utils.iter_batches(my_utils.iter_records(file), self.embed_batch_size)
+
+                while True:
+                    start = time.perf_counter()
+                    batch = next(batches, None)
+                    if batch is None:
+                        break
+                    ids = pineconing.assign_chunk_ids(fname, batch, page_counts)
+                    self.add_stat("read", len(batch), time.perf_counter() - start)
+
+                    if not self.put(parsed, (ids, batch)):
+                        return
+        except Exception as e:
+            self.errors.append(e)
+        finally:
+            self.put_done(parsed)
+
+    def embed_stage(self, parsed, embedded):
+        try:
+            while True:
+                item = parsed.get()
+                if item is DONE or self.errors:
+                    break
+
+                ids, batch = item
+                start = time.perf_counter()
+                vectors = self.vdb.make_vectors(ids, batch)
+                self.add_stat("embed", len(vectors), time.perf_counter() - start)
+
+                if not self.put(embedded, vectors):
+                    return
+        except Exception as e:
+            self.errors.append(e)
+        finally:
+            self.put_done(embedded)
+
+    def upsert_stage(self, embedded):
+        in_flight = threading.BoundedSemaphore(self.max_in_flight)
+
+        # A request that ran out of retries is an error right away, so the other stages stop too
+        def done(future):
+            if future.exception() is not None:
+                self.errors.append(future.exception())
+            in_flight.release()
+
+        def send(vectors):
+            in_flight.acquire()
+            future = pool.submit(self.upsert_with_retry, vectors)
+            future.add_done_callback(done)
+
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as pool:
+            try:
+                buffer = []
+                while True:
+                    item = embedded.get()
+                    if item is DONE or self.errors:
+                        break
+
+                    buffer.extend(item)
+                    while len(buffer) >= self.upsert_batch_size:
+                        send(buffer[:self.upsert_batch_size])
+                        buffer = buffer[self.upsert_batch_size:]
+
+                # Last partial batch (never an empty one)
+                if buffer and not self.errors:
+                    send(buffer)
+            except Exception as e:
+                self.errors.append(e)
+        # Leaving the pool waited for every request, their errors are already in self.errors
+
+    def upsert_with_retry(self, vectors):
+        my_utils.retry(lambda: self.upsert_once(vectors), self.retries, self.backoff, "Upsert")
+
+        with self.lock:
+            self.stats["upsert"]["chunks"] += len(vectors)
+            read = self.stats["read"]["chunks"]
+            done = self.stats["upsert"]["chunks"]
+        print(f"Upserted {done}/{read} chunks")
+
+    def upsert_once(self, vectors):
+        self.request_started()
+        try:
+            self.vdb.upsert(vectors, self.namespace)
+        finally:
+            self.request_finished()
+
+    # Requests overlap, so the upsert stage is busy from the first one going out until none are left
+    def request_started(self):
+        with self.lock:
+            if self.requests_out == 0:
+                self.busy_since = time.perf_counter()
+            self.requests_out += 1
+
+    def request_finished(self):
+        with self.lock:
+            self.requests_out -= 1
+            if self.requests_out == 0:
+                self.stats["upsert"]["seconds"] += time.perf_counter() - self.busy_since
+
+    # Makes sure the next stage hears DONE even when its queue is full
+    def put_done(self, q):
+        while True:
+            try:
+                q.put(DONE, timeout=0.1)
+                return
+            except queue.Full:
+                # The next stage stopped because of an error, drop something so DONE fits
+                if self.errors:
+                    try:
+                        q.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def report(self, total):
+        report = {"total_seconds": total}
+        for stage, s in self.stats.items():
+            rate = s["chunks"] / s["seconds"] if s["seconds"] else 0.0
+            report[stage] = {"chunks": s["chunks"], "seconds": s["seconds"], "chunks_per_sec": rate}
+            print(f"{stage:>6}: {s['chunks']} chunks in {s['seconds']:.2f}s ({rate:.1f} chunks/sec)")
+
+        total_rate = self.stats["upsert"]["chunks"] / total if total else 0.0
+        print(f" total: {total:.2f}s ({total_rate:.1f} chunks/sec)")
+        return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embed and upsert scraped data files")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--backend", default="pinecone")
+    parser.add_argument("--embed_batch_size", type=int, default=64)
+    parser.add_argument("--upsert_batch_size", type=int, default=200)
+    parser.add_argument("--max_in_flight", type=int, default=4)
+    parser.add_argument("--dedup", action="store_true", help="merge duplicate chunks first and ingest the compacted files")
+    args = parser.parse_args()
+
+    files = args.files
+    if args.dedup:
+        from dedup import compact_files
+
+        files, _ = compact_files(files)
+        print(f"Start the app with DATA_FILES={','.join(files)}")
+
+    vdb = pineconing.VectorDB(backend=args.backend, batch_queries=False)
+    vdb.upsert_files(files,
+                     embed_batch_size=args.embed_batch_size,
+                     upsert_batch_size=args.upsert_batch_size,
+                     max_in_flight=args.max_in_flight)
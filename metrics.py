@@ -0,0 +1,192 @@
+import bisect
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+"""
+Local metrics for the RAG hot path, no outside service needed.
+
+- Counter: a number that only goes up (e.g. cache hits)
+- Histogram: counts of values in fixed buckets, plus their sum and count
+  (e.g. how long every stage takes)
+- Gauge: a function that is only called when the metrics are read
+Everything lives in a Registry, and render() gives the Prometheus text format
+(app.py serves it on /metrics).
+
+span("stage") times a block of code into rag_stage_seconds. If JSON logs are on
+(RAG_JSON_LOGS=1, or registry.log_to(stream)) every span is also written as one
+json line, with a trace id so the lines of one question can be grouped.
+
+Recording is a perf_counter call, a dict lookup and a short lock, so it's
+cheap enough to leave on all the time.
+"""
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000)
+CHUNK_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 10, 20)
+
+# Id of the question being answered, set by new_trace()
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+def format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+def format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(label, "") for label in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_labels(self.labels, key)} {format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, buckets, labels=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labels = labels
+        self.lock = threading.Lock()
+        self.values = {}  # label values -> [bucket counts..., +Inf count], sum
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(label, "") for label in self.labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, (counts, total) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += count
+                    le = bound if bound == "+Inf" else format_value(bound)
+                    lines.append(f"{self.name}_bucket{format_labels(self.labels, key, ('le', le))} {cumulative}")
+                lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {format_value(total)}")
+                lines.append(f"{self.name}_count{format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, help, read):
+        self.name = name
+        self.help = help
+        self.read = read
+
+    def render(self):
+        try:
+            value = self.read()
+        except Exception:
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {format_value(value)}"]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.log_lock = threading.Lock()
+        self.log_stream = sys.stderr if os.environ.get("RAG_JSON_LOGS") == "1" else None
+
+    def add(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.metrics.get(name) or self.add(Counter(name, help, labels))
+
+    def histogram(self, name, help, buckets=TIME_BUCKETS, labels=()):
+        return self.metrics.get(name) or self.add(Histogram(name, help, buckets, labels))
+
+    # read() is called every time the metrics are rendered, errors just skip the gauge
+    def gauge(self, name, help, read):
+        return self.add(Gauge(name, help, read))
+
+    # Write every span as a json line to stream (None turns it off)
+    def log_to(self, stream):
+        self.log_stream = stream
+
+    def log(self, event, **fields):
+        if self.log_stream is None:
+            return
+        record = {"time": round(time.time(), 3), "event": event, "trace": current_trace.get(), **fields}
+        with self.log_lock:
+            self.log_stream.write(json.dumps(record) + "\n")
+            self.log_stream.flush()
+
+    def render(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class Span:
+    def __init__(self, stage, fields):
+        self.stage = stage
+        self.fields = fields
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.stage, time.perf_counter() - self.start, error=exc[0] is not None, **self.fields)
+
+
+# Everything in the app records into this one
+registry = Registry()
+
+stage_seconds = registry.histogram("rag_stage_seconds", "Time spent in each RAG stage", TIME_BUCKETS, ("stage",))
+requests_total = registry.counter("rag_requests_total", "Questions answered", ("method",))
+retrieved_chunks = registry.counter("rag_retrieved_chunks_total", "Chunks returned by the vector search")
+filtered_chunks = registry.counter("rag_filtered_chunks_total", "Chunks dropped by the score threshold")
+context_chunks = registry.histogram("rag_context_chunks", "Chunks that went into a prompt", CHUNK_BUCKETS)
+prompt_tokens = registry.histogram("rag_prompt_tokens", "Estimated prompt size in tokens", TOKEN_BUCKETS)
+cache_outcomes = registry.counter("rag_cache_total", "Cache lookups", ("cache", "outcome"))
+
+# Use as: with metrics.span("embed"): ...
+def span(stage, **fields):
+    return Span(stage, fields)
+
+# Same as a span, for stages that can't be wrapped in a with block (e.g. across yields)
+def record(stage, seconds, **fields):
+    stage_seconds.observe(seconds, stage=stage)
+    if registry.log_stream is not None:
+        registry.log("span", stage=stage, ms=round(seconds * 1000, 3), **fields)
+
+# Starts a new trace id for the json logs (one per question)
+def new_trace():
+    trace = uuid.uuid4().hex[:12]
+    current_trace.set(trace)
+    return trace
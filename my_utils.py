@@ -1,3 +1,9 @@
+import json
+import os
+import queue
+import threading
+import time
+
 """
 Takes a file and returns a string of the whole file
 If specified, replaces all newlines with a space to sort of 'concatenate'
@@ -13,4 +19,164 @@ def read_text_file(file, concat=True):
         text = f.read()
         if concat:
             text = text.replace("\n", " ")
-    return text
\ No newline at end of file
+    return text
+
+"""
+Reads a scraped data file one record at a time.
+Works for both the old '.json' files (a list dumped with json.dump) and the
+streamed '.jsonl' files (one record per line). For '.jsonl' only one line is in
+memory at a time, and a half written last line (crashed crawl) is skipped.
+Inputs:
+    file: file path
+Outputs:
+    generator of dicts
+"""
+def iter_records(file):
+    if not file.endswith('.jsonl'):
+        with open(file, 'r', encoding='utf-8') as f:
+            yield from json.load(f)
+        return
+
+    with open(file, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.endswith('\n'):
+                break
+            if line.strip():
+                yield json.loads(line)
+
+
+"""
+Groups anything iterable into lists of at most batch_size items.
+Inputs:
+    iterable: anything you can loop over
+    batch_size: max size of each list
+Outputs:
+    generator of lists
+"""
+def iter_batches(iterable, batch_size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+"""
+Cuts a '.jsonl' file back to its last complete line, so appending to a file
+left behind by a crash doesn't glue a new record onto a broken one.
+Only reads the end of the file (block_size bytes at a time), not the whole thing.
+Inputs:
+    file: file path
+"""
+def truncate_partial_line(file, block_size=65536):
+    with open(file, 'rb+') as f:
+        size = f.seek(0, os.SEEK_END)
+        # Read back from the end a block at a time until we find the last newline
+        pos = size
+        end = 0
+        while pos > 0:
+            start = max(pos - block_size, 0)
+            f.seek(start)
+            newline = f.read(pos - start).rfind(b'\n')
+            if newline != -1:
+                end = start + newline + 1
+                break
+            pos = start
+        if end != size:
+            f.truncate(end)
+
+
+"""
+Takes off the "Site Title / Header / Link" lines that clean_contents adds to
+the end of every chunk, leaving just the text from the page.
+Inputs:
+    content: a chunk's Content
+Outputs:
+    the page text
+"""
+def strip_chunk_metadata(content):
+    end = content.rfind("\nSite Title: ")
+    return content[:end] if end != -1 else content
+
+
+"""
+Takes the next batch off a queue: blocks for the first item, then takes
+whatever else arrives within max_wait seconds, up to max_batch_size items.
+Used by the background threads that batch work (embedding_batcher.py,
+own_data_writer.py).
+Inputs:
+    q: queue.Queue
+    max_batch_size: most items in one batch
+    max_wait: seconds to wait for more items after the first
+Outputs:
+    list of items
+"""
+def collect_batch(q, max_batch_size, max_wait):
+    batch = [q.get()]
+    deadline = time.perf_counter() + max_wait
+    while len(batch) < max_batch_size:
+        remaining = deadline - time.perf_counter()
+        try:
+            if remaining > 0:
+                batch.append(q.get(timeout=remaining))
+            else:
+                batch.append(q.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+
+# Batch sizes and how long items waited in the queue, for the stats() of the batching threads
+class BatchStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.batch_sizes = {}  # batch size -> how many batches had that size
+        self.items = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    # started: when the batch was taken, queued: when each of its items was put on the queue
+    def add(self, started, queued):
+        with self.lock:
+            self.batch_sizes[len(queued)] = self.batch_sizes.get(len(queued), 0) + 1
+            self.items += len(queued)
+            for t in queued:
+                self.total_wait += started - t
+                self.max_wait = max(self.max_wait, started - t)
+
+    def stats(self):
+        with self.lock:
+            batches = sum(self.batch_sizes.values())
+            return {
+                "items": self.items,
+                "batches": batches,
+                "mean_batch_size": self.items / batches if batches else 0.0,
+                "batch_sizes": dict(sorted(self.batch_sizes.items())),
+                "mean_queue_wait_ms": 1000 * self.total_wait / self.items if self.items else 0.0,
+                "max_queue_wait_ms": 1000 * self.max_wait,
+            }
+
+
+"""
+Calls fn() and returns what it returns. If it raises, it is tried again up to
+retries more times, waiting backoff, 2 * backoff, 4 * backoff... seconds in
+between. The last error is raised.
+Inputs:
+    fn: function without arguments (e.g. one upsert request)
+    retries: how many times to try again
+    backoff: seconds to wait before the first retry
+    what: name for the retry messages
+"""
+def retry(fn, retries, backoff, what="Request"):
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == retries:
+                raise
+            wait = backoff * 2 ** attempt
+            print(f"{what} failed ({e}), retrying in {wait:.1f}s")
+            time.sleep(wait)
@@ -0,0 +1,220 @@
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+"""
+Local copy of the user added facts (the own_data namespace) in SQLite.
+
+VectorDB.upsert_own_data and delete_by_id keep it in sync, so showing the
+added data is a query on this file instead of listing and fetching every
+vector from the vector store. page() only reads one page of rows (newest
+first) and the total is kept in memory, so opening the accordion costs the
+same with 10 facts or 100,000.
+
+It also hands out the ids of new facts: add_pending() takes the next id and
+saves the fact in one SQLite transaction, so two submissions at the same time
+(even from different processes) can never get the same id. The fact stays
+"pending" until own_data_writer.py has embedded and upserted it, so nothing
+is lost if the app stops in between.
+
+If the vector store gets changed some other way (e.g. deleting from the
+pinecone console), reconcile() finds the difference and fixes the catalogue.
+A fact that was only stored a little while ago and isn't in the vector store
+is made pending again instead of removed (the store may not show it yet, or
+lost it in a crash).
+Run it from the command line (from the repo root):
+    python own_data_catalog.py [--backend local]
+"""
+class OwnDataCatalog:
+    # id_count_file: the old id counter, only read once to start the ids after it
+    def __init__(self, file="datafiles/own_data.sqlite", id_count_file="datafiles/own_data_id_count.txt"):
+        self.file = file
+        self.lock = threading.Lock()
+        # Autocommit, transactions are started by hand in transaction()
+        self.connection = sqlite3.connect(file, check_same_thread=False, timeout=30, isolation_level=None)
+        with self.transaction():
+            self.connection.execute("CREATE TABLE IF NOT EXISTS facts ("
+                                    "id INTEGER PRIMARY KEY, content TEXT NOT NULL, "
+                                    "created TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+            columns = [row[1] for row in self.connection.execute("PRAGMA table_info(facts)")]
+            if "stored" not in columns:
+                self.connection.execute("ALTER TABLE facts ADD COLUMN stored INTEGER NOT NULL DEFAULT 1")
+            if "stored_at" not in columns:
+                # When mark_stored was called (unix time), NULL for facts stored before this column
+                self.connection.execute("ALTER TABLE facts ADD COLUMN stored_at REAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+            if self.connection.execute("SELECT 1 FROM counters WHERE name = 'own_data'").fetchone() is None:
+                next_id = self.connection.execute("SELECT COALESCE(MAX(id) + 1, 0) FROM facts").fetchone()[0]
+                if os.path.exists(id_count_file):
+                    with open(id_count_file) as f:
+                        next_id = max(next_id, int(f.read().strip() or 0))
+                self.connection.execute("INSERT INTO counters (name, value) VALUES ('own_data', ?)", (next_id,))
+            # The counter can never be at or below an id that's already taken
+            self.connection.execute("UPDATE counters SET value = MAX(value, (SELECT COALESCE(MAX(id) + 1, 0) FROM facts)) "
+                                    "WHERE name = 'own_data'")
+        self.total = self.connection.execute("SELECT COUNT(*) FROM facts").fetchone()[0]
+
+    # BEGIN IMMEDIATE takes the write lock right away, so other processes wait instead of failing halfway
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    def __len__(self):
+        return self.total
+
+    # Adds a fact that already has an id (e.g. found in the vector store by reconcile)
+    def add(self, id, content):
+        with self.transaction():
+            exists = self.connection.execute("SELECT 1 FROM facts WHERE id = ?", (int(id),)).fetchone()
+            self.connection.execute("INSERT OR REPLACE INTO facts (id, content, stored) VALUES (?, ?, 1)", (int(id), content))
+            # New ids from add_pending have to come after it
+            self.connection.execute("UPDATE counters SET value = MAX(value, ?) WHERE name = 'own_data'", (int(id) + 1,))
+            if not exists:
+                self.total += 1
+
+    # Gives the fact the next id and saves it as pending, in one transaction. Returns the id
+    def add_pending(self, content):
+        with self.transaction():
+            id = self.connection.execute("SELECT value FROM counters WHERE name = 'own_data'").fetchone()[0]
+            self.connection.execute("UPDATE counters SET value = ? WHERE name = 'own_data'", (id + 1,))
+            self.connection.execute("INSERT INTO facts (id, content, stored) VALUES (?, ?, 0)", (id, content))
+            self.total += 1
+        return id
+
+    # The facts are in the vector store now
+    def mark_stored(self, ids):
+        now = time.time()
+        with self.transaction():
+            self.connection.executemany("UPDATE facts SET stored = 1, stored_at = ? WHERE id = ?",
+                                        [(now, int(id)) for id in ids])
+
+    # The facts have to be written again
+    def mark_pending(self, ids):
+        with self.transaction():
+            self.connection.executemany("UPDATE facts SET stored = 0 WHERE id = ?", [(int(id),) for id in ids])
+
+    # Ids of facts marked stored within the last seconds
+    def stored_since(self, seconds):
+        with self.lock:
+            return {row[0] for row in self.connection.execute("SELECT id FROM facts WHERE stored = 1 AND stored_at > ?",
+                                                              (time.time() - seconds,))}
+
+    # [(id, content)] of facts that were never written to the vector store
+    def pending(self):
+        with self.lock:
+            return self.connection.execute("SELECT id, content FROM facts WHERE stored = 0 ORDER BY id").fetchall()
+
+    def remove(self, id):
+        with self.transaction():
+            cursor = self.connection.execute("DELETE FROM facts WHERE id = ?", (int(id),))
+            self.total -= cursor.rowcount
+
+    def get(self, id):
+        with self.lock:
+            row = self.connection.execute("SELECT content FROM facts WHERE id = ?", (int(id),)).fetchone()
+        return row[0] if row else None
+
+    def ids(self, stored_only=False):
+        with self.lock:
+            where = " WHERE stored = 1" if stored_only else ""
+            return {row[0] for row in self.connection.execute("SELECT id FROM facts" + where)}
+
+    # [(id, content)] for every fact, oldest first
+    def all(self):
+        with self.lock:
+            return self.connection.execute("SELECT id, content FROM facts ORDER BY id").fetchall()
+
+    # Number of facts, or of facts containing search
+    def count(self, search=""):
+        if not search:
+            return self.total
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM facts WHERE content LIKE ? ESCAPE '\\'",
+                                           (self.like_pattern(search),)).fetchone()[0]
+
+    """
+    One page of facts, newest first.
+    Inputs:
+        page: page number, starting at 1
+        page_size: facts per page
+        search: only facts containing this text (case insensitive)
+    Outputs:
+        [(id, content)]
+    """
+    def page(self, page=1, page_size=20, search=""):
+        offset = (max(page, 1) - 1) * page_size
+        with self.lock:
+            if not search:
+                return self.connection.execute("SELECT id, content FROM facts ORDER BY id DESC LIMIT ? OFFSET ?",
+                                               (page_size, offset)).fetchall()
+            return self.connection.execute("SELECT id, content FROM facts WHERE content LIKE ? ESCAPE '\\' "
+                                           "ORDER BY id DESC LIMIT ? OFFSET ?",
+                                           (self.like_pattern(search), page_size, offset)).fetchall()
+
+    @staticmethod
+    def like_pattern(search):
+        escaped = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return f"%{escaped}%"
+
+    """
+    Makes the catalogue match the own_data namespace of vdb: facts missing here
+    are fetched and added, facts that aren't in the vector store any more are
+    removed (except pending ones, the writer is still on those).
+    Inputs:
+        recent: facts stored less than this many seconds ago that aren't in
+            the vector store are made pending again instead of removed
+        requeue: called with [(id, content)] of those facts (e.g. the writer's
+            requeue), so they get written again
+    Outputs:
+        {"stored", "catalog", "added", "removed", "requeued"} counts
+    """
+    def reconcile(self, vdb, namespace="own_data", fetch_batch_size=100, recent=600, requeue=None):
+        stored = set()
+        for ids in vdb.list(namespace=namespace):
+            stored.update(ids)
+        catalog = {f"{namespace}_{id}" for id in self.ids(stored_only=True)}
+
+        missing = sorted(stored - catalog)
+        added = 0
+        for start in range(0, len(missing), fetch_batch_size):
+            vectors = vdb.fetch(missing[start:start + fetch_batch_size], namespace=namespace)
+            for key, vector in vectors.items():
+                self.add(key.rsplit("_", 1)[1], vector["metadata"]["Content"])
+                added += 1
+
+        extra = {int(key.rsplit("_", 1)[1]) for key in catalog - stored}
+        requeued = sorted(extra & self.stored_since(recent))
+        for id in extra.difference(requeued):
+            self.remove(id)
+        if requeued:
+            self.mark_pending(requeued)
+            if requeue is not None:
+                requeue([(id, self.get(id)) for id in requeued])
+
+        report = {"stored": len(stored), "catalog": self.total, "added": added,
+                  "removed": len(extra) - len(requeued), "requeued": len(requeued)}
+        print(f"Own data reconcile: {report}")
+        return report
+
+
+if __name__ == "__main__":
+    import pineconing
+
+    parser = argparse.ArgumentParser(description="Sync the local own data catalogue with the vector store")
+    parser.add_argument("--backend", default="pinecone")
+    args = parser.parse_args()
+
+    vdb = pineconing.VectorDB(backend=args.backend, batch_queries=False)
+    vdb.reconcile_own_data()
+    vdb.own_data_writer.flush()
@@ -0,0 +1,101 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import my_utils
+
+"""
+Write-behind queue for user added facts.
+
+submit() saves the fact in the own data catalogue right away (that's where its
+id comes from, see own_data_catalog.py) and returns without touching the
+model or the vector store. A background thread takes whatever facts arrived
+within max_wait seconds (up to max_batch_size), embeds them in one model call
+and upserts them in one request, retrying with backoff if the upsert fails.
+A backend that saves to disk later (LocalBackend) is flushed first, then
+they're marked as stored in the catalogue, so a fact marked stored is never
+only in memory.
+
+Facts still pending from a previous run (the app stopped before they were
+written) are queued again when the writer starts.
+
+stats() gives how many facts and batches were written and how long facts waited.
+"""
+class OwnDataWriter:
+    def __init__(self, vdb, max_batch_size=32, max_wait=0.05, retries=3, backoff=0.5, namespace="own_data"):
+        self.vdb = vdb
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.retries = retries
+        self.backoff = backoff
+        self.namespace = namespace
+
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.batch_stats = my_utils.BatchStats()
+        self.failed = 0
+
+        for id, content in vdb.own_data.pending():
+            self.queue.put((id, content, Future(), time.perf_counter()))
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # Returns (id, Future) right away, the future is done (with the id) once the fact is in the vector store
+    def submit(self, content):
+        id = self.vdb.own_data.add_pending(content)
+        future = Future()
+        self.queue.put((id, content, future, time.perf_counter()))
+        return id, future
+
+    # Queues facts [(id, content)] that are already in the catalogue again (see OwnDataCatalog.reconcile)
+    def requeue(self, facts):
+        for id, content in facts:
+            self.queue.put((id, content, Future(), time.perf_counter()))
+
+    # Blocks until everything submitted so far has been written (or failed)
+    def flush(self):
+        self.queue.join()
+
+    def run(self):
+        while True:
+            batch = my_utils.collect_batch(self.queue, self.max_batch_size, self.max_wait)
+            try:
+                self.write(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def write(self, batch):
+        started = time.perf_counter()
+        ids = [id for id, _, _, _ in batch]
+        try:
+            # Same embedding the single fact upsert always used (encode_query)
+            embedded = self.vdb.embed_own_data([content for _, content, _, _ in batch])
+            vectors = [{"id": f"{self.namespace}_{id}", "values": embedded[i], "metadata": {"Content": content}}
+                       for i, (id, content, _, _) in enumerate(batch)]
+            my_utils.retry(lambda: self.vdb.upsert(vectors, self.namespace), self.retries, self.backoff,
+                           "Added facts upsert")
+            flush = getattr(self.vdb.backend, "flush", None)
+            if flush is not None:
+                flush()
+            self.vdb.own_data.mark_stored(ids)
+        except Exception as e:
+            # They stay pending in the catalogue and get another try next time the writer starts
+            print(f"Failed to write {len(batch)} added facts: {e}")
+            with self.lock:
+                self.failed += len(batch)
+            for _, _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        for id, _, future, _ in batch:
+            future.set_result(id)
+
+        self.batch_stats.add(started, [queued for _, _, _, queued in batch])
+
+    def stats(self):
+        stats = self.batch_stats.stats()
+        with self.lock:
+            return {"written": stats.pop("items"), "failed": self.failed, **stats}
@@ -1,156 +1,366 @@
-from pinecone import Pinecone, ServerlessSpec
-
 import time
-import json
 import re
-from sentence_transformers import SentenceTransformer
+import hashlib
+import my_utils
+from embedding_cache import EmbeddingCache
+from embedding_batcher import EmbeddingBatcher
+from vector_backends import PineconeBackend, LocalBackend, IVFBackend
+from embedding_backends import embedding_name, load_embedding_model, check_against_reference
+from bm25 import BM25Index
+import metrics
+from own_data_catalog import OwnDataCatalog
+from own_data_writer import OwnDataWriter
+from chunk_store import ChunkStore, slim_metadata
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from dotenv import load_dotenv
 
+# Name of a 'json'/'jsonl' data file, e.g. datafiles/umd_sustainability_data.json -> sustainability
+# A file one folder down gets the folder in front, e.g. datafiles/compact/umd_sustainability_data.jsonl
+# -> compact_sustainability, so the compacted chunks never share ids with the original ones
+def get_file_name(fname):
+    file_re = re.compile(r'^datafiles/(?:([A-Za-z0-9_]+)/)?umd_([A-Za-z0-9]*)_data.jsonl?$')
+
+    matched = re.match(file_re, fname)
+    if matched:
+        folder, name = matched.groups()
+        return f"{folder}_{name}" if folder else name
+    else:
+        raise Exception("Not good file name")
+
+"""
+Vector id of the j-th chunk scraped from a page.
+Ids are tied to the page (not to the position in the file) so that a re-crawl
+can replace or delete one page's chunks without touching the rest.
+"""
+def page_prefix(fname, link):
+    return f"{fname}_{hashlib.md5(link.encode('utf-8')).hexdigest()[:10]}_"
+
+def chunk_id(fname, link, j):
+    return f"{page_prefix(fname, link)}{j}"
+
+"""
+Ids for a batch of scraped records.
+page_counts keeps how many chunks of each page we've seen so far, pass the
+same dict for every batch of a file so the ids keep counting up.
+"""
+def assign_chunk_ids(fname, data, page_counts):
+    ids = []
+    for d in data:
+        j = page_counts.get(d['Link'], 0)
+        page_counts[d['Link']] = j + 1
+        ids.append(chunk_id(fname, d['Link'], j))
+    return ids
+
+# Ids from before they were tied to the page: <fname>_<position in the file>
+def legacy_id_re(fname):
+    return re.compile(rf'^{re.escape(fname)}_\d+$')
+
 class VectorDB:
     
     """
-    Initiates a pinecone index and embeddings:
-    self.index
+    Initiates a vector storage backend and embeddings:
+    self.backend
     self.embedding_model
+
+    backend:
+    - "pinecone": the pinecone serverless index (self.index is the pinecone index)
+    - "local": numpy index on disk in datafiles/local_index, works without network
+    - "ivf": same as local but with an approximate index (faster on big corpora)
+    backend_options: extra arguments for the backend, e.g. {"nprobe": 16} for "ivf"
+    batch_queries: embed queries that arrive at the same time in one model call
+    embedding_backend: how to run the embedding model, see embedding_backends.py
+    ("torch", "torch-int8", "onnx", "onnx-int8")
+    check_embeddings: compare the embedding backend against the full precision
+    model on some of our data first. "fail" (or True) refuses to start if they
+    differ too much, "warn" only prints it, False skips the check. Never done
+    for "torch" (it is the reference) or "hashing" (not the model at all)
+    own_data_file: SQLite file with a local copy of the user added facts (see own_data_catalog.py)
+    embedding_model: an already loaded model to use instead of loading embedding_backend
+    (e.g. serve.WorkerPool, which sends the work to other processes)
+    chunk_store_folder: where the text and fields of the file_data chunks are kept,
+    the vector store only gets their ids and slim metadata (see chunk_store.py)
+    embedding_cache_folder: where the embedding cache keeps its files (see embedding_cache.py)
     """
-    def __init__(self):
+    def __init__(self, backend="pinecone", backend_options=None, batch_queries=True,
+                 embedding_backend="torch", check_embeddings="fail", own_data_file="datafiles/own_data.sqlite",
+                 chunk_store_folder="datafiles/chunk_store", embedding_model=None,
+                 embedding_cache_folder="datafiles/embedding_cache"):
 
         # Load environment variables from .env
         load_dotenv(override=True)
 
-        """
-        Index for SentenceTransformer embeddings: "umdsustainabilitychatbot"
-        - dimension: 384
-
-        Index for GoogleGenerativeAI embeddings (from langchain_google_genai): "umdsustainabilitychatbot2"
-        - dimension: 768
-
-        New Index for GoogleGenerativeAI embeddings (from langchain_google_genai): "umdsustainabilitychatbot3" - FIXING THIS
-        - dimension: 3072
-        """
-        pc = Pinecone()
-        index_name = "umdsustainabilitychatbot3"
-        existing_indexes = [index["name"] for index in pc.list_indexes()]
-
-        # create only if it doesn't exist already
-        if index_name not in existing_indexes:
-            print("Index doesn't exist. Creating...")
-            pc.create_index(
-                name=index_name,
-                dimension= 384, # Add embedding dimensions
-                metric= "cosine",   # Add your similarity metric
-                spec=ServerlessSpec(
-                    cloud="aws",
-                    region="us-east-1"
-            )
-        )
-        else:
-            print("Index exists already")
-
-        self.index = pc.Index(index_name)
-
         """
         Loading embedding model:
         - SentenceTransformer (all-MiniLM-L6-v2)
         - GoogleGenerativeAIEmbeddings (models/gemini-embedding-001)
         """
         # self.embedding_model = GoogleGenerativeAIEmbeddings(model='models/gemini-embedding-001')
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
- 
-    # Files must be in a list format
-    def upsert_files(self, files: list):
+        self.embedding_model = embedding_model or load_embedding_model(embedding_backend)
+        dim = self.embedding_model.get_sentence_embedding_dimension()
 
-        # Inner helper function to get the name of a 'json' file
-        def get_file_name(fname):
-            file_re = re.compile(r'^datafiles/umd_([A-Za-z0-9]*)_data.json$')
+        if check_embeddings and embedding_backend not in ("torch", "hashing"):
+            sample = [d['Content'] for d in my_utils.iter_records("datafiles/umd_sustainability_data.json")][:200]
+            try:
+                worst = check_against_reference(self.embedding_model, load_embedding_model("torch"), sample)
+                print(f"Embedding backend {embedding_backend} ok, lowest cosine to reference: {worst:.4f}")
+            except Exception as e:
+                if check_embeddings != "warn":
+                    raise
+                print(f"Warning: embedding backend {embedding_backend} failed its check: {e}")
 
-            matched = re.match(file_re, fname)
-            if matched:
-                return matched.group(1)
-            else:
-                raise Exception("Not good file name")
+        # Embeddings we've already computed (on disk for chunks, in memory for queries)
+        # Every embedding backend gets its own cache so their vectors never mix
+        self.embedding_cache = EmbeddingCache(embedding_name(embedding_backend), dim, folder=embedding_cache_folder)
 
-        total_to_upsert = [] # List for all vectors that will be upserted
+        # Concurrent searches share one forward pass (see embedding_batcher.py)
+        self.query_batcher = EmbeddingBatcher(self.embedding_model.encode_query) if batch_queries else None
 
-        # Go through all the files
-        for file in files:
-            with open(file, 'r', encoding="utf-8") as f:
-                data = json.load(f)
+        backend_options = backend_options or {}
+        if backend == "local":
+            self.backend = LocalBackend(dim=dim, **backend_options)
+        elif backend == "ivf":
+            self.backend = IVFBackend(dim=dim, **backend_options)
+        elif backend == "pinecone":
+            self.backend = PineconeBackend(dim=dim, **backend_options)
+        else:
+            raise Exception(f"Unknown vector backend: {backend}")
 
-            fname = get_file_name(file)
+        # Raw pinecone index, handy in the notebooks (None for other backends)
+        self.index = getattr(self.backend, "index", None)
+
+        # Goes up every time the stored data changes, so caches know when to drop things
+        self.version = 0
 
-            content = [] # list for the content of one file
+        # BM25 keyword index, only there after build_keyword_index (see bm25.py)
+        self.keyword_index = None
 
-            # Loop through all the data in one file
-            for d in data:
-                content.append(d['Content'])
-            
-            embedded_content = self.embedding_model.encode_document(content) # Embed in batches because it's faster
-            print(f"Embedding everything from {fname} data")
+        # Text of the scraped chunks, read only for the chunks a search keeps (see hydrate)
+        self.chunk_store = ChunkStore(chunk_store_folder)
 
-            # Create pinecone type of data
-            batch = []
-            for i, d in enumerate(data):
-                pinecone_form = {}
-                pinecone_form["id"] = f"{fname}_{i}"
-                pinecone_form["values"] = embedded_content[i]
-                pinecone_form["metadata"] = d
+        # Local copy of own_data, so listing the added facts needs no vector store calls
+        self.own_data = OwnDataCatalog(own_data_file)
+        self.own_data_writer = OwnDataWriter(self)
+
+    # Embeds chunks, skipping the ones that are already in the embedding cache
+    def embed_documents(self, texts):
+        with metrics.span("embed_documents", chunks=len(texts)):
+            return self.embedding_cache.get_many(texts, self.embedding_model.encode_document)
+
+    # Added facts have always been embedded like a query (encode_query), cached apart from the chunks
+    def embed_own_data(self, texts):
+        return self.embedding_cache.get_many(texts, self.embedding_model.encode_query, kind="query")
+
+    # Embeds a search query, repeated queries come from the in memory LRU
+    def embed_query(self, query):
+        encode = self.query_batcher.encode if self.query_batcher else self.embedding_model.encode_query
+        with metrics.span("embed"):
+            return self.embedding_cache.get_query(query, encode)
+ 
+    # Turns scraped records into pinecone vectors with page based ids (see assign_chunk_ids)
+    def to_vectors(self, fname, data, page_counts=None):
+        ids = assign_chunk_ids(fname, data, {} if page_counts is None else page_counts)
+        return self.make_vectors(ids, data)
 
-                batch.append(pinecone_form)
+    def make_vectors(self, ids, data):
+        embedded_content = self.embed_documents([d['Content'] for d in data]) # Embed in batches because it's faster
 
-            total_to_upsert.extend(batch)
-            content.clear()
+        vectors = []
+        for i, d in enumerate(data):
+            pinecone_form = {}
+            pinecone_form["id"] = ids[i]
+            pinecone_form["values"] = embedded_content[i]
+            pinecone_form["metadata"] = d
+            vectors.append(pinecone_form)
 
-        # upserting 200 vectors batch by batch
+        return vectors
+
+    # upserting 200 vectors batch by batch
+    def upsert_batches(self, vectors, namespace="file_data"):
         batch_size = 200
-        for i in range(len(total_to_upsert) // batch_size + 1):
-            start = i*batch_size
-            stop = start + batch_size if len(total_to_upsert) - start > batch_size else len(total_to_upsert)
-            self.index.upsert(namespace="file_data", vectors=total_to_upsert[start:stop])
+        for i, start in enumerate(range(0, len(vectors), batch_size)):
+            self.upsert(vectors[start:start + batch_size], namespace)
             print(f"Upserting batch {i}")
 
+    """
+    Files must be in a list format.
+    Reading, embedding and upserting run at the same time in a pipeline (see
+    ingest.py), a fixed number of records at a time, so memory stays the same
+    no matter how big the files are. Extra arguments go to IngestPipeline.
+    Once everything is upserted, the vectors the files had under the old
+    position based ids are deleted (see delete_legacy_ids).
+    """
+    def upsert_files(self, files: list, **pipeline_options):
+        from ingest import IngestPipeline
 
-    # Upsert random data by ourselves
-    def upsert_own_data(self, our_data):
+        report = IngestPipeline(self, **pipeline_options).run(files)
+        for file in files:
+            self.delete_legacy_ids(get_file_name(file))
+        return report
 
-        # Get current own data id count
-        with open("datafiles/own_data_id_count.txt", 'r+') as file:
-            id = int(file.read())
-            file.seek(0)
-            file.write(str(id + 1))
+    """
+    Deletes the file_data vectors of fname that still have an old position
+    based id (<fname>_<i>, see legacy_id_re). Left in the index they come back
+    next to the same chunk under its new id and take two of the top k.
+    Returns how many were deleted.
+    """
+    def delete_legacy_ids(self, fname):
+        legacy = legacy_id_re(fname)
+        old = []
+        for ids in self.list(namespace="file_data", prefix=f"{fname}_"):
+            old.extend(i for i in ids if legacy.match(i))
 
-        embedded = self.embedding_model.encode_query(our_data)
-        pinecone_form = {}
-        pinecone_form["id"] = f"own_data_{id}"
-        pinecone_form["values"] = embedded
-        pinecone_form["metadata"] = {"Content": our_data}
+        for start in range(0, len(old), 1000):
+            self.delete(old[start:start + 1000], namespace="file_data")
+        if old:
+            print(f"Deleted {len(old)} chunks with old ids from {fname} data")
+        return len(old)
 
-        self.index.upsert(namespace="own_data", vectors=[pinecone_form])
+    """
+    Incremental version of upsert_files for a re-crawl with a crawl state.
+    Only chunks from changed_links get re-embedded and upserted. Old chunks of
+    changed pages that no longer exist, and all chunks of removed_links, are deleted.
+    Inputs:
+        file: the data file the scraper just saved
+        changed_links, removed_links: scraper.changed_links, scraper.removed_links
+    """
+    def upsert_changed(self, file, changed_links, removed_links):
+        fname = get_file_name(file)
+        changed = [d for d in my_utils.iter_records(file) if d['Link'] in changed_links]
+
+        vectors = self.to_vectors(fname, changed) if changed else []
+        print(f"Embedding {len(vectors)} changed chunks from {fname} data")
+        if vectors:
+            self.upsert_batches(vectors)
+
+        # Delete whatever is left under each touched page that we didn't just write
+        new_ids = {v["id"] for v in vectors}
+        stale = []
+        for link in set(changed_links) | set(removed_links):
+            for ids in self.list(namespace="file_data", prefix=page_prefix(fname, link)):
+                stale.extend(i for i in ids if i not in new_ids)
 
-    def search(self, query, top_k=10):
+        for start in range(0, len(stale), 1000):
+            self.delete(stale[start:start + 1000], namespace="file_data")
+        print(f"Deleted {len(stale)} stale chunks from {fname} data")
+
+
+    # Upsert random data by ourselves
+    """
+    Adds a user fact. The id is taken atomically in the own data catalogue and
+    the embedding + upsert happen in the background writer, batched with any
+    other facts that come in at the same time (see own_data_writer.py).
+    Inputs:
+        our_data: the fact
+        wait: block until it's in the vector store (otherwise return right away)
+    Outputs:
+        the fact's id number (the vector id is own_data_<id>)
+    """
+    def upsert_own_data(self, our_data, wait=True):
+        id, written = self.own_data_writer.submit(our_data)
+        if wait:
+            written.result()
+        return id
+
+    # Fixes the own data catalogue if it drifted from the vector store. Facts it makes pending go back to the writer
+    def reconcile_own_data(self):
+        return self.own_data.reconcile(self, requeue=self.own_data_writer.requeue)
+
+    # include_values: also return every match's vector (the context selector uses them)
+    def search(self, query, top_k=10, include_values=False):
         # embed the query
         # encode() for Sentence Transformers
         # embed_query() for google embeddings
-        query_embedding = self.embedding_model.encode_query(query)
+        query_embedding = self.embed_query(query)
+
+        # Query the backend for the top_k most relevant chunks
+        with metrics.span("vector_query"):
+            return self.backend.query(query_embedding, top_k, ['file_data', 'own_data'], include_values)
+
+    """
+    Fills in the full metadata (Content, Site_Title, Header, ...) of search
+    results from the chunk store. Call it after filtering, so only the chunks
+    that are actually used get read. Results that aren't in the store (own_data,
+    or vectors upserted with full metadata before the chunk store) stay as they are.
+    """
+    def hydrate(self, matches):
+        with metrics.span("hydrate", chunks=len(matches)):
+            records = self.chunk_store.get_many([match["id"] for match in matches])
+        return [dict(match, metadata={**match["metadata"], **records[match["id"]]}) if match["id"] in records else match
+                for match in matches]
+
+    """
+    Puts the chunks of the data files in the chunk store without embedding or
+    upserting anything, for when the vector store was filled somewhere else
+    (e.g. the shared pinecone index). Chunks already there are skipped.
+    """
+    def fill_chunk_store(self, files):
+        for file in files:
+            fname = get_file_name(file)
+            page_counts = {}
+            for batch in my_utils.iter_batches(my_utils.iter_records(file), 500):
+                ids = assign_chunk_ids(fname, batch, page_counts)
+                self.chunk_store.put_many(zip(ids, batch))
+
+    """
+    Builds the BM25 keyword index from the scraped data files, plus everything
+    in the own data catalogue. After this, upsert and delete keep it up to date.
+    """
+    def build_keyword_index(self, files, include_own_data=True):
+        index = BM25Index()
+        for file in files:
+            index.add_file(file)
+
+        if include_own_data:
+            for id, content in self.own_data.all():
+                index.add(f"own_data_{id}", content, 'own_data', {"Content": content})
+
+        self.keyword_index = index
+        return index
+
+    # Keyword (BM25) search, same result format as search(). Empty if there's no keyword index
+    def keyword_search(self, query, top_k=10):
+        if self.keyword_index is None:
+            return []
+        with metrics.span("keyword_query"):
+            return self.keyword_index.search(query, top_k, ['file_data', 'own_data'])
+
+    def upsert(self, vectors, namespace):
+        records = [vector['metadata'] for vector in vectors]
+        if namespace == 'file_data':
+            # Chunk text goes to the local chunk store (first, so every vector can be hydrated)
+            self.chunk_store.put_many((vector['id'], vector['metadata']) for vector in vectors)
+            vectors = [dict(vector, metadata=slim_metadata(vector['metadata'])) for vector in vectors]
+
+        self.backend.upsert(vectors, namespace)
+        if self.keyword_index is not None:
+            for vector, record in zip(vectors, records):
+                self.keyword_index.add(vector['id'], record['Content'], namespace, record)
+        self.version += 1
+
+    # {id: {"id", "values", "metadata"}} for the ids that exist
+    def fetch(self, ids, namespace):
+        return self.backend.fetch(ids, namespace)
 
-        # Query Pinecone for the top_k most relevant chunks
-        # <code to query index>
-        search_results = self.index.query_namespaces(
-            namespaces=['file_data', 'own_data'],
-            metric='cosine',
-            vector=query_embedding.tolist(),
-            top_k=top_k,
-            include_metadata=True
-        )
+    def delete(self, ids, namespace):
+        self.backend.delete(ids, namespace)
+        if namespace == 'file_data':
+            self.chunk_store.delete(ids)
+        if self.keyword_index is not None:
+            for id in ids:
+                self.keyword_index.remove(id)
+        self.version += 1
 
-        return search_results.matches
+    # Generator of lists of ids in a namespace
+    def list(self, namespace, prefix=None):
+        return self.backend.list(namespace, prefix)
 
     def delete_by_id(self, id, namespace):
         name = namespace + '_' + str(id)
-        res = self.index.fetch([name], namespace)
-        if len(res.vectors) == 0:
+        res = self.fetch([name], namespace)
+        if len(res) == 0:
             return f"Couldn't find id {id} in added data"
         else:
-            self.index.delete(ids=[name], namespace=namespace)
+            self.delete([name], namespace)
+            if namespace == 'own_data':
+                self.own_data.remove(id)
             return f"Successfully deleted id {id} from added data"
\ No newline at end of file
@@ -0,0 +1,127 @@
+import os
+import threading
+import time
+
+import my_utils
+
+"""
+Text file that is read once and kept in memory. Every time you ask for the
+text it checks the file's modification time and only reads it again if the
+file changed, so prompts can be edited while the app runs.
+Inputs:
+    file: file path
+    concat (default True): same as my_utils.read_text_file
+"""
+class CachedTextFile:
+    def __init__(self, file, concat=True):
+        self.file = file
+        self.concat = concat
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.text = ""
+
+    def get(self):
+        mtime = os.stat(self.file).st_mtime_ns
+        if mtime != self.mtime:
+            with self.lock:
+                if mtime != self.mtime:
+                    self.text = my_utils.read_text_file(self.file, self.concat)
+                    self.mtime = mtime
+        return self.text
+
+
+# Gemini has no local tokenizer, ~4 characters per token is close enough for budgeting
+def estimate_tokens(text):
+    return (len(text) + 3) // 4
+
+
+"""
+Builds the RAG prompt:
+- the instructions come from a CachedTextFile instead of reading the file every turn
+- the prompt layout is one template filled in with a single format call
+- the context is joined once, and chunks that don't fit in max_prompt_tokens
+  are cut (best matches come first, so the worst ones get cut)
+It also keeps how long building took and how many tokens the prompts had (stats()).
+"""
+class PromptBuilder:
+    TEMPLATE = "Here are your instructions: \n {instructions} \n \
+                        Here is the context provided to answer the query.\n \
+                        Context: {context}\nQuestion: {query}\nAnswer:"
+
+    def __init__(self, instruction_file='datafiles/model_instruction.txt', max_prompt_tokens=4000, count_tokens=estimate_tokens):
+        self.instructions = CachedTextFile(instruction_file)
+        self.max_prompt_tokens = max_prompt_tokens
+        self.count_tokens = count_tokens
+
+        self.lock = threading.Lock()
+        self.builds = 0
+        self.total_build_time = 0.0
+        self.total_tokens = 0
+        self.max_tokens_seen = 0
+        self.truncated = 0
+        self.last_tokens = 0
+
+    # Text of one retrieved chunk as it goes in the context
+    @staticmethod
+    def format_chunk(retrieved):
+        content_data = retrieved['metadata']
+        if retrieved['namespace'] == 'file_data':
+            return (f"Site Title: {content_data['Site_Title']}\n"
+                    f"Header: {content_data['Header']}\n"
+                    f"Text: {content_data['Content']}\n\n")
+        return f"Text: {content_data['Content']}\n\n"
+
+    def build(self, retrieval, query):
+        start = time.perf_counter()
+        instructions = self.instructions.get()
+
+        # Whatever is left after the instructions and question is for the context
+        budget = self.max_prompt_tokens - self.count_tokens(self.TEMPLATE.format(instructions=instructions, context="", query=query))
+
+        parts = []
+        truncated = False
+        for retrieved in retrieval:
+            chunk = self.format_chunk(retrieved)
+            tokens = self.count_tokens(chunk)
+            if tokens > budget:
+                # Keep the start of the chunk if there's a useful amount of room left
+                if budget > 50:
+                    parts.append(self.cut_to_tokens(chunk, budget))
+                truncated = True
+                break
+            parts.append(chunk)
+            budget -= tokens
+
+        prompt = self.TEMPLATE.format(instructions=instructions, context="".join(parts), query=query)
+
+        prompt_tokens = self.count_tokens(prompt)
+        with self.lock:
+            self.builds += 1
+            self.total_build_time += time.perf_counter() - start
+            self.total_tokens += prompt_tokens
+            self.max_tokens_seen = max(self.max_tokens_seen, prompt_tokens)
+            self.truncated += truncated
+            self.last_tokens = prompt_tokens
+        return prompt
+
+    # Longest start of text that fits in tokens
+    def cut_to_tokens(self, text, tokens):
+        low, high = 0, len(text)
+        while low < high:
+            mid = (low + high + 1) // 2
+            if self.count_tokens(text[:mid]) <= tokens:
+                low = mid
+            else:
+                high = mid - 1
+        return text[:low]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "builds": self.builds,
+                "mean_build_ms": 1000 * self.total_build_time / self.builds if self.builds else 0.0,
+                "mean_prompt_tokens": self.total_tokens / self.builds if self.builds else 0.0,
+                "max_prompt_tokens": self.max_tokens_seen,
+                "last_prompt_tokens": self.last_tokens,
+                "truncated_prompts": self.truncated,
+            }
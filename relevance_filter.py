@@ -0,0 +1,136 @@
+import hashlib
+import os
+import time
+
+import numpy as np
+
+import build_assets
+import metrics
+import my_utils
+
+"""
+Cheap first check for user submitted facts, before asking Gemini.
+
+A fact is embedded once and compared with:
+- the centroid (average direction) of all the scraped file_data chunks, which
+  is basically "what UMD sustainability text looks like"
+- the closest fact already in own_data, to catch near-duplicates
+  (and the facts the writer hasn't stored yet), to catch near-duplicates
+Clear cases are decided right here, only the ones in between go to the LLM:
+    similarity >= accept_thresh  -> "accept" (off when accept_thresh is None)
+    similarity <= reject_thresh  -> "reject" (off when reject_thresh is None)
+    anything in between          -> "unsure" (ask the LLM)
+    own_data match >= duplicate_thresh -> "duplicate"
+Thresholds are arguments so they can be tuned with benchmarks/relevance_report.py.
+They haven't been tuned on the real model yet, so by default nothing is
+accepted or rejected locally: every fact with at least min_words words that
+isn't a duplicate goes to the LLM.
+
+The centroid is saved by build_assets.py (with the embedding model and a hash
+of the files it came from) so the app doesn't embed every chunk at startup.
+If it's missing or stale it's made here and saved for next time.
+centroid_file=None always makes it and saves nothing.
+"""
+class RelevanceFilter:
+    def __init__(self, vdb, files, accept_thresh=None, reject_thresh=None, duplicate_thresh=0.95, min_words=3,
+                 centroid_file=build_assets.CENTROID_FILE):
+        self.vdb = vdb
+        self.accept_thresh = accept_thresh
+        self.reject_thresh = reject_thresh
+        self.duplicate_thresh = duplicate_thresh
+        self.min_words = min_words
+        self.centroid = self.load_centroid(files, centroid_file)
+
+    def load_centroid(self, files, centroid_file):
+        key = centroid_key(self.vdb.embedding_cache.model_name, files)
+        if centroid_file and os.path.exists(centroid_file):
+            saved = np.load(centroid_file)
+            if str(saved["key"]) == key:
+                return saved["centroid"]
+
+        centroid = make_centroid(files, self.vdb.embed_documents)
+        if centroid_file:
+            save_centroid(centroid_file, centroid, key)
+        return centroid
+
+    def similarity(self, embedding):
+        return float(np.dot(embedding, self.centroid) / max(np.linalg.norm(embedding), 1e-12))
+
+    # (vector id, similarity) of the closest added fact, including ones still waiting for the writer
+    def nearest_fact(self, embedding):
+        best = None
+        for match in self.vdb.backend.query(embedding, 1, ['own_data']):
+            best = (match["id"], match["score"])
+
+        pending = self.vdb.own_data.pending()
+        if pending:
+            # Embedded the same way the writer does, so it gets them from the cache
+            vectors = self.vdb.embed_own_data([content for _, content in pending])
+            scores = vectors @ embedding / np.maximum(np.linalg.norm(vectors, axis=1) * np.linalg.norm(embedding), 1e-12)
+            i = int(np.argmax(scores))
+            if best is None or scores[i] > best[1]:
+                best = (f"own_data_{pending[i][0]}", float(scores[i]))
+        return best
+
+    """
+    Inputs:
+        fact: the text the user entered
+    Outputs:
+        {"decision": "accept" | "reject" | "unsure" | "duplicate",
+         "score": similarity to the centroid, "duplicate_of": id or None, "ms": time taken}
+    """
+    def check(self, fact):
+        start = time.perf_counter()
+        result = {"decision": "unsure", "score": 0.0, "duplicate_of": None}
+
+        if len(fact.split()) < self.min_words:
+            result["decision"] = "reject"
+        else:
+            embedding = self.vdb.embed_query(fact)
+            result["score"] = self.similarity(embedding)
+
+            nearest = self.nearest_fact(embedding)
+            if nearest and nearest[1] >= self.duplicate_thresh:
+                result["decision"] = "duplicate"
+                result["duplicate_of"] = nearest[0]
+            elif self.accept_thresh is not None and result["score"] >= self.accept_thresh:
+                result["decision"] = "accept"
+            elif self.reject_thresh is not None and result["score"] <= self.reject_thresh:
+                result["decision"] = "reject"
+
+        result["ms"] = (time.perf_counter() - start) * 1000
+        relevance_decisions.inc(decision=result["decision"])
+        return result
+
+
+# Normalized mean of the normalized chunk embeddings
+def make_centroid(files, embed_documents):
+    total = None
+    for file in files:
+        for batch in my_utils.iter_batches(my_utils.iter_records(file), 256):
+            vectors = np.asarray(embed_documents([d['Content'] for d in batch]), dtype=np.float32)
+            vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            total = vectors.sum(axis=0) if total is None else total + vectors.sum(axis=0)
+    if total is None:
+        raise Exception("No file data to build the relevance centroid from")
+    return total / np.linalg.norm(total)
+
+# Changes when the embedding model or anything in the files does
+def centroid_key(model_name, files):
+    digest = hashlib.sha256(model_name.encode('utf-8'))
+    for file in files:
+        digest.update(file.encode('utf-8'))
+        with open(file, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+def save_centroid(centroid_file, centroid, key):
+    try:
+        os.makedirs(os.path.dirname(centroid_file), exist_ok=True)
+        np.savez(centroid_file, centroid=centroid, key=key)
+    except OSError as e:
+        print(f"Couldn't save the relevance centroid ({e})")
+
+
+relevance_decisions = metrics.registry.counter("relevance_decisions_total", "Added fact checks by outcome", ("decision",))
@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+"""
+Cache of answers in front of UMDRAG.pipe.
+
+A new query counts as the same question as a cached one when
+    - their embeddings have cosine similarity >= threshold, and
+    - retrieval found exactly the same chunks (so the answer came from the same context)
+in which case the cached answer is returned without calling the model.
+
+Entries expire after ttl seconds, the least recently used one goes when there
+are more than max_entries, and everything is dropped when the vector storage
+changes (VectorDB.version goes up on every upsert/delete).
+"""
+class SemanticCache:
+    def __init__(self, threshold=0.95, ttl=3600, max_entries=500):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+
+        self.entries = OrderedDict()  # key -> entry, least recently used first
+        self.next_key = 0
+        self.data_version = None
+
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    @staticmethod
+    def normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    # Caller holds the lock
+    def check_version(self, data_version):
+        if data_version != self.data_version:
+            self.entries.clear()
+            self.data_version = data_version
+
+    """
+    Inputs:
+        embedding: query embedding
+        chunk_ids: ids of the retrieved chunks
+        data_version: VectorDB.version right now
+    Outputs:
+        the cached result, or None
+    """
+    def lookup(self, embedding, chunk_ids, data_version):
+        embedding = self.normalize(embedding)
+        chunk_ids = tuple(chunk_ids)
+        now = time.time()
+
+        with self.lock:
+            self.check_version(data_version)
+
+            best_key, best_score = None, self.threshold
+            for key, entry in list(self.entries.items()):
+                if now - entry["created"] > self.ttl:
+                    del self.entries[key]
+                    continue
+                if entry["chunk_ids"] != chunk_ids:
+                    continue
+                score = float(entry["embedding"] @ embedding)
+                if score >= best_score:
+                    best_key, best_score = key, score
+
+            if best_key is None:
+                self.misses += 1
+                return None
+
+            entry = self.entries[best_key]
+            self.entries.move_to_end(best_key)
+            self.hits += 1
+            self.saved_seconds += entry["latency"]
+            return entry["result"]
+
+    # latency: how long computing the result took, counted as saved on every hit
+    def put(self, embedding, chunk_ids, result, latency, data_version):
+        with self.lock:
+            self.check_version(data_version)
+
+            self.entries[self.next_key] = {
+                "embedding": self.normalize(embedding),
+                "chunk_ids": tuple(chunk_ids),
+                "result": result,
+                "latency": latency,
+                "created": time.time(),
+            }
+            self.next_key += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "saved_seconds": self.saved_seconds,
+            }
@@ -0,0 +1,351 @@
+import argparse
+import gc
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+from multiprocessing import reduction
+from multiprocessing.connection import Connection
+
+import numpy as np
+
+import metrics
+from embedding_backends import load_embedding_model
+
+"""
+Serving mode for hosts with more than one core.
+
+app.py alone is one process, so every query embedding runs under the same GIL
+no matter how many people are chatting. Here the embedding model is loaded
+once, then worker processes are forked from that process. They all share the
+loaded weights copy-on-write (gc.freeze keeps the garbage collector from
+touching, and so copying, those pages), so a worker only adds its own small
+working memory instead of a whole model.
+
+The Gradio front end stays a single process (chat state, streaming, the LLM
+coordinator, own data writes) and sends every embedding to a free worker
+(WorkerPool has the same encode_query / encode_document as a model, so
+VectorDB just uses it as its model). The vector search itself stays in the
+front end: the local matrix is loaded there once, and numpy releases the GIL
+while it multiplies, so it isn't copied into every worker either.
+
+Workers aren't forked from the front end itself: by the time one needs
+replacing, the front end has threads (uvicorn, gradio, the batchers), and
+forking a threaded process can copy a lock some other thread was holding.
+Instead a small zygote process is forked once at startup, right after the
+model is loaded and before any threads exist, and every worker (the first
+ones and the replacements) is forked from it. If the zygote is gone, a
+replacement is started with spawn and loads its own model.
+
+A dead or stuck worker is replaced with a new one. /workers shows every
+worker's health and memory, and /metrics has the totals.
+
+Command line (from the repo root):
+    python serve.py [--workers 4] [--embedding_backend torch]
+"""
+
+def worker_main(model, conn, threads):
+    # Workers split the cores between them, so each one uses few threads
+    if "torch" in sys.modules:
+        import torch
+        torch.set_num_threads(threads)
+
+    while True:
+        try:
+            op, payload = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+
+        try:
+            if op == "query":
+                result = np.asarray(model.encode_query(payload), dtype=np.float32)
+            elif op == "document":
+                result = np.asarray(model.encode_document(payload), dtype=np.float32)
+            elif op == "ping":
+                result = os.getpid()
+            else:
+                raise Exception(f"Unknown worker op: {op}")
+            conn.send(("ok", result))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+def spawn_worker_main(backend, conn, threads):
+    worker_main(load_embedding_model(backend), conn, threads)
+
+
+"""
+Forks workers on request. The front end sends the worker's end of a pipe
+(the file descriptor itself), gets back the new worker's pid.
+"""
+def zygote_main(model, conn, threads):
+    # Nobody waits for the workers, the kernel cleans them up when they exit
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    while True:
+        try:
+            fd = reduction.recv_handle(conn)
+        except (EOFError, OSError, KeyboardInterrupt):
+            return
+
+        pid = os.fork()
+        if pid == 0:
+            conn.close()
+            code = 0
+            try:
+                worker_main(model, Connection(fd), threads)
+            except BaseException:
+                code = 1
+            finally:
+                os._exit(code)
+
+        os.close(fd)
+        conn.send(pid)
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+# Resident and proportional (shared pages split between the processes using them) memory from /proc
+def process_memory_mb(pid):
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return {key.lower(): int(fields[key].split()[0]) / 1024 for key in ("Rss", "Pss") if key in fields}
+    except (OSError, ValueError):
+        return {}
+
+
+class Worker:
+    def __init__(self, number):
+        self.number = number
+        self.pid = None
+        # Only set for a worker started with spawn (forked ones aren't our children)
+        self.process = None
+        self.conn = None
+        self.busy = False
+        self.requests = 0
+        self.errors = 0
+        self.restarts = -1
+        self.last_ms = 0.0
+        self.started = 0.0
+
+    def alive(self):
+        if self.process is not None:
+            return self.process.is_alive()
+        return self.pid is not None and pid_alive(self.pid)
+
+    def stop(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.join()
+        elif self.alive():
+            os.kill(self.pid, signal.SIGKILL)
+        if self.conn is not None:
+            self.conn.close()
+
+    def health(self):
+        alive = self.alive()
+        return {"worker": self.number, "pid": self.pid, "alive": alive,
+                "busy": self.busy, "requests": self.requests, "errors": self.errors, "restarts": self.restarts,
+                "last_ms": round(self.last_ms, 3), "uptime": round(time.time() - self.started, 1),
+                **(process_memory_mb(self.pid) if alive else {})}
+
+
+"""
+Inputs:
+    backend: embedding backend (see embedding_backends.py), loaded once here
+    workers: number of worker processes (defaults to the number of cores)
+    threads_per_worker: torch threads in each worker
+    timeout: seconds a request can take before its worker counts as stuck
+    health_interval: seconds between checks of the idle workers
+"""
+class WorkerPool:
+    def __init__(self, backend="torch", workers=None, threads_per_worker=1, timeout=30.0, health_interval=5.0):
+        self.backend = backend
+        self.threads_per_worker = threads_per_worker
+        self.timeout = timeout
+        self.health_interval = health_interval
+        self.context = multiprocessing.get_context("fork")
+        self.closed = False
+
+        start = time.perf_counter()
+        self.model = load_embedding_model(backend)
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.load_seconds = time.perf_counter() - start
+
+        # Everything loaded so far is never collected, so the workers never write to (and copy) its pages
+        gc.collect()
+        gc.freeze()
+
+        # Forked before this process starts any thread, every worker is forked from it
+        self.zygote_conn, child_conn = self.context.Pipe()
+        self.zygote = self.context.Process(target=zygote_main, args=(self.model, child_conn, threads_per_worker),
+                                           daemon=True, name="embedding-zygote")
+        self.zygote.start()
+        child_conn.close()
+        self.zygote_lock = threading.Lock()
+
+        self.workers = [Worker(number) for number in range(workers or os.cpu_count() or 1)]
+        # Numbers of the idle workers, a request takes one and gives it back when it's done
+        self.free = queue.Queue()
+        for worker in self.workers:
+            self.start_worker(worker)
+            self.free.put(worker.number)
+
+        self.checker = threading.Thread(target=self.check_loop, daemon=True)
+        self.checker.start()
+
+        metrics.registry.gauge("serve_workers_alive", "Embedding worker processes that are running",
+                               lambda: sum(w.alive() for w in self.workers))
+        metrics.registry.gauge("serve_workers_busy", "Embedding worker processes working on a request",
+                               lambda: sum(w.busy for w in self.workers))
+
+    # Caller owns the worker (took it from self.free, or it isn't there yet)
+    def start_worker(self, worker):
+        worker.stop()
+
+        conn, child_conn = self.context.Pipe()
+        try:
+            with self.zygote_lock:
+                reduction.send_handle(self.zygote_conn, child_conn.fileno(), self.zygote.pid)
+                worker.pid = self.zygote_conn.recv()
+            worker.process = None
+        except (OSError, EOFError) as e:
+            print(f"Embedding zygote is gone ({e}), starting worker {worker.number} with spawn")
+            worker.process = multiprocessing.get_context("spawn").Process(
+                target=spawn_worker_main, args=(self.backend, child_conn, self.threads_per_worker),
+                daemon=True, name=f"embedding-worker-{worker.number}")
+            worker.process.start()
+            worker.pid = worker.process.pid
+        child_conn.close()
+        worker.conn = conn
+        worker.restarts += 1
+        worker.started = time.time()
+        if worker.restarts:
+            worker_restarts.inc()
+
+    # Caller owns the worker. Raises if it died or got stuck (and replaces it)
+    def send(self, worker, op, payload, timeout):
+        start = time.perf_counter()
+        try:
+            worker.conn.send((op, payload))
+            if not worker.conn.poll(timeout):
+                raise TimeoutError(f"Embedding worker {worker.number} took more than {timeout}s")
+            status, result = worker.conn.recv()
+        except (OSError, EOFError, TimeoutError):
+            worker.errors += 1
+            self.start_worker(worker)
+            raise
+
+        worker.last_ms = (time.perf_counter() - start) * 1000
+        if status == "error":
+            worker.errors += 1
+            raise Exception(result)
+        return result
+
+    """
+    Sends one request to the first idle worker. If the worker dies while on
+    it, the request is tried once more on another one.
+    """
+    def call(self, op, payload):
+        for attempt in range(2):
+            try:
+                number = self.free.get(timeout=self.timeout)
+            except queue.Empty:
+                raise TimeoutError("No embedding worker got free in time")
+
+            worker = self.workers[number]
+            worker.busy = True
+            try:
+                result = self.send(worker, op, payload, self.timeout)
+                worker.requests += 1
+                return result
+            except (OSError, EOFError, TimeoutError):
+                if attempt == 1:
+                    raise
+            finally:
+                worker.busy = False
+                self.free.put(number)
+
+    # Same methods as an embedding model, so VectorDB(embedding_model=pool) works
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode_query(self, texts, **kwargs):
+        return self.call("query", texts)
+
+    def encode_document(self, texts, **kwargs):
+        return self.call("document", texts)
+
+    # Pings the idle workers and replaces the ones that don't answer
+    def check_loop(self):
+        while not self.closed:
+            time.sleep(self.health_interval)
+            for _ in range(len(self.workers)):
+                if self.closed:
+                    return
+                try:
+                    number = self.free.get_nowait()
+                except queue.Empty:
+                    break
+                worker = self.workers[number]
+                try:
+                    if not worker.alive():
+                        worker.errors += 1
+                        self.start_worker(worker)
+                    else:
+                        self.send(worker, "ping", None, min(self.timeout, 5.0))
+                except Exception as e:
+                    print(f"Embedding worker {number} failed its health check ({e}), restarted it")
+                finally:
+                    self.free.put(number)
+
+    def close(self):
+        self.closed = True
+        for worker in self.workers:
+            worker.stop()
+        self.zygote.kill()
+        self.zygote.join()
+        self.zygote_conn.close()
+
+    def health(self):
+        workers = [worker.health() for worker in self.workers]
+        return {
+            "backend": self.backend,
+            "model_load_seconds": round(self.load_seconds, 3),
+            "zygote_alive": self.zygote.is_alive(),
+            "front_end": process_memory_mb(os.getpid()),
+            "workers": workers,
+            "healthy": all(w["alive"] for w in workers),
+        }
+
+
+worker_restarts = metrics.registry.counter("serve_worker_restarts_total", "Embedding workers replaced after dying or getting stuck")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the app with a pool of embedding worker processes")
+    parser.add_argument("--workers", type=int, default=None, help="defaults to the number of cores")
+    parser.add_argument("--embedding_backend", default=os.environ.get("EMBEDDING_BACKEND", "torch"))
+    parser.add_argument("--threads_per_worker", type=int, default=1)
+    args = parser.parse_args()
+
+    # Fork before anything else (gradio, the vector db, threads) is loaded
+    pool = WorkerPool(args.embedding_backend, args.workers, args.threads_per_worker)
+    print(f"Started {len(pool.workers)} embedding workers ({args.embedding_backend})")
+
+    os.environ["EMBEDDING_BACKEND"] = args.embedding_backend
+    import app
+
+    app.embedding_model = pool
+    app.run_server()
@@ -0,0 +1,95 @@
+import threading
+import time
+
+"""
+Helpers for starting the app fast.
+
+Heavy things (the embedding model, the vector storage connection, the Gemini
+client) are wrapped in a LazyResource: nothing is imported or loaded until
+the first get(). Startup.warm() calls get() on all of them in a background
+thread right after the server is up, so usually they're ready before the
+first chat comes in, but the port doesn't have to wait for them.
+
+Startup also remembers how long every phase took, and whether everything is
+loaded (ready), for the /startup and /ready endpoints in app.py.
+"""
+class Startup:
+    def __init__(self):
+        self.created = time.perf_counter()
+        self.lock = threading.Lock()
+        self.phases = {}  # phase name -> seconds
+        self.errors = {}  # resource name -> error message
+        self.ready = threading.Event()
+
+    def record(self, phase, seconds):
+        with self.lock:
+            self.phases[phase] = seconds
+
+    # Use as: with startup.phase("build ui"): ...
+    def phase(self, name):
+        return PhaseTimer(self, name)
+
+    def warm(self, resources):
+        def run():
+            for resource in resources:
+                try:
+                    resource.get()
+                except Exception as e:
+                    with self.lock:
+                        self.errors[resource.name] = str(e)
+                    print(f"Failed to load {resource.name}: {e}")
+            self.record("warm total", time.perf_counter() - self.created)
+            if not self.errors:
+                self.ready.set()
+            print(f"Startup: {self.report()}")
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def report(self):
+        with self.lock:
+            return {
+                "ready": self.ready.is_set(),
+                "phases": {name: round(seconds, 3) for name, seconds in self.phases.items()},
+                "errors": dict(self.errors),
+            }
+
+
+class PhaseTimer:
+    def __init__(self, startup, name):
+        self.startup = startup
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.startup.record(self.name, time.perf_counter() - self.start)
+
+
+"""
+Something expensive that is only built the first time get() is called.
+Inputs:
+    name: shows up in the startup timings
+    factory: function with no arguments that builds it
+    startup: Startup to record the load time in
+"""
+class LazyResource:
+    def __init__(self, name, factory, startup):
+        self.name = name
+        self.factory = factory
+        self.startup = startup
+        self.lock = threading.Lock()
+        self.value = None
+        self.loaded = False
+
+    def get(self):
+        if not self.loaded:
+            with self.lock:
+                if not self.loaded:
+                    with self.startup.phase(f"load {self.name}"):
+                        self.value = self.factory()
+                    self.loaded = True
+        return self.value
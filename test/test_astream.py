@@ -0,0 +1,101 @@
+"""
+UMDRAG.astream with FakeStreamingLLM on a small temporary local index:
+the pieces come out in order as the model writes them, a cached answer comes
+out as one piece without calling the model, and the metadata is passed along.
+
+Run from the repo root:
+    python -m unittest discover test
+"""
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pineconing
+from context_selection import ContextSelector
+from fake_llm import FakeStreamingLLM
+from semantic_cache import SemanticCache
+from umd_rag import UMDRAG
+
+RECORDS = [
+    {"Link": "https://sustainability.umd.edu/composting", "Site_Title": "Composting", "Header": "Dining halls",
+     "Content": "Every dining hall on campus sends its food scraps to be composted instead of the landfill."},
+    {"Link": "https://sustainability.umd.edu/transportation", "Site_Title": "Transportation", "Header": "Shuttle-UM",
+     "Content": "Shuttle-UM buses are free for students and run on routes across campus and College Park."},
+    {"Link": "https://sustainability.umd.edu/energy", "Site_Title": "Energy", "Header": "Solar",
+     "Content": "Solar panels on campus buildings produce part of the electricity the university uses."},
+]
+
+ANSWER = "Food scraps from the dining halls are composted."
+QUERY = "What happens to food scraps from the dining halls?"
+
+
+class AstreamTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.vdb = pineconing.VectorDB(backend="local", backend_options={"folder": self.folder.name, "save_delay": None},
+                                       batch_queries=False, embedding_backend="hashing",
+                                       own_data_file=os.path.join(self.folder.name, "own_data.sqlite"),
+                                       chunk_store_folder=os.path.join(self.folder.name, "chunk_store"),
+                                       embedding_cache_folder=os.path.join(self.folder.name, "embedding_cache"))
+        self.vdb.upsert(self.vdb.to_vectors("test", [dict(r) for r in RECORDS]), "file_data")
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def rag(self, llm, cache=None):
+        return UMDRAG(self.vdb, llm, cache=cache, hybrid=False, context_selector=ContextSelector(self.vdb))
+
+    async def collect(self, rag, **kwargs):
+        pieces = []
+        async for piece in rag.astream(QUERY, top_k=3, retrieval_thresh=-1.0, **kwargs):
+            pieces.append((time.perf_counter(), piece))
+        return pieces
+
+    async def test_pieces_come_in_order_as_written(self):
+        llm = FakeStreamingLLM(ANSWER, token_delay=0.02)
+        pieces = await self.collect(self.rag(llm))
+
+        tokens = [piece["token"] for _, piece in pieces]
+        self.assertEqual(tokens, [word if i == 0 else " " + word for i, word in enumerate(ANSWER.split(" "))])
+        self.assertEqual("".join(tokens), ANSWER)
+        self.assertEqual(llm.calls, 1)
+        self.assertIn(QUERY, llm.prompts[0])
+        # Streamed, not gathered first: the pieces arrive spread out over the model's delays
+        times = [t for t, _ in pieces]
+        self.assertGreater(times[-1] - times[0], 0.02 * (len(pieces) - 1) * 0.5)
+
+    async def test_cached_answer_is_one_piece(self):
+        llm = FakeStreamingLLM(ANSWER)
+        rag = self.rag(llm, cache=SemanticCache())
+
+        first = await self.collect(rag)
+        second = await self.collect(rag)
+
+        self.assertGreater(len(first), 1)
+        self.assertEqual(len(second), 1)
+        self.assertEqual(second[0][1]["token"], ANSWER)
+        self.assertEqual(llm.calls, 1)
+
+    async def test_metadata_passthrough(self):
+        rag = self.rag(FakeStreamingLLM(ANSWER))
+        expected = [match["id"] for match in rag.retrieve(QUERY, 3, -1.0)]
+
+        pieces = await self.collect(rag, include_metadata=True)
+        for _, piece in pieces:
+            metadata = piece["metadata"]
+            self.assertEqual([match["id"] for match in metadata], expected)
+            # Full chunk fields from the chunk store, and no vectors
+            for match in metadata:
+                self.assertIn("Content", match["metadata"])
+                self.assertIn("Site_Title", match["metadata"])
+                self.assertNotIn("values", match)
+
+        pieces = await self.collect(rag)
+        self.assertTrue(all(piece["metadata"] == [] for _, piece in pieces))
+
+
+if __name__ == "__main__":
+    unittest.main()
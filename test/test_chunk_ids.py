@@ -0,0 +1,45 @@
+"""
+Moving file data to page based chunk ids (pineconing.assign_chunk_ids):
+delete_legacy_ids removes only the old position based ids of a file.
+
+Run from the repo root:
+    python -m unittest discover test
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pineconing
+
+
+class LegacyIdsTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.vdb = pineconing.VectorDB(backend="local", backend_options={"folder": self.folder.name, "save_delay": None},
+                                       batch_queries=False, embedding_backend="hashing",
+                                       own_data_file=os.path.join(self.folder.name, "own_data.sqlite"),
+                                       chunk_store_folder=os.path.join(self.folder.name, "chunk_store"),
+                                       embedding_cache_folder=os.path.join(self.folder.name, "embedding_cache"))
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_only_old_ids_of_the_file_are_deleted(self):
+        link = "https://sustainability.umd.edu/composting"
+        ids = ["sustainability_0", "sustainability_17", pineconing.chunk_id("sustainability", link, 0),
+               "sustainingprogress_3", pineconing.chunk_id("compact_sustainability", link, 0)]
+        vectors = [{"id": id, "values": np.ones(self.vdb.backend.dim, dtype=np.float32),
+                    "metadata": {"Link": link, "Content": id}} for id in ids]
+        self.vdb.upsert(vectors, "file_data")
+
+        self.assertEqual(self.vdb.delete_legacy_ids("sustainability"), 2)
+        left = {id for batch in self.vdb.list("file_data") for id in batch}
+        self.assertEqual(left, set(ids[2:]))
+
+
+if __name__ == "__main__":
+    unittest.main()
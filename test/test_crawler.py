@@ -0,0 +1,178 @@
+"""
+Crawler (umd_webscraper.py) against a tiny site served from a temp folder with
+http.server: what gets written, that every page is fetched once, and what
+happens with pages that 404 or fail.
+
+Run from the repo root:
+    python -m unittest discover test
+"""
+import functools
+import http.server
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+import unittest.mock
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from crawl_state import CrawlState
+from umd_webscraper import UMDWebScraper
+
+# Every page links to some of the others (and to itself / each other twice), plus links the crawler must skip
+PAGES = {
+    "index.html": ("Home", ["a.html", "b.html", "a.html", "missing.html", "broken.html", "index.html#top",
+                            "https://example.com/elsewhere.html"]),
+    "a.html": ("Page A", ["b.html", "index.html"]),
+    "b.html": ("Page B", ["a.html", "c.html"]),
+    "c.html": ("Page C", ["index.html"]),
+    "broken.html": ("Broken", ["c.html"]),
+}
+
+def page_html(title, links):
+    anchors = "".join(f'<a href="{link}">{link}</a>' for link in links)
+    return (f"<html><head><title>{title}</title></head><body><nav>{anchors}</nav>"
+            f'<div id="main-content"><div class="editor-content"><h2>About {title}</h2>'
+            f"<p>{title} is a page about sustainability at the University of Maryland campus.</p>"
+            f"</div></div></body></html>")
+
+
+class Handler(http.server.SimpleHTTPRequestHandler):
+    # Set by the tests: path -> status code to answer with instead of the file
+    errors = {}
+    hits = Counter()
+
+    def do_GET(self):
+        path = self.path.lstrip("/")
+        Handler.hits[path] += 1
+        if path in Handler.errors:
+            self.send_error(Handler.errors[path])
+            return
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+class CrawlerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.TemporaryDirectory()
+        for name, (title, links) in PAGES.items():
+            with open(os.path.join(cls.folder.name, name), "w", encoding="utf-8") as f:
+                f.write(page_html(title, links))
+
+        cls.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0),
+                                                     functools.partial(Handler, directory=cls.folder.name))
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base = f"http://127.0.0.1:{cls.server.server_port}/"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.folder.cleanup()
+
+    def setUp(self):
+        Handler.errors = {"broken.html": 500}
+        Handler.hits = Counter()
+        self.work = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.work.cleanup()
+
+    def scraper(self, state=None):
+        return UMDWebScraper(self.base, max_workers=4, delay=0, state=state)
+
+    def test_crawl_output(self):
+        scraper = self.scraper()
+        scraper.crawl(self.base + "index.html")
+
+        links = [d["Link"] for d in scraper.data]
+        self.assertEqual(set(links), {self.base + p for p in ("index.html", "a.html", "b.html", "c.html")})
+        # One chunk per page, each page once
+        self.assertEqual(len(links), len(set(links)))
+        for d in scraper.data:
+            self.assertIn("sustainability at the University of Maryland", d["Content"])
+            self.assertTrue(d["Header"].startswith("About "))
+            self.assertIn(f"Link: {d['Link']}", d["Content"])
+
+    def test_every_page_fetched_once(self):
+        self.scraper().crawl(self.base + "index.html")
+        self.assertTrue(all(count == 1 for count in Handler.hits.values()), Handler.hits)
+        # Links with '#' and links off the site are never followed
+        self.assertEqual(set(Handler.hits), set(PAGES) | {"missing.html"})
+
+    def test_errors_dont_stop_the_crawl(self):
+        scraper = self.scraper()
+        scraper.crawl(self.base + "index.html")
+        crawled = {link[len(self.base):] for link in scraper.crawled_links}
+        self.assertEqual(crawled, {"index.html", "a.html", "b.html", "c.html"})
+
+    def test_jsonl_resume_doesnt_duplicate(self):
+        out = os.path.join(self.work.name, "data.jsonl")
+        self.scraper().crawl_to_jsonl(out, self.base + "index.html")
+        self.scraper().crawl_to_jsonl(out, self.base + "index.html")
+
+        with open(out, encoding="utf-8") as f:
+            links = [json.loads(line)["Link"] for line in f if line.strip()]
+        self.assertEqual(len(links), 4)
+        self.assertEqual(len(set(links)), 4)
+
+    def test_jsonl_resume_after_torn_line(self):
+        out = os.path.join(self.work.name, "data.jsonl")
+        self.scraper().crawl_to_jsonl(out, self.base + "index.html")
+        # A crash in the middle of writing a record
+        with open(out, "a", encoding="utf-8") as f:
+            f.write('{"Link": "' + self.base + 'a.h')
+        self.scraper().crawl_to_jsonl(out, self.base + "index.html")
+
+        with open(out, encoding="utf-8") as f:
+            links = [json.loads(line)["Link"] for line in f]
+        self.assertEqual(len(links), 4)
+
+    def test_state_keeps_failed_pages_and_drops_gone_ones(self):
+        state_file = os.path.join(self.work.name, "state.json")
+        Handler.errors = {}
+        first = self.scraper(CrawlState(state_file))
+        first.crawl(self.base + "index.html")
+        self.assertEqual(len(first.changed_links), 5)
+
+        # b.html has a server error: it keeps its chunks and c.html (only linked from it and broken.html) stays
+        Handler.errors = {"b.html": 503, "broken.html": 500}
+        second = self.scraper(CrawlState(state_file))
+        second.crawl(self.base + "index.html")
+        self.assertEqual(second.removed_links, set())
+        self.assertEqual(second.failed_links, {self.base + "b.html", self.base + "broken.html"})
+        self.assertIn(self.base + "b.html", {d["Link"] for d in second.data})
+        self.assertIn(self.base + "c.html", second.crawled_links)
+
+        # Now b.html is gone for real
+        Handler.errors = {"b.html": 404}
+        third = self.scraper(CrawlState(state_file))
+        third.crawl(self.base + "index.html")
+        self.assertEqual(third.gone_links, {self.base + "b.html", self.base + "missing.html"})
+        self.assertEqual(third.removed_links, {self.base + "b.html"})
+        self.assertNotIn(self.base + "b.html", CrawlState(state_file).pages)
+
+    def test_state_survives_crash_while_saving(self):
+        state_file = os.path.join(self.work.name, "state.json")
+        state = CrawlState(state_file)
+        state.pages = {"https://example.com/a": {"hash": "a"}}
+        state.save()
+
+        # Dies halfway through writing the next save
+        def broken_dump(obj, f, **kwargs):
+            f.write(json.dumps(obj)[:10])
+            raise KeyboardInterrupt
+        state.pages["https://example.com/b"] = {"hash": "b"}
+        with unittest.mock.patch("crawl_state.json.dump", broken_dump), self.assertRaises(KeyboardInterrupt):
+            state.save()
+
+        self.assertEqual(CrawlState(state_file).pages, {"https://example.com/a": {"hash": "a"}})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+"""
+Added facts (own_data_writer.py / own_data_catalog.py) survive the app being
+killed: a fact is only marked stored once the local index is on disk, and
+reconcile() on the next start writes a recently stored fact again instead of
+dropping it.
+
+Run from the repo root:
+    python -m unittest discover test
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+import unittest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+import pineconing
+
+FACT = "The campus farm gives its extra vegetables to the student food pantry."
+
+
+def open_vdb(folder):
+    return pineconing.VectorDB(backend="local", backend_options={"folder": os.path.join(folder, "index")},
+                               batch_queries=False, embedding_backend="hashing",
+                               own_data_file=os.path.join(folder, "own_data.sqlite"),
+                               chunk_store_folder=os.path.join(folder, "chunk_store"),
+                               embedding_cache_folder=os.path.join(folder, "embedding_cache"))
+
+
+class OwnDataCrashTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    # Adds FACT in another process that runs `before` first and is killed (os._exit, no atexit) after the add
+    def add_and_kill(self, before=""):
+        script = textwrap.dedent(f"""
+            import os, sys
+            sys.path.insert(0, {REPO!r})
+            sys.path.insert(0, {os.path.dirname(os.path.abspath(__file__))!r})
+            from test_own_data import open_vdb
+            vdb = open_vdb({self.folder.name!r})
+            {before}
+            vdb.upsert_own_data({FACT!r}, wait=True)
+            os._exit(0)
+        """)
+        subprocess.run([sys.executable, "-c", script], check=True, cwd=REPO)
+
+    def stored_ids(self, vdb):
+        return {id for ids in vdb.list("own_data") for id in ids}
+
+    def test_killed_after_add(self):
+        self.add_and_kill()
+
+        vdb = open_vdb(self.folder.name)
+        report = vdb.reconcile_own_data()
+        self.assertEqual(report["removed"], 0)
+        [(id, content)] = vdb.own_data.all()
+        self.assertEqual(content, FACT)
+        self.assertEqual(self.stored_ids(vdb), {f"own_data_{id}"})
+
+    def test_killed_between_upsert_and_flush(self):
+        # The writer upserts into memory, then the process dies when it tries to save the index
+        self.add_and_kill(before="vdb.backend.flush = lambda: os._exit(0)")
+
+        vdb = open_vdb(self.folder.name)
+        self.assertEqual(self.stored_ids(vdb), set())
+        # Never marked stored, so the writer picks it up again on start
+        vdb.own_data_writer.flush()
+        vdb.reconcile_own_data()
+        [(id, content)] = vdb.own_data.all()
+        self.assertEqual(content, FACT)
+        self.assertEqual(vdb.own_data.pending(), [])
+        self.assertEqual(self.stored_ids(vdb), {f"own_data_{id}"})
+
+    def test_reconcile_requeues_recently_stored(self):
+        vdb = open_vdb(self.folder.name)
+        # Marked stored without being in the index (what a lost save looked like)
+        recent = vdb.own_data.add_pending(FACT)
+        old = vdb.own_data.add_pending("A fact deleted from the vector store by hand a long time ago.")
+        vdb.own_data.mark_stored([recent, old])
+        with vdb.own_data.transaction():
+            vdb.own_data.connection.execute("UPDATE facts SET stored_at = 0 WHERE id = ?", (old,))
+
+        report = vdb.reconcile_own_data()
+        self.assertEqual((report["requeued"], report["removed"]), (1, 1))
+        vdb.own_data_writer.flush()
+        self.assertEqual(vdb.own_data.all(), [(recent, FACT)])
+        self.assertEqual(vdb.own_data.pending(), [])
+        self.assertEqual(self.stored_ids(vdb), {f"own_data_{recent}"})
+
+
+if __name__ == "__main__":
+    unittest.main()
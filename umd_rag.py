@@ -1,55 +1,187 @@
 from langsmith import traceable
-import my_utils
+import asyncio
+import contextlib
+import time
+from prompt_builder import PromptBuilder
+from bm25 import reciprocal_rank_fusion
+import metrics
+
+# The vectors retrieve keeps for the context selector, left out of the metadata we hand back
+def without_values(matches):
+    return [{key: value for key, value in match.items() if key != 'values'} for match in matches]
 
 class UMDRAG:
 
-    def __init__(self, vdb, model):
+    # cache: optional semantic_cache.SemanticCache to reuse answers to near identical questions
+    # prompt_builder: optional prompt_builder.PromptBuilder (e.g. with a different max_prompt_tokens)
+    # hybrid: also search the vdb's BM25 keyword index (if it has one) and fuse the results
+    # rrf_k: k of the reciprocal rank fusion (see bm25.py)
+    # keyword_thresh: keyword matches need a normalized BM25 score (0..1, see bm25.py) above this to count
+    # limiter: optional coordinator.ConcurrencyLimiter that caps how many model calls run at once
+    # context_selector: optional context_selection.ContextSelector that trims the retrieved chunks before the prompt
+    def __init__(self, vdb, model, cache=None, prompt_builder=None, hybrid=True, rrf_k=60, keyword_thresh=0.4,
+                 limiter=None, context_selector=None):
         self.vector_storage = vdb
         self.model = model
+        self.cache = cache
+        self.prompt_builder = prompt_builder or PromptBuilder()
+        self.hybrid = hybrid
+        self.rrf_k = rrf_k
+        self.keyword_thresh = keyword_thresh
+        self.limiter = limiter
+        self.context_selector = context_selector
+
+    # Holds an LLM slot while the model is called (raises coordinator.Busy if there's none)
+    def llm_slot(self):
+        return self.limiter.slot() if self.limiter else contextlib.nullcontext()
+
+    def allm_slot(self):
+        return self.limiter.aslot() if self.limiter else contextlib.nullcontext()
 
     @traceable(
         run_type='retriever'
     )
     def retrieve(self, query, top_k, score_thresh):
-        matched = self.vector_storage.search(query, top_k)
-        good_score_matches = []
-        for match in matched:
-            if match["score"] > score_thresh:
-                good_score_matches.append(match)
-        return good_score_matches
+        matched = self.vector_storage.search(query, top_k, include_values=self.context_selector is not None)
+        with metrics.span("filter"):
+            good_score_matches = []
+            for match in matched:
+                if match["score"] > score_thresh:
+                    good_score_matches.append(match)
+        metrics.retrieved_chunks.inc(len(matched))
+        metrics.filtered_chunks.inc(len(matched) - len(good_score_matches))
+
+        # Keyword matches are only added when the question is on topic at all (something passed the
+        # dense threshold), otherwise any question sharing one word with the data would get context
+        if self.hybrid and good_score_matches:
+            # Exact words (building names, acronyms, numbers) the embeddings can miss
+            keyword_matches = [match for match in self.vector_storage.keyword_search(query, top_k)
+                               if match["normalized_score"] > self.keyword_thresh]
+            if keyword_matches:
+                # Ordered by the fused rrf_score. "score" stays the dense (cosine) score,
+                # None for chunks only the keyword search found
+                with metrics.span("fusion"):
+                    fused = reciprocal_rank_fusion({"dense": good_score_matches, "keyword": keyword_matches}, self.rrf_k)
+                good_score_matches = [dict(match, score=match.get("dense_score")) for match in fused[:top_k]]
+
+        # Vectors only carry slim metadata, the text is read for the chunks we kept
+        return self.vector_storage.hydrate(good_score_matches)
     
     def create_prompt(self, retrieval, query):
-        system_instruction = my_utils.read_text_file('datafiles/model_instruction.txt')
-        context = ""
-        for retrieved in retrieval:
-            namespace = retrieved['namespace']
-            content_data = retrieved['metadata']
-
-            if namespace == 'file_data':
-                context += f"Site Title: {content_data['Site_Title']}\n"
-                context += f"Header: {content_data['Header']}\n"
-
-            elif namespace == 'own_data':
-                pass
-            context += f"Text: {content_data['Content']}\n\n"
-
-        prompt = f"Here are your instructions: \n {system_instruction} \n \
-                        Here is the context provided to answer the query.\n \
-                        Context: {context}\nQuestion: {query}\nAnswer:"
+        # Only the prompt gets the trimmed chunks, the metadata shown to the user stays the same
+        if self.context_selector is not None:
+            retrieval = self.context_selector.select(retrieval, query)
+        with metrics.span("prompt_build"):
+            prompt = self.prompt_builder.build(retrieval, query)
+        metrics.context_chunks.observe(len(retrieval))
+        metrics.prompt_tokens.observe(self.prompt_builder.count_tokens(prompt))
         return prompt
     
     def generate(self, prompt):
-        return self.model.invoke(prompt)
+        with self.llm_slot(), metrics.span("generate"):
+            return self.model.invoke(prompt)
     
+    # Looks the query up in the semantic cache. Returns (cached answer or None, key to store under)
+    def check_cache(self, query, retrieval):
+        if self.cache is None:
+            return None, None
+
+        query_embedding = self.vector_storage.embed_query(query)
+        chunk_ids = [match['id'] for match in retrieval]
+        with metrics.span("cache_lookup"):
+            answer = self.cache.lookup(query_embedding, chunk_ids, self.vector_storage.version)
+        metrics.cache_outcomes.inc(cache="semantic", outcome="miss" if answer is None else "hit")
+        return answer, (query_embedding, chunk_ids)
+
+    def save_to_cache(self, cache_key, answer, start):
+        if self.cache is not None:
+            query_embedding, chunk_ids = cache_key
+            self.cache.put(query_embedding, chunk_ids, answer, time.perf_counter() - start, self.vector_storage.version)
+
     @traceable(
         run_type='chain',
         metadata={"ls_provider": "google_genai", "ls_model_name": "gemini-2.5-flash"}
     )
     def pipe(self, query, include_metadata=False, top_k=6, retrieval_thresh=0.6):
-        retrieval = self.retrieve(query, top_k=top_k, score_thresh=retrieval_thresh)
-        prompt = self.create_prompt(retrieval, query)
-        answer = self.generate(prompt)
+        metrics.new_trace()
+        metrics.requests_total.inc(method="pipe")
+        start = time.perf_counter()
+        with metrics.span("total"):
+            retrieval = self.retrieve(query, top_k=top_k, score_thresh=retrieval_thresh)
+
+            # Same question with the same context as before: reuse the answer
+            answer, cache_key = self.check_cache(query, retrieval)
+            if answer is None:
+                prompt = self.create_prompt(retrieval, query)
+                answer = self.generate(prompt)
+                self.save_to_cache(cache_key, answer, start)
+
+        return {
+            'answer': answer,
+            'metadata': without_values(retrieval) if include_metadata else []
+        }
+
+    """
+    Async version of pipe. Retrieval (embedding + vector search) runs in a
+    worker thread and the model is called with ainvoke, so the event loop can
+    serve other chats while this one waits.
+    """
+    @traceable(
+        run_type='chain',
+        metadata={"ls_provider": "google_genai", "ls_model_name": "gemini-2.5-flash"}
+    )
+    async def apipe(self, query, include_metadata=False, top_k=6, retrieval_thresh=0.6):
+        metrics.new_trace()
+        metrics.requests_total.inc(method="apipe")
+        start = time.perf_counter()
+        with metrics.span("total"):
+            retrieval = await asyncio.to_thread(self.retrieve, query, top_k, retrieval_thresh)
+
+            answer, cache_key = await asyncio.to_thread(self.check_cache, query, retrieval)
+            if answer is None:
+                # Context selection can embed, keep it off the event loop
+                prompt = await asyncio.to_thread(self.create_prompt, retrieval, query)
+                async with self.allm_slot():
+                    with metrics.span("generate"):
+                        answer = await self.model.ainvoke(prompt)
+                self.save_to_cache(cache_key, answer, start)
+
         return {
             'answer': answer,
-            'metadata': retrieval if include_metadata else []
+            'metadata': without_values(retrieval) if include_metadata else []
         }
+
+    """
+    Streaming version of apipe. Yields the answer piece by piece as the model
+    writes it:
+        {'token': str, 'metadata': retrieval (or [])}
+    A cached answer comes out as a single piece.
+    """
+    async def astream(self, query, include_metadata=False, top_k=6, retrieval_thresh=0.6):
+        metrics.new_trace()
+        metrics.requests_total.inc(method="astream")
+        start = time.perf_counter()
+        retrieval = await asyncio.to_thread(self.retrieve, query, top_k, retrieval_thresh)
+        metadata = without_values(retrieval) if include_metadata else []
+
+        answer, cache_key = await asyncio.to_thread(self.check_cache, query, retrieval)
+        if answer is not None:
+            metrics.record("total", time.perf_counter() - start)
+            yield {'token': answer.content, 'metadata': metadata}
+            return
+
+        prompt = await asyncio.to_thread(self.create_prompt, retrieval, query)
+        full_answer = None
+        async with self.allm_slot():
+            generate_start = time.perf_counter()
+            async for chunk in self.model.astream(prompt):
+                if full_answer is None:
+                    # What the user actually waits for before text shows up
+                    metrics.record("first_token", time.perf_counter() - start)
+                full_answer = chunk if full_answer is None else full_answer + chunk
+                yield {'token': chunk.content, 'metadata': metadata}
+
+        metrics.record("generate", time.perf_counter() - generate_start)
+        metrics.record("total", time.perf_counter() - start)
+        if full_answer is not None:
+            self.save_to_cache(cache_key, full_answer, start)
@@ -1,11 +1,36 @@
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlparse
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from collections import deque
+import threading
+import time
+import importlib.util
 import json
+import os
+from crawl_state import hash_content
+import my_utils
+
+# Use the faster lxml parser when it's installed, otherwise the built in one
+HTML_PARSER = "lxml" if importlib.util.find_spec("lxml") else "html.parser"
+
+# Classes of the page sections get_text_content / get_slideshow_data look inside
+TEXT_SECTION_CLASSES = ['page-section-ut_feature', 'section-ut_feature',
+                        'page-section-ut_text', 'section-ut_text',
+                        'page-section-ut_image_with_text', 'section-ut_image_with_text']
+SLIDESHOW_CLASSES = ['section-ut_slideshow', 'page-section-ut_slideshow']
 
 class UMDWebScraper:
-    def __init__(self, url):
+    """
+    max_workers: how many pages crawl() fetches at the same time
+    delay: seconds to wait between two requests to the same host (politeness)
+    state: optional crawl_state.CrawlState, makes crawl() only re-parse pages that changed
+    parser: BeautifulSoup parser, defaults to lxml if it's installed
+    """
+    def __init__(self, url, max_workers=8, delay=0.1, state=None, parser=HTML_PARSER):
         self.url = url
+        self.parser = parser
         self.visited_links = set()
         self.data = []
         self.template_data = {
@@ -15,35 +40,60 @@ class UMDWebScraper:
             "Content": "",
         }
 
+        # One pooled session so connections are reused between pages
+        self.max_workers = max_workers
+        self.delay = delay
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # Next time we are allowed to hit each host
+        self.host_lock = threading.Lock()
+        self.next_request_time = {}
+
+        # Filled by crawl() when a state is given
+        self.state = state
+        self.crawled_links = set()
+        self.changed_links = set()
+        self.removed_links = set()
+        # Pages that answered 404/410, and pages that failed some other way (timeout, 5xx, ...)
+        self.gone_links = set()
+        self.failed_links = set()
+        # A page failed that we had nothing stored for, so links it has weren't followed
+        self.incomplete = False
+
+    # Blocks until the politeness delay for this url's host has passed
+    def wait_for_host(self, url):
+        host = urlparse(url).netloc
+        with self.host_lock:
+            now = time.monotonic()
+            start = max(now, self.next_request_time.get(host, now))
+            self.next_request_time[host] = start + self.delay
+
+        if start > now:
+            time.sleep(start - now)
+
     def fetch_page(self, url):
         try:
-            response = requests.get(url, timeout=10)
+            self.wait_for_host(url)
+            response = self.session.get(url, timeout=10)
             response.raise_for_status()
-            return BeautifulSoup(response.text, "html.parser")
+            return BeautifulSoup(response.text, self.parser)
         except requests.RequestException as e:
             print(f"Failed to fetch {url}: {e}")
             return None
 
-    def extract_links(self, soup, base_url):
+    def extract_links(self, soup, base_url, skip_visited=True):
         links = set()
         for a_tag in soup.find_all("a", href=True):
             link = urljoin(base_url, a_tag["href"])
-            if link.startswith(self.url) and link not in self.visited_links \
+            if link.startswith(self.url) and not (skip_visited and link in self.visited_links) \
             and not link.startswith(self.url + "sites/default/files") \
             and '#' not in link and '?' not in link:
                 links.add(link)
         return links
 
-    def extract_content(self, soup, page_template):
-        main_content = self.get_main_content(soup, page_template)
-        text_content = self.get_text_content(soup, page_template)
-        accordion_content = self.get_accordion_content(soup, page_template)
-        card_group_content = self.get_card_groups(soup, page_template)
-        slideshow_content = self.get_slideshow_data(soup, page_template)
-
-        content = main_content + text_content + accordion_content + card_group_content + slideshow_content
-        return self.clean_contents(content)
-
     def scrape(self, url):
         if url in self.visited_links:
             return
@@ -55,15 +105,193 @@ class UMDWebScraper:
         if not soup:
             return
 
+        self.data += self.extract_content(soup, self.make_page_template(soup, url))
+
+        new_links = self.extract_links(soup, url)
+        for link in new_links:
+            self.scrape(link)
+
+    def make_page_template(self, soup, url):
         page_template = self.template_data.copy()
         page_template['Link'] = url
         page_template['Site_Title'] = soup.title.string
+        return page_template
 
-        self.data += self.extract_content(soup, page_template)
+    # Fetches and parses one page. Runs inside the crawl() worker threads.
+    def process_page(self, url):
+        if self.state is not None:
+            return self.process_page_incremental(url)
 
-        new_links = self.extract_links(soup, url)
-        for link in new_links:
-            self.scrape(link)
+        soup = self.fetch_page(url)
+        if not soup:
+            return None
+
+        page_data = self.extract_content(soup, self.make_page_template(soup, url))
+        return page_data, self.extract_links(soup, url)
+
+    """
+    Same as process_page but uses the crawl state: sends a conditional GET and
+    reuses the stored chunks and links when the server says 304 or the body
+    hashes to the same thing as last time.
+    """
+    def process_page_incremental(self, url):
+        entry = self.state.get(url)
+        try:
+            self.wait_for_host(url)
+            response = self.session.get(url, timeout=10, headers=self.state.conditional_headers(url))
+            response.raise_for_status()
+        except requests.RequestException as e:
+            print(f"Failed to fetch {url}: {e}")
+            status = e.response.status_code if e.response is not None else None
+            with self.host_lock:
+                if status in (404, 410):
+                    self.gone_links.add(url)
+                    return None
+                self.failed_links.add(url)
+                if not entry:
+                    self.incomplete = True
+            if not entry:
+                return None
+            # Probably a hiccup, keep the page as it was last time and still follow its links
+            return entry['data'], set(entry['links'])
+
+        if response.status_code == 304 and entry:
+            return entry['data'], set(entry['links'])
+
+        page_hash = hash_content(response.content)
+        if entry and entry['hash'] == page_hash:
+            # Body is the same, only refresh the validators
+            self.state.update(url, response, page_hash, entry['links'], entry['data'])
+            return entry['data'], set(entry['links'])
+
+        soup = BeautifulSoup(response.text, self.parser)
+        page_data = self.extract_content(soup, self.make_page_template(soup, url))
+        # Keep every link (not just unvisited ones) so a 304 next time still knows them
+        links = self.extract_links(soup, url, skip_visited=False)
+
+        self.state.update(url, response, page_hash, links, page_data)
+        with self.host_lock:
+            self.changed_links.add(url)
+        return page_data, links
+
+    """
+    Iterative version of scrape(). Keeps a frontier of links to visit and
+    fetches up to max_workers pages at once instead of recursing page by page.
+    Yields (link, page_data) as each page finishes.
+    """
+    def iter_crawl(self, url=None):
+        frontier = deque([url or self.url])
+        pending = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while frontier or pending:
+                # Fill up the pool with links we haven't seen yet
+                while frontier and len(pending) < self.max_workers:
+                    link = frontier.popleft()
+                    if link in self.visited_links:
+                        continue
+
+                    print(f"Scraping: {link}")
+                    self.visited_links.add(link)
+                    pending[pool.submit(self.process_page, link)] = link
+
+                if not pending:
+                    continue
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    link = pending.pop(future)
+                    result = future.result()
+                    if result is None:
+                        continue
+
+                    page_data, new_links = result
+                    self.crawled_links.add(link)
+                    yield link, page_data
+
+                    for new_link in sorted(new_links):
+                        if new_link not in self.visited_links:
+                            frontier.append(new_link)
+
+    # Same records as scrape(), just gathered concurrently
+    def crawl(self, url=None):
+        for _, page_data in self.iter_crawl(url):
+            self.data += page_data
+
+        if self.state is not None:
+            self.finish_state()
+
+    """
+    Pages that answered 404/410 are gone, and so are pages we had last time
+    that no page we got this time links to anymore. A page that failed some
+    other way keeps its old state. If a failed page had nothing stored (so we
+    don't know where its links go), only the 404/410 pages are dropped.
+    """
+    def finish_state(self):
+        if self.incomplete:
+            keep = set(self.state.pages) - self.gone_links
+        else:
+            keep = (self.crawled_links | self.failed_links) - self.gone_links
+        self.removed_links = self.state.prune(keep)
+        self.state.save()
+        print(f"Changed pages: {len(self.changed_links)}, removed pages: {len(self.removed_links)}, "
+              f"failed pages: {len(self.failed_links)}")
+
+    """
+    Streaming version of crawl() + save_data(). Every page's chunks are appended
+    to a '.jsonl' file (one record per line) and flushed as soon as the page is
+    done, so nothing piles up in self.data.
+    If the file already exists (e.g. the last crawl crashed), pages that are
+    already in it are not written again. Those pages are still visited to find
+    their links, which is cheap with a crawl state.
+    """
+    def crawl_to_jsonl(self, filename, url=None):
+        done_links = set()
+        if os.path.exists(filename):
+            done_links = self.resume_jsonl(filename)
+            print(f"Resuming: {len(done_links)} pages already in {filename}")
+
+        count = 0
+        with open(filename, "a", encoding="utf-8") as f:
+            for link, page_data in self.iter_crawl(url):
+                if link in done_links or not page_data:
+                    continue
+
+                f.write("".join(json.dumps(d, ensure_ascii=False) + "\n" for d in page_data))
+                f.flush()
+                count += len(page_data)
+
+        if self.state is not None:
+            self.finish_state()
+        print(f"Wrote {count} new chunks to {filename}")
+
+    """
+    Gets a '.jsonl' file from a crashed crawl ready to be appended to again.
+    Pages are written one after the other, so only the last page can be cut
+    short: it's dropped from the file and crawled again.
+    Returns the links of the pages that are complete.
+    """
+    def resume_jsonl(self, filename):
+        my_utils.truncate_partial_line(filename)
+
+        done_links = set()
+        last_link = None
+        last_start = 0
+        offset = 0
+        with open(filename, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    link = json.loads(line)['Link']
+                    if link != last_link:
+                        if last_link is not None:
+                            done_links.add(last_link)
+                        last_link = link
+                        last_start = offset
+                offset += len(line)
+
+        with open(filename, 'rb+') as f:
+            f.truncate(last_start)
+        return done_links
 
     def save_data(self, filename):
         with open(filename, "w", encoding="utf-8") as f:
@@ -71,27 +299,31 @@ class UMDWebScraper:
         print(f"Data saved to {filename}")
 
     def get_main_content(self, soup, page_template):
-        main_data = []
-
         mc = soup.find(id='main-content')
         if mc:
             ec = mc.find(class_='editor-content')
             if ec:
+                return self.main_chunks(ec, page_template)
+        return []
+
+    def main_chunks(self, ec, page_template):
+        main_data = []
+
+        new_data = page_template.copy()
+        for child in ec.children:
+            if child.name in ['h1', 'h2', 'h3']:
+                main_data.append(new_data)
                 new_data = page_template.copy()
-                for child in ec.children:
-                    if child.name in ['h1', 'h2', 'h3']:
-                        main_data.append(new_data)
-                        new_data = page_template.copy()
-                        new_data['Header'] = child.get_text()
+                new_data['Header'] = child.get_text()
 
-                    if child.name == 'p':
-                        new_data['Content'] += child.get_text(strip=True) + " "
+            if child.name == 'p':
+                new_data['Content'] += child.get_text(strip=True) + " "
 
-                    if child.name == 'ul':
-                        for li in child.find_all('li'):
-                            new_data['Content'] += li.get_text() + " "
-                if new_data:
-                    main_data.append(new_data)
+            if child.name == 'ul':
+                for li in child.find_all('li'):
+                    new_data['Content'] += li.get_text() + " "
+        if new_data:
+            main_data.append(new_data)
 
         return main_data
 
@@ -99,56 +331,56 @@ class UMDWebScraper:
         text_data = []
         editor_content = []
 
-        psuft = soup.find_all(class_='page-section-ut_feature')
-        sutf = soup.find_all(class_='section-ut_feature')
-        psutt = soup.find_all(class_='page-section-ut_text')
-        sutt = soup.find_all(class_='section-ut_text')
-        psutiwt = soup.find_all(class_='page-section-ut_image_with_text')
-        sutiwt = soup.find_all(class_='section-ut_image_with_text')
-
-        search = psuft + sutf + psutt + sutt + psutiwt + sutiwt
+        search = []
+        for section_class in TEXT_SECTION_CLASSES:
+            search += soup.find_all(class_=section_class)
         for thing in search:
             for ec in thing.find_all(class_='editor-content'):
                 editor_content.append(ec)
 
         for ec in editor_content:
-            new_data = page_template.copy()
-
-            ul = ec.find('ul')
-            if ul:
-                for li in ul.find_all('li'):
-                    list_data = new_data.copy()
-                    list_data['Content'] = li.get_text()
-                    text_data.append(list_data)
-
-            header1 = ec.find('h1')
-            if header1:
-                new_data['Header'] = header1.get_text()
-            else:
-                header2 = ec.find('h2')
-                if header2:
-                    new_data['Header'] = header2.get_text()
-                else:
-                    header3 = ec.find('h3')
-                    if header3:
-                        new_data['Header'] = header3.get_text()
-                    else:
-                        header4 = ec.find('h4')
-                        if header4:
-                            new_data['Header'] = header4.get_text()
-
-            ps = ec.find_all('p')
-            if ps:
-                for p in ps:
-                    new_data['Content'] += p.get_text() + " "
-            else:
-                spans = ec.find_all('span')
-                if spans:
-                    for span in spans:
-                        new_data['Content'] = span.get_text() + " "
+            text_data += self.text_chunks(ec, page_template)
 
-            text_data.append(new_data)
+        return text_data
 
+    def text_chunks(self, ec, page_template):
+        text_data = []
+        new_data = page_template.copy()
+
+        ul = ec.find('ul')
+        if ul:
+            for li in ul.find_all('li'):
+                list_data = new_data.copy()
+                list_data['Content'] = li.get_text()
+                text_data.append(list_data)
+
+        header1 = ec.find('h1')
+        if header1:
+            new_data['Header'] = header1.get_text()
+        else:
+            header2 = ec.find('h2')
+            if header2:
+                new_data['Header'] = header2.get_text()
+            else:
+                header3 = ec.find('h3')
+                if header3:
+                    new_data['Header'] = header3.get_text()
+                else:
+                    header4 = ec.find('h4')
+                    if header4:
+                        new_data['Header'] = header4.get_text()
+
+        ps = ec.find_all('p')
+        if ps:
+            for p in ps:
+                new_data['Content'] += p.get_text() + " "
+        else:
+            spans = ec.find_all('span')
+            if spans:
+                for span in spans:
+                    new_data['Content'] = span.get_text() + " "
+
+        text_data.append(new_data)
         return text_data
 
     def get_accordion_content(self, soup, page_template):
@@ -156,61 +388,169 @@ class UMDWebScraper:
 
         for a in soup.find_all(class_='accordion'):
             for card in a.find_all(class_='card'):
-                new_data = page_template.copy()
+                accordion_data.append(self.accordion_chunk(card, page_template))
+
+        return accordion_data
 
-                ch = card.find(class_='card-header')
-                if ch:
-                    new_data['Header'] = ch.get_text(strip=True)
+    def accordion_chunk(self, card, page_template):
+        new_data = page_template.copy()
 
-                cb = card.find(class_='card-body')
-                if cb:
-                    new_data['Content'] = cb.get_text(strip=True)
+        ch = card.find(class_='card-header')
+        if ch:
+            new_data['Header'] = ch.get_text(strip=True)
 
-                accordion_data.append(new_data)
+        cb = card.find(class_='card-body')
+        if cb:
+            new_data['Content'] = cb.get_text(strip=True)
 
-        return accordion_data
+        return new_data
 
     def get_card_groups(self, soup, page_template):
         card_groups = []
 
         for cg in soup.find_all(class_='card-group'):
             for cw in cg.find_all(class_='card-wrap'):
-                new_data = page_template.copy()
+                card_groups.append(self.card_group_chunk(cw, page_template))
 
-                ctitle = cw.find(class_='card-title')
-                if ctitle:
-                    new_data['Header'] = ctitle.get_text(strip=True)
+        return card_groups
 
-                ctext = cw.find(class_='card-text')
-                if ctext:
-                    new_data['Content'] = ctext.get_text(strip=True)
+    def card_group_chunk(self, cw, page_template):
+        new_data = page_template.copy()
 
-                card_groups.append(new_data)
+        ctitle = cw.find(class_='card-title')
+        if ctitle:
+            new_data['Header'] = ctitle.get_text(strip=True)
 
-        return card_groups
+        ctext = cw.find(class_='card-text')
+        if ctext:
+            new_data['Content'] = ctext.get_text(strip=True)
+
+        return new_data
 
     def get_slideshow_data(self, soup, page_template):
         slideshow_data = []
 
-        sus = soup.find_all(class_='section-ut_slideshow')
-        psuts = soup.find_all(class_='page-section-ut_slideshow')
-
-        search = sus + psuts
+        search = []
+        for section_class in SLIDESHOW_CLASSES:
+            search += soup.find_all(class_=section_class)
         for thing in search:
             for si in thing.find_all(class_='slideshow-item'):
-                new_data = page_template.copy()
+                slideshow_data.append(self.slideshow_chunk(si, page_template))
+
+        return slideshow_data
 
-                sct = si.find(class_='slideshow-caption-title')
-                if sct:
-                    new_data['Header'] = sct.get_text()
+    def slideshow_chunk(self, si, page_template):
+        new_data = page_template.copy()
+
+        sct = si.find(class_='slideshow-caption-title')
+        if sct:
+            new_data['Header'] = sct.get_text()
+
+        scc = si.find(class_='slideshow-caption-content')
+        if scc:
+            new_data['Content'] = scc.get_text()
+
+        return new_data
+
+    """
+    Walks the page once and sorts every element we care about into buckets,
+    instead of every get_* method sweeping the whole tree with find_all.
+    Containers (text sections, accordions, card groups, slideshows, main content)
+    stay "open" while we are inside them so the items nested in them
+    (editor-content, card, card-wrap, slideshow-item) get added to every open one.
+    The buckets come out in the same order the find_all sweeps would give.
+    """
+    def collect_sections(self, soup):
+        sections = {
+            "main": [],
+            "text": {c: [] for c in TEXT_SECTION_CLASSES},
+            "accordion": [],
+            "card_group": [],
+            "slideshow": {c: [] for c in SLIDESHOW_CLASSES},
+        }
+        main_found = False
+
+        # Each stack entry: (element, open containers around it)
+        # An open container is (item class it collects, list the items go into)
+        stack = [(soup, ())]
+        while stack:
+            element, open_containers = stack.pop()
+            classes = element.get('class') or []
+
+            for item_class, items in open_containers:
+                if item_class in classes:
+                    items.append(element)
+
+            new_containers = []
+            if not main_found and element.get('id') == 'main-content':
+                main_found = True
+                new_containers.append(('editor-content', sections["main"]))
+            for c in classes:
+                if c in sections["text"]:
+                    container = []
+                    sections["text"][c].append(container)
+                    new_containers.append(('editor-content', container))
+                elif c in sections["slideshow"]:
+                    container = []
+                    sections["slideshow"][c].append(container)
+                    new_containers.append(('slideshow-item', container))
+            if 'accordion' in classes:
+                container = []
+                sections["accordion"].append(container)
+                new_containers.append(('card', container))
+            if 'card-group' in classes:
+                container = []
+                sections["card_group"].append(container)
+                new_containers.append(('card-wrap', container))
+
+            if new_containers:
+                open_containers = open_containers + tuple(new_containers)
+
+            # Push children reversed so they pop in document order
+            children = [child for child in element.children if child.name]
+            for child in reversed(children):
+                stack.append((child, open_containers))
+
+        return sections
 
-                scc = si.find(class_='slideshow-caption-content')
-                if scc:
-                    new_data['Content'] = scc.get_text()
+    def extract_content(self, soup, page_template):
+        sections = self.collect_sections(soup)
+        content = []
 
-                slideshow_data.append(new_data)
+        # Only the first editor-content inside main-content counts
+        if sections["main"]:
+            content += self.main_chunks(sections["main"][0], page_template)
 
-        return slideshow_data
+        for c in TEXT_SECTION_CLASSES:
+            for container in sections["text"][c]:
+                for ec in container:
+                    content += self.text_chunks(ec, page_template)
+
+        for container in sections["accordion"]:
+            for card in container:
+                content.append(self.accordion_chunk(card, page_template))
+
+        for container in sections["card_group"]:
+            for cw in container:
+                content.append(self.card_group_chunk(cw, page_template))
+
+        for c in SLIDESHOW_CLASSES:
+            for container in sections["slideshow"][c]:
+                for si in container:
+                    content.append(self.slideshow_chunk(si, page_template))
+
+        return self.clean_contents(content)
+
+    # Original five-sweep version, kept to check extract_content against
+    def extract_content_legacy(self, soup, page_template):
+        main_content = self.get_main_content(soup, page_template)
+        text_content = self.get_text_content(soup, page_template)
+        accordion_content = self.get_accordion_content(soup, page_template)
+        card_group_content = self.get_card_groups(soup, page_template)
+        slideshow_content = self.get_slideshow_data(soup, page_template)
+
+        content = main_content + text_content + accordion_content + card_group_content + slideshow_content
+        return self.clean_contents(content)
 
     def clean_contents(self, data):
         cleaned_data = []
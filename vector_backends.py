@@ -0,0 +1,441 @@
+import atexit
+import json
+import os
+import threading
+
+import numpy as np
+
+"""
+Where VectorDB actually keeps its vectors. Every backend has the same methods:
+    upsert(vectors, namespace)        vectors are {"id", "values", "metadata"} dicts
+    query(vector, top_k, namespaces, include_values=False)
+                                      list of {"id", "score", "namespace", "metadata"} best first
+                                      (plus "values" if include_values)
+    fetch(ids, namespace)             {id: {"id", "values", "metadata"}} for the ids that exist
+    delete(ids, namespace)
+    list(namespace, prefix=None)      generator of lists of ids (like pinecone's index.list)
+
+PineconeBackend: the pinecone serverless index we've always used
+LocalBackend: numpy matrices in memory, saved to disk. No network needed.
+IVFBackend: LocalBackend plus an approximate (clustered) index for big corpora
+"""
+
+
+class PineconeBackend:
+    """
+    Index for SentenceTransformer embeddings: "umdsustainabilitychatbot"
+    - dimension: 384
+
+    Index for GoogleGenerativeAI embeddings (from langchain_google_genai): "umdsustainabilitychatbot2"
+    - dimension: 768
+
+    New Index for GoogleGenerativeAI embeddings (from langchain_google_genai): "umdsustainabilitychatbot3" - FIXING THIS
+    - dimension: 3072
+    """
+    def __init__(self, index_name="umdsustainabilitychatbot3", dim=384):
+        from pinecone import Pinecone, ServerlessSpec
+
+        pc = Pinecone()
+        existing_indexes = [index["name"] for index in pc.list_indexes()]
+
+        # create only if it doesn't exist already
+        if index_name not in existing_indexes:
+            print("Index doesn't exist. Creating...")
+            pc.create_index(
+                name=index_name,
+                dimension=dim, # Add embedding dimensions
+                metric="cosine",   # Add your similarity metric
+                spec=ServerlessSpec(
+                    cloud="aws",
+                    region="us-east-1"
+                )
+            )
+        else:
+            print("Index exists already")
+
+        self.index = pc.Index(index_name)
+
+    def upsert(self, vectors, namespace):
+        self.index.upsert(namespace=namespace, vectors=vectors)
+
+    def query(self, vector, top_k, namespaces, include_values=False):
+        search_results = self.index.query_namespaces(
+            namespaces=namespaces,
+            metric='cosine',
+            vector=np.asarray(vector).tolist(),
+            top_k=top_k,
+            include_metadata=True,
+            include_values=include_values
+        )
+
+        return [{"id": m["id"], "score": m["score"], "namespace": m["namespace"], "metadata": m["metadata"],
+                 **({"values": m["values"]} if include_values else {})}
+                for m in search_results.matches]
+
+    def fetch(self, ids, namespace):
+        res = self.index.fetch(ids=ids, namespace=namespace)
+        return {key: {"id": key, "values": v.values, "metadata": v.metadata} for key, v in res.vectors.items()}
+
+    def delete(self, ids, namespace):
+        self.index.delete(ids=ids, namespace=namespace)
+
+    def list(self, namespace, prefix=None):
+        if prefix:
+            return self.index.list(prefix=prefix, namespace=namespace)
+        return self.index.list(namespace=namespace)
+
+
+class LocalBackend:
+    """
+    Keeps every namespace as a matrix of normalized vectors, so cosine
+    similarity is just one matrix-vector product. Loaded back from folder when
+    created. Saving writes the whole namespace, so changes are saved at most
+    once every save_delay seconds (in the background, and at exit), not after
+    every upsert. save_delay=None saves right away. flush() saves now.
+    """
+    def __init__(self, folder="datafiles/local_index", dim=384, save_delay=1.0):
+        self.folder = folder
+        self.dim = dim
+        self.save_delay = save_delay
+        self.lock = threading.RLock()
+        self.namespaces = {}
+        # Namespaces changed since they were last saved, and the timer that will save them
+        self.dirty = set()
+        self.save_timer = None
+        atexit.register(self.flush)
+
+        os.makedirs(folder, exist_ok=True)
+        for file in os.listdir(folder):
+            if file.endswith('.json'):
+                self.load(file[:-len('.json')])
+
+    def get_namespace(self, namespace):
+        if namespace not in self.namespaces:
+            self.namespaces[namespace] = {
+                "ids": [],
+                "rows": {},
+                "matrix": np.zeros((0, self.dim), dtype=np.float32),
+                "metadata": [],
+            }
+        return self.namespaces[namespace]
+
+    @staticmethod
+    def normalize(matrix):
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        norms[norms == 0] = 1
+        return matrix / norms
+
+    def upsert(self, vectors, namespace):
+        # The same id twice in one batch: the last one wins
+        vectors = list({v["id"]: v for v in vectors}.values())
+        with self.lock:
+            ns = self.get_namespace(namespace)
+            new_rows = []
+            for v in vectors:
+                values = self.normalize(np.asarray(v["values"], dtype=np.float32))
+                metadata = v.get("metadata", {})
+                if v["id"] in ns["rows"]:
+                    row = ns["rows"][v["id"]]
+                    ns["matrix"][row] = values
+                    ns["metadata"][row] = metadata
+                else:
+                    ns["rows"][v["id"]] = len(ns["ids"])
+                    ns["ids"].append(v["id"])
+                    ns["metadata"].append(metadata)
+                    new_rows.append(values)
+
+            if new_rows:
+                ns["matrix"] = np.vstack([ns["matrix"], np.asarray(new_rows, dtype=np.float32)])
+            self.changed(namespace)
+
+    """
+    Top k for many query vectors at once.
+    Inputs:
+        vectors: array of shape (n, dim)
+        top_k: how many matches per query
+        namespaces: which namespaces to search, results are merged
+        include_values: also give every match its (normalized) vector
+    Outputs:
+        list (one per query) of lists of matches
+    """
+    def query_many(self, vectors, top_k, namespaces, include_values=False):
+        queries = self.normalize(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim))
+        per_query = [[] for _ in range(len(queries))]
+
+        with self.lock:
+            for namespace in namespaces:
+                ns = self.namespaces.get(namespace)
+                if ns is None or len(ns["ids"]) == 0:
+                    continue
+
+                scores = queries @ ns["matrix"].T
+                k = min(top_k, scores.shape[1])
+                # argpartition gets the k best without sorting everything
+                best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                for q, rows in enumerate(best):
+                    for row in rows:
+                        per_query[q].append({
+                            "id": ns["ids"][row],
+                            "score": float(scores[q, row]),
+                            "namespace": namespace,
+                            "metadata": ns["metadata"][row],
+                            **({"values": ns["matrix"][row].copy()} if include_values else {}),
+                        })
+
+        return [sorted(matches, key=lambda m: m["score"], reverse=True)[:top_k] for matches in per_query]
+
+    def query(self, vector, top_k, namespaces, include_values=False):
+        return self.query_many([vector], top_k, namespaces, include_values)[0]
+
+    def fetch(self, ids, namespace):
+        with self.lock:
+            ns = self.namespaces.get(namespace)
+            if ns is None:
+                return {}
+
+            found = {}
+            for id in ids:
+                if id in ns["rows"]:
+                    row = ns["rows"][id]
+                    found[id] = {"id": id, "values": ns["matrix"][row].tolist(), "metadata": ns["metadata"][row]}
+            return found
+
+    def delete(self, ids, namespace):
+        with self.lock:
+            ns = self.namespaces.get(namespace)
+            if ns is None:
+                return
+
+            remove = {ns["rows"][id] for id in ids if id in ns["rows"]}
+            if not remove:
+                return
+
+            keep = [row for row in range(len(ns["ids"])) if row not in remove]
+            ns["ids"] = [ns["ids"][row] for row in keep]
+            ns["metadata"] = [ns["metadata"][row] for row in keep]
+            ns["matrix"] = ns["matrix"][keep]
+            ns["rows"] = {id: row for row, id in enumerate(ns["ids"])}
+            self.changed(namespace)
+
+    def list(self, namespace, prefix=None):
+        with self.lock:
+            ns = self.namespaces.get(namespace)
+            ids = [id for id in ns["ids"] if not prefix or id.startswith(prefix)] if ns else []
+        if ids:
+            yield ids
+
+    # Caller holds the lock
+    def changed(self, namespace):
+        self.dirty.add(namespace)
+        if self.save_delay is None:
+            self.flush()
+        elif self.save_timer is None:
+            self.save_timer = threading.Timer(self.save_delay, self.flush)
+            self.save_timer.daemon = True
+            self.save_timer.start()
+
+    # Saves every namespace that changed
+    def flush(self):
+        with self.lock:
+            if self.save_timer is not None:
+                self.save_timer.cancel()
+                self.save_timer = None
+            # The folder can be gone by now (e.g. a temporary index at exit)
+            if os.path.isdir(self.folder):
+                for namespace in sorted(self.dirty):
+                    self.save(namespace)
+            self.dirty.clear()
+
+    # Caller holds the lock
+    def save(self, namespace):
+        ns = self.namespaces[namespace]
+        np.save(os.path.join(self.folder, f"{namespace}.npy"), ns["matrix"])
+        with open(os.path.join(self.folder, f"{namespace}.json"), 'w', encoding='utf-8') as f:
+            json.dump({"ids": ns["ids"], "metadata": ns["metadata"]}, f, ensure_ascii=False)
+
+    def load(self, namespace):
+        with open(os.path.join(self.folder, f"{namespace}.json"), 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+
+        ns = self.get_namespace(namespace)
+        ns["ids"] = saved["ids"]
+        ns["metadata"] = saved["metadata"]
+        ns["rows"] = {id: row for row, id in enumerate(ns["ids"])}
+        ns["matrix"] = np.load(os.path.join(self.folder, f"{namespace}.npy")).astype(np.float32)
+
+
+class IVFBackend(LocalBackend):
+    """
+    LocalBackend with an approximate (IVF) index on top, for when the corpus
+    gets too big to score every vector on every query.
+
+    The vectors of a namespace are split into nlist clusters with k-means.
+    A query only scores the vectors in the nprobe clusters whose centers are
+    closest to it, so it looks at roughly nprobe / nlist of the corpus.
+    Raising nprobe gives better recall but slower queries.
+
+    nlist: number of clusters, defaults to about sqrt(number of vectors)
+    nprobe: clusters searched per query
+    min_train_size: below this many vectors we just do exact search
+    """
+    def __init__(self, folder="datafiles/local_index", dim=384, nlist=None, nprobe=8, min_train_size=1000, save_delay=1.0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        super().__init__(folder, dim, save_delay)
+
+    def get_namespace(self, namespace):
+        ns = super().get_namespace(namespace)
+        ns.setdefault("centroids", None)  # (nlist, dim) or None when not trained
+        ns.setdefault("assign", np.zeros(0, dtype=np.int32))  # cluster of every row
+        ns.setdefault("lists", [])  # rows in every cluster
+        ns.setdefault("trained_size", 0)
+        return ns
+
+    # Spherical k-means: centers are normalized so closeness is cosine similarity
+    def train(self, ns, iterations=10, seed=0):
+        matrix = ns["matrix"]
+        nlist = self.nlist or max(1, int(np.sqrt(len(matrix))))
+        rng = np.random.default_rng(seed)
+
+        sample = matrix
+        if len(matrix) > nlist * 256:
+            sample = matrix[rng.choice(len(matrix), nlist * 256, replace=False)]
+
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)]
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[labels == c]
+                if len(members):
+                    centroids[c] = members.sum(axis=0)
+            centroids = self.normalize(centroids)
+
+        ns["centroids"] = centroids.astype(np.float32)
+        ns["trained_size"] = len(matrix)
+        ns["assign"] = self.assign(ns, matrix)
+        self.rebuild_lists(ns)
+
+    def assign(self, ns, vectors):
+        assign = np.zeros(len(vectors), dtype=np.int32)
+        # In chunks so a big namespace doesn't need an (n, nlist) matrix all at once
+        for start in range(0, len(vectors), 65536):
+            assign[start:start + 65536] = np.argmax(vectors[start:start + 65536] @ ns["centroids"].T, axis=1)
+        return assign
+
+    def rebuild_lists(self, ns):
+        order = np.argsort(ns["assign"], kind="stable")
+        bounds = np.searchsorted(ns["assign"][order], np.arange(len(ns["centroids"]) + 1))
+        ns["lists"] = [order[bounds[c]:bounds[c + 1]] for c in range(len(ns["centroids"]))]
+
+    # Keeps the clusters up to date after the matrix changed
+    def update_index(self, ns, changed_rows):
+        n = len(ns["ids"])
+        if ns["centroids"] is None or n > 2 * ns["trained_size"]:
+            # Not trained yet, or grown so much the clusters are stale
+            if n >= self.min_train_size:
+                self.train(ns)
+            return
+
+        old_assign = ns["assign"]
+        assign = np.concatenate([old_assign, np.zeros(n - len(old_assign), dtype=np.int32)])
+        rows = np.asarray(sorted(changed_rows), dtype=np.int64)
+        assign[rows] = self.assign(ns, ns["matrix"][rows])
+        ns["assign"] = assign
+
+        if len(rows) and rows[0] < len(old_assign):
+            # An existing vector moved, easiest to redo the lists
+            self.rebuild_lists(ns)
+        else:
+            # Only new rows: add them to the end of their clusters
+            for c in np.unique(assign[rows]):
+                ns["lists"][c] = np.concatenate([ns["lists"][c], rows[assign[rows] == c]])
+
+    def upsert(self, vectors, namespace):
+        with self.lock:
+            ns = self.get_namespace(namespace)
+            old_n = len(ns["ids"])
+            replaced = {ns["rows"][v["id"]] for v in vectors if v["id"] in ns["rows"]}
+            super().upsert(vectors, namespace)
+
+            # New ids were added at the end
+            self.update_index(ns, replaced | set(range(old_n, len(ns["ids"]))))
+            # Again, so a save_delay=None save has the new clusters too
+            self.changed(namespace)
+
+    def delete(self, ids, namespace):
+        with self.lock:
+            ns = self.namespaces.get(namespace)
+            if ns is None:
+                return
+            remove = {ns["rows"][id] for id in ids if id in ns["rows"]}
+            super().delete(ids, namespace)
+
+            if ns["centroids"] is not None and remove:
+                keep = np.asarray([row for row in range(len(ns["assign"])) if row not in remove], dtype=np.int64)
+                ns["assign"] = ns["assign"][keep]
+                self.rebuild_lists(ns)
+                self.changed(namespace)
+
+    def query_many(self, vectors, top_k, namespaces, include_values=False):
+        queries = self.normalize(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim))
+        per_query = [[] for _ in range(len(queries))]
+
+        with self.lock:
+            for namespace in namespaces:
+                ns = self.namespaces.get(namespace)
+                if ns is None or len(ns["ids"]) == 0:
+                    continue
+
+                if ns["centroids"] is None:
+                    # Small namespace, exact search is cheaper anyway
+                    scores = queries @ ns["matrix"].T
+                    candidates = [np.arange(len(ns["ids"]))] * len(queries)
+                    candidate_scores = list(scores)
+                else:
+                    nprobe = min(self.nprobe, len(ns["centroids"]))
+                    probes = np.argpartition(-(queries @ ns["centroids"].T), nprobe - 1, axis=1)[:, :nprobe]
+                    candidates = [np.concatenate([ns["lists"][c] for c in probe]) for probe in probes]
+                    candidate_scores = [ns["matrix"][rows] @ q for rows, q in zip(candidates, queries)]
+
+                for q, (rows, scores) in enumerate(zip(candidates, candidate_scores)):
+                    if len(rows) == 0:
+                        continue
+                    k = min(top_k, len(rows))
+                    best = np.argpartition(-scores, k - 1)[:k]
+                    for i in best:
+                        row = rows[i]
+                        per_query[q].append({
+                            "id": ns["ids"][row],
+                            "score": float(scores[i]),
+                            "namespace": namespace,
+                            "metadata": ns["metadata"][row],
+                            **({"values": ns["matrix"][row].copy()} if include_values else {}),
+                        })
+
+        return [sorted(matches, key=lambda m: m["score"], reverse=True)[:top_k] for matches in per_query]
+
+    # Caller holds the lock
+    def save(self, namespace):
+        super().save(namespace)
+        ns = self.namespaces[namespace]
+        if ns["centroids"] is not None:
+            np.savez(os.path.join(self.folder, f"{namespace}.ivf.npz"),
+                     centroids=ns["centroids"], assign=ns["assign"], trained_size=ns["trained_size"])
+
+    def load(self, namespace):
+        super().load(namespace)
+        ns = self.namespaces[namespace]
+
+        file = os.path.join(self.folder, f"{namespace}.ivf.npz")
+        if os.path.exists(file):
+            saved = np.load(file)
+            if len(saved["assign"]) == len(ns["ids"]):
+                ns["centroids"] = saved["centroids"]
+                ns["assign"] = saved["assign"]
+                ns["trained_size"] = int(saved["trained_size"])
+                self.rebuild_lists(ns)
+                return
+
+        if len(ns["ids"]) >= self.min_train_size:
+            self.train(ns)